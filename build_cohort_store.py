@@ -0,0 +1,25 @@
+import os
+import argparse
+
+from processing.catalog import build_catalog
+from processing.cohort_store import ingest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Ingest every Oxysoft .txt / Artinis .mat recording of a study tree into one HDF5 cohort store.')
+    parser.add_argument('data_folder', help='Root of the study tree')
+    parser.add_argument('store_path', help='HDF5 cohort store to create or update')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of parsing processes')
+    args = parser.parse_args()
+
+    catalog_path = os.path.splitext(args.store_path)[0] + '_catalog.sqlite'
+    with build_catalog(args.data_folder, catalog_path) as catalog:
+        data_files = catalog.find(root=args.data_folder, fmt=['txt', 'mat'],
+                                  condition=['LongWalk_ST', 'LongWalk_DT'])
+
+    ingest(data_files, args.store_path, args.data_folder, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
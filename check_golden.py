@@ -0,0 +1,53 @@
+import sys
+import argparse
+
+import pandas as pd
+
+from processing.precision import DTYPES
+from processing.golden import STAGE_ENGINES, record_golden, resolve_engines, check_engines, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Store golden outputs of the reference processing stages and check faster engines against them.')
+    parser.add_argument('--golden-folder', default='golden', help='Folder of the golden outputs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help='Run the reference engines and store their outputs')
+    record.add_argument('files', nargs='*', help='Real .txt/.mat recordings to add to the synthetic corpus')
+
+    check = commands.add_parser('check', help='Compare engines against the stored golden outputs')
+    engine_help = ', '.join(f"{stage}: {'/'.join(engines)}" for stage, engines in STAGE_ENGINES.items())
+    check.add_argument('--engine', action='append', default=[],
+                       help=f"Engine for every stage that has it (e.g. vectorized) or for one stage "
+                            f"(e.g. fir=fft). Available: {engine_help}")
+    check.add_argument('--dtype', default='float64', choices=DTYPES,
+                       help='Floating point type to run the stages in, float32 is checked against the float64 goldens')
+    check.add_argument('--report', default=None, help='CSV file for the per channel and feature errors')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        names = record_golden(args.golden_folder, args.files)
+        print(f"Golden outputs of {len(names)} recordings saved to {args.golden_folder}")
+        return
+
+    engines = resolve_engines(args.engine)
+    report = check_engines(args.golden_folder, engines, dtype=args.dtype)
+    if args.report:
+        report.to_csv(args.report, index=False)
+        print(f"Error report saved to {args.report}")
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summarize(report).to_string(index=False))
+
+    failed = report[~report['Passed']]
+    if failed.empty:
+        print("All stages match the golden outputs within tolerance")
+        return
+    print(f"{len(failed)} channels or features exceed their tolerance:")
+    print(failed.to_string(index=False))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import os
+import sys
+import argparse
+
+from processing.import_time import HEAVY_MODULES, IMPORT_BUDGETS_MS, check_import
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that the entry points import quickly and do not load '
+                    f'{", ".join(HEAVY_MODULES)} at import time.')
+    parser.add_argument('modules', nargs='*', default=list(IMPORT_BUDGETS_MS),
+                        help='Entry point modules to check, all budgeted ones by default')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed imports per module, the fastest is kept')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports listed per module')
+    args = parser.parse_args()
+
+    # Top-level scripts are imported from the folder they live in
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    failed = False
+    for module in args.modules:
+        result = check_import(module, repeat=args.repeat, cwd=cwd)
+        budget = f"{result['budget_ms']:.0f} ms" if result['budget_ms'] is not None else 'no budget'
+        status = 'OK' if result['passed'] else 'FAIL'
+        print(f"{status:4s} {module}: {result['total_ms']:.0f} ms ({budget})")
+        if result['heavy']:
+            print(f"     imports {', '.join(result['heavy'])} at import time")
+        for name, self_ms in result['slowest'][:args.top]:
+            print(f"     {self_ms:8.1f} ms  {name}")
+        failed = failed or not result['passed']
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
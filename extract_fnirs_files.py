@@ -1,8 +1,9 @@
 import os
-import shutil
-import glob
 
-def extract_fnirs_files(base_dir, destination_dir):
+from processing.catalog import build_catalog
+from processing.sync import sync_files
+
+def extract_fnirs_files(base_dir, destination_dir, catalog_path=None, max_workers=8, checksum=False):
     """
     Searches for files matching 'Turn_*_LongWalk_ST.txt' and 'Turn_*_LongWalk_DT.txt'
     within the 'Baseline' and 'Pre' folders of each subject directory, and copies them
@@ -11,6 +12,12 @@ def extract_fnirs_files(base_dir, destination_dir):
     Parameters:
     - base_dir: The root directory to start the search.
     - destination_dir: The directory where the files will be copied.
+    - catalog_path: Optional. SQLite catalog of base_dir, kept in destination_dir by default.
+    - max_workers: Number of files copied concurrently.
+    - checksum: Compare checksums instead of size and mtime to skip up-to-date files.
+
+    Returns:
+    - Summary of copied, skipped and failed files (see processing.sync.sync_files).
     """
 
     # Ensure the destination directory exists
@@ -19,36 +26,29 @@ def extract_fnirs_files(base_dir, destination_dir):
     # Search patterns for the desired files
     target_patterns = ['Turn_*_LongWalk_ST.txt', 'Turn_*_LongWalk_DT.txt']
 
-    for subject_id in os.listdir(base_dir):
-        subject_path = os.path.join(base_dir, subject_id)
-        if os.path.isdir(subject_path) and subject_id.startswith('OHSU_Turn_'):
-            # Only look into 'Baseline' and 'Pre' folders under subject_path
-            for session_folder in ['Baseline', 'Pre']:
-                session_path = os.path.join(subject_path, session_folder)
-                if os.path.isdir(session_path):
-                    # Recursively search for target files within session_path
-                    for pattern in target_patterns:
-                        search_pattern = os.path.join(session_path, '**', pattern)
-                        matches = glob.glob(search_pattern, recursive=True)
-                        for file_path in matches:
-                            if os.path.isfile(file_path):
-                                # Extract the base filename
-                                filename = os.path.basename(file_path)
-                                # Construct the destination path with subdirectories
-                                subject_dest_dir = os.path.join(destination_dir, subject_id, session_folder)
-                                os.makedirs(subject_dest_dir, exist_ok=True)
-                                destination_file_path = os.path.join(subject_dest_dir, filename)
-                                # Copy the file without renaming
-                                shutil.copy2(file_path, destination_file_path)
-                                print(f"Copied {file_path} to {destination_file_path}")
-                            else:
-                                print(f"File {file_path} is not a regular file")
-                else:
-                    print(f"Session folder '{session_folder}' not found in {subject_path}")
-        else:
-            print(f"Skipping non-subject folder: {subject_id}")
+    # Walk the study tree once and query the catalog instead of globbing
+    # every subject and session folder separately
+    copy_pairs = []
+    if catalog_path is None:
+        catalog_path = os.path.join(destination_dir, 'fnirs_catalog.sqlite')
+    with build_catalog(base_dir, catalog_path, exclude=[destination_dir]) as catalog:
+        for pattern in target_patterns:
+            # Only look into 'Baseline' and 'Pre' folders of subject directories
+            for file_path in catalog.find(root=base_dir, session=['Baseline', 'Pre'], name_pattern=pattern):
+                record = catalog.get(file_path)
+                if record['subject'] is None:
+                    print(f"Skipping file outside of a subject folder: {file_path}")
+                    continue
+                # Construct the destination path with subdirectories, without renaming the file
+                destination_file_path = os.path.join(destination_dir, record['subject'], record['session'],
+                                                     record['name'])
+                copy_pairs.append((file_path, destination_file_path))
+
+    # Copy only the files that are missing or out of date at the destination
+    summary = sync_files(copy_pairs, max_workers=max_workers, checksum=checksum)
 
     print("Extraction complete.")
+    return summary
 
 def main():
     # Update the base directory to reflect the correct path
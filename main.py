@@ -1,27 +1,84 @@
 import os
+import argparse
+from functools import partial
+from concurrent.futures.process import BrokenProcessPool
+
 import pandas as pd
 
-from processing.process_file_bc import process_file
+from processing.process_file_bc import process_file, get_base_filename
+from processing.catalog import build_catalog
+from processing.manifest import Manifest, STATUS_DONE, STATUS_FAILED
+from processing.results_sink import ResultsSink, read_results, SOURCE_COLUMN, WRITTEN_COLUMN
+from processing.resampling_stats import paired_differences, subject_means, contrast_statistics
+from processing.plotting import PlotQueue
+from processing.report import build_report, panel_path
+from processing.instrumentation import Tracer, set_tracer, span
+from processing.batch import run_batch
+from processing.precision import DTYPES
+from processing.motion import METHODS
+from processing.connectivity import build_connectivity_store
+from processing.io_pipeline import OutputWriter
+from processing.readers import read_recording
+from processing.sharding import parse_shard, shard_files, shard_folder, shard_folders
+from processing.watcher import DirectoryWatcher, warm_up, warm_pool, watch
+
+# Analysis sampling rate, recordings at other rates are resampled to it
+NIRSsamprate = 50
+# Floating point type of the signals, 'float32' halves the memory per recording
+# (accumulations and statistics stay float64)
+precision = 'float64'
+# Motion correction: 'tddr' repairs every sample, 'spline' only corrects the
+# segments where motion is detected (cheaper on clean recordings, and the
+# segments are saved to _motion_qc.csv files), 'spline+tddr' does both
+motion_correction = 'tddr'
+# Set to True to compute channel x channel correlation and 0.01-0.1 Hz
+# coherence matrices of the walking segments (connectivity.h5)
+compute_connectivity = False
+# Set to a folder path to export the processed signals as SNIRF
+snirf_folder = None
+# Set to False to skip the per-file plots in batch runs
+make_plots = True
+# Set to False to skip the cohort HTML report
+make_report = True
+# Set to True to time every processing stage (stage_timings.csv, trace.json)
+trace_stages = False
+# Set to True to also measure the memory of every stage (slower)
+trace_memory = False
+# Number of files processed at once, and an optional memory budget in MB;
+# over budget, fewer files are processed at once and then in low-memory mode
+max_workers = 1
+memory_budget_mb = None
+# Number of files read ahead while a file is processed (one file at a time)
+prefetch_depth = 2
+# File extensions processed; files are read by the reader their header
+# matches (see processing.readers), so e.g. 'mat' or 'snirf' can be added
+input_formats = ['txt']
+# Watch mode (--watch): seconds a new file must stay unchanged before it is
+# processed, and seconds between checks of the data directory
+settle_seconds = 30
+poll_interval = 5
 
 # Initialize a list to store filenames with warnings
 warning_files = []
 
-def create_summary_sheets(combined_stats_df, output_folder):
-    # Filter for ST condition
-    summary_ST = combined_stats_df[combined_stats_df['Condition'] == 'LongWalk_ST']
-    # Select relevant columns
-    summary_ST = summary_ST[['Subject', 'Timepoint',
-                             'Overall grand oxy Mean',
-                             'First Half grand oxy Mean',
-                             'Second Half grand oxy Mean']]
-
-    # Filter for DT condition
-    summary_DT = combined_stats_df[combined_stats_df['Condition'] == 'LongWalk_DT']
-    # Select relevant columns
-    summary_DT = summary_DT[['Subject', 'Timepoint',
-                             'Overall grand oxy Mean',
-                             'First Half grand oxy Mean',
-                             'Second Half grand oxy Mean']]
+SUMMARY_COLUMNS = ['Subject', 'Timepoint',
+                   'Overall grand oxy Mean',
+                   'First Half grand oxy Mean',
+                   'Second Half grand oxy Mean']
+
+def create_summary_sheets(results_path, output_folder, source_files=None, stats_df=None):
+    if stats_df is not None:
+        # Rows already in memory, see update_results_cache
+        summary_ST = stats_df.loc[stats_df['Condition'] == 'LongWalk_ST', SUMMARY_COLUMNS]
+        summary_DT = stats_df.loc[stats_df['Condition'] == 'LongWalk_DT', SUMMARY_COLUMNS]
+    else:
+        # Read only the ST rows and the summary columns from the results dataset
+        summary_ST = read_results(results_path, filters={'Condition': 'LongWalk_ST'},
+                                  columns=SUMMARY_COLUMNS, sources=source_files)
+
+        # Read only the DT rows and the summary columns from the results dataset
+        summary_DT = read_results(results_path, filters={'Condition': 'LongWalk_DT'},
+                                  columns=SUMMARY_COLUMNS, sources=source_files)
 
     # Save to CSV files
     summary_ST_file = os.path.join(output_folder, 'summary_ST.csv')
@@ -33,52 +90,78 @@ def create_summary_sheets(combined_stats_df, output_folder):
     print(f"Summary ST saved to {summary_ST_file}")
     print(f"Summary DT saved to {summary_DT_file}")
 
-def main():
-    # Get the directory containing the .txt files from the user
-    dir_path = input('Enter the full path of the directory containing the .txt files: ')
-
-    if not os.path.isdir(dir_path):
-        print(f"Directory {dir_path} not found. Please ensure it exists.")
+def create_contrast_statistics(results_path, output_folder, source_files=None, stats_df=None):
+    """
+    Paired DT - ST permutation tests and bootstrap confidence intervals for
+    every statistics column, saved to contrast_statistics.csv. The differences
+    of a subject's timepoints are averaged so that every subject is one unit.
+    """
+    if stats_df is None:
+        stats_df = read_results(results_path, sources=source_files)
+    feature_columns = [col for col in stats_df.select_dtypes('number').columns if col != WRITTEN_COLUMN]
+    differences = paired_differences(stats_df, 'LongWalk_DT', 'LongWalk_ST', feature_columns=feature_columns)
+    if differences.empty:
+        print("No subjects with both ST and DT statistics, skipping contrast statistics.")
         return
 
-    # Create an output directory within the original directory
-    output_folder = os.path.join(dir_path, 'turning_bc_for_all')
-    os.makedirs(output_folder, exist_ok=True)
-    print(f"Results will be saved to {output_folder}")
+    contrast_df = contrast_statistics(subject_means(differences, feature_columns), feature_columns=feature_columns,
+                                      seed=0)
+    contrast_file = os.path.join(output_folder, 'contrast_statistics.csv')
+    contrast_df.to_csv(contrast_file, index=False)
+    print(f"DT vs ST contrast statistics saved to {contrast_file}")
 
-    # Collect all .txt files in dir_path and its subdirectories, excluding the output folder
-    txt_files = []
-    for root, dirs, files in os.walk(dir_path):
-        # Exclude the output folder
-        dirs[:] = [d for d in dirs if os.path.join(root, d) != output_folder]
-        for file in files:
-            if file.lower().endswith('.txt'):
-                txt_files.append(os.path.join(root, file))
+def rebuild_summaries(completed, results_path, output_folder, cache=None):
+    """
+    Rebuild the summary sheets from the stored per-file statistics of every
+    completed file, without recomputing anything.
 
-    if not txt_files:
-        print(f"No .txt files found in directory {dir_path} or its subdirectories.")
-        return
+    Parameters:
+    - completed: Manifest entries of the completed files of the cohort
+    - results_path: Results dataset, or a list of them (one per shard)
+    - output_folder: Directory for the summaries
+    - cache: Optional dictionary kept between calls, so that only the rows of
+      files completed since the last call are read, see update_results_cache
 
-    # Initialize list to collect stats DataFrames
-    all_stats = []
+    Returns:
+    - True if any statistics were combined, False otherwise
+    """
+    warning_files[:] = [entry['input'] for entry in completed if entry['outputs'].get('warning')]
+    if not completed:
+        return False
 
-    for file_path in txt_files:
-        stats_df, warning_occurred = process_file(file_path, output_folder, dir_path)
-        if stats_df is not None:
-            all_stats.append(stats_df)
-            if warning_occurred:
-                warning_files.append(file_path)
-
-    # After processing all files, combine the stats DataFrames
-    if all_stats:
-        combined_stats_df = pd.concat(all_stats, ignore_index=True)
-
-        # Create summary sheets
-        create_summary_sheets(combined_stats_df, output_folder)
-    else:
-        print("No data to combine.")
-        return
+    source_files = [entry['input'] for entry in completed]
+    stats_df = update_results_cache(cache, completed, results_path) if cache is not None else None
+    create_summary_sheets(results_path, output_folder, source_files=source_files, stats_df=stats_df)
+    create_contrast_statistics(results_path, output_folder, source_files=source_files, stats_df=stats_df)
+    return True
 
+def update_results_cache(cache, completed, results_path):
+    """
+    Bring an in-memory copy of the results rows of the completed files up to
+    date, reading only the rows of files that were added or reprocessed
+    since the last call.
+
+    Parameters:
+    - cache: Dictionary {source file: (manifest version, rows)}, updated in place
+    - completed: Manifest entries of the completed files of the cohort
+    - results_path: Results dataset, or a list of them (one per shard)
+
+    Returns:
+    - DataFrame of the rows of every completed file, in source file order
+    """
+    versions = {entry['input']: (entry['recorded_at'], entry['fingerprint']['sha1']) for entry in completed}
+    for source in set(cache) - set(versions):
+        del cache[source]
+    changed = [source for source, version in versions.items() if source not in cache or cache[source][0] != version]
+    if changed:
+        rows = read_results(results_path, sources=changed)
+        for source, group in rows.groupby(SOURCE_COLUMN, sort=False):
+            cache[source] = (versions[source], group)
+        print(f"Read the results of {len(changed)} new or reprocessed files")
+    frames = [cache[source][1] for source in sorted(versions) if source in cache]
+    return pd.concat(frames, ignore_index=True) if frames else read_results(results_path, sources=[])
+
+def write_warning_summary(output_folder):
     # After processing all files, write the summary of warnings if any
     if warning_files:
         summary_file = os.path.join(output_folder, 'warning_summary.txt')
@@ -90,7 +173,276 @@ def main():
     else:
         print("No 'invalid value encountered in divide' warnings were encountered during processing.")
 
+def default_output_folder(dir_path):
+    # Output directory within the original directory
+    return os.path.join(dir_path, 'turning_bc_for_all')
+
+def run(dir_path, output_folder=None, shard=None, workers=max_workers, memory_budget=memory_budget_mb,
+        dtype=precision, executor=None, only_files=None, summary_cache=None,
+        motion=motion_correction, connectivity=compute_connectivity):
+    """
+    Process the .txt files below dir_path and write the summaries.
+
+    With shard=(i, N) only the i-th of N size-balanced parts of the file list
+    is processed, into output_folder/shards/shard-i-of-N with its own
+    manifest and results dataset, e.g. as one job of a cluster array job.
+    Plots go to the shard folder and report panels to the shared report
+    folder. merge() then combines the shards into the cohort summaries.
+
+    motion is the motion correction, one of processing.motion.METHODS. With
+    connectivity=True the connectivity matrices of every file are collected
+    into output_folder/connectivity.h5.
+
+    executor, only_files and summary_cache are used by watch(): a running
+    worker pool, the files known to be completely written, and the results
+    rows kept between runs (see rebuild_summaries). With only_files, other
+    files are only processed if the manifest shows them unchanged since they
+    were last processed; new or changed files may still be being written
+    and are left for a later run.
+    """
+    output_folder = output_folder or default_output_folder(dir_path)
+    work_folder = shard_folder(output_folder, *shard) if shard else output_folder
+    os.makedirs(work_folder, exist_ok=True)
+    print(f"Results will be saved to {work_folder}")
+
+    # Collect all .txt files in dir_path and its subdirectories, excluding the output folder
+    with build_catalog(dir_path, os.path.join(work_folder, 'fnirs_catalog.sqlite'),
+                       exclude=[output_folder]) as catalog:
+        txt_files = catalog.find(root=dir_path, fmt=input_formats)
+
+    if not txt_files:
+        print(f"No .txt files found in directory {dir_path} or its subdirectories.")
+        return
+
+    if shard:
+        txt_files = shard_files(txt_files, *shard)
+        print(f"Shard {shard[0]}/{shard[1]}: {len(txt_files)} files")
+
+    tracer = Tracer(enabled=trace_stages, memory=trace_memory)
+    set_tracer(tracer)
+
+    # The manifest records every processed file so that a rerun only processes
+    # new, changed or previously failed files
+    manifest = Manifest(os.path.join(work_folder, 'manifest.jsonl'))
+    params = {'pipeline': 'bc', 'NIRSsamprate': NIRSsamprate, 'snirf_folder': snirf_folder, 'plots': make_plots,
+              'report': make_report, 'dtype': dtype, 'motion': motion,
+              'connectivity': connectivity}
+    if snirf_folder is not None:
+        os.makedirs(snirf_folder, exist_ok=True)
+    connectivity_folder = os.path.join(work_folder, 'connectivity') if connectivity else None
+    if connectivity_folder is not None:
+        os.makedirs(connectivity_folder, exist_ok=True)
+
+    # Statistics rows go to the results dataset through a background writer;
+    # a file is marked as done once its row has been written to disk
+    results_path = os.path.join(work_folder, 'results')
+    report_folder = os.path.join(output_folder, 'report') if make_report else None
+
+    def record_done(flushed):
+        for source, outputs in flushed:
+            manifest.record(source, params, STATUS_DONE, outputs=outputs)
+
+    def handle_result(file_path, result, error):
+        if error is not None:
+            print(f"Error processing file {file_path}: {str(error)}")
+            manifest.record(file_path, params, STATUS_FAILED, error=str(error))
+            return
+
+        stats_df, warning_occurred = result
+        if stats_df is None:
+            manifest.record(file_path, params, STATUS_FAILED, error='No statistics produced')
+            return
+
+        base_filename = get_base_filename(file_path, dir_path)
+        outputs = {
+            'results': results_path,
+            'warning': warning_occurred
+        }
+        if make_plots:
+            outputs['plot'] = os.path.join(work_folder, base_filename + '_mean_signals.png')
+        if snirf_folder is not None:
+            outputs['snirf'] = os.path.join(snirf_folder, base_filename + '_processed.snirf')
+        if report_folder is not None:
+            outputs['report_panel'] = panel_path(report_folder, base_filename)
+        if motion.startswith('spline'):
+            outputs['motion_qc'] = os.path.join(work_folder, base_filename + '_motion_qc.csv')
+        if connectivity_folder is not None:
+            outputs['connectivity'] = os.path.join(connectivity_folder, base_filename + '_connectivity.npz')
+
+        def record(write_error):
+            if write_error is not None:
+                print(f"Error writing the outputs of {file_path}: {write_error}")
+                manifest.record(file_path, params, STATUS_FAILED, error=str(write_error))
+            else:
+                results_sink.append(stats_df, source=file_path, payload=outputs)
+
+        # The statistics row is only stored once the outputs written in the
+        # background exist, the file is recorded as done once the row is
+        writer.when_done(file_path, record)
+
+    pending_files = []
+    for file_path in txt_files:
+        if only_files is not None and file_path not in only_files and not manifest.is_unchanged(file_path):
+            print(f"Skipping file not settled yet: {file_path}")
+        elif manifest.needs_processing(file_path, params):
+            pending_files.append(file_path)
+        else:
+            print(f"Skipping unchanged file: {file_path}")
+
+    # Plots are rendered by a separate worker process while the next file is
+    # processed; worker processes of a parallel run render their own plots.
+    # One file at a time, the next files are read and the outputs written on
+    # background threads while the current file is processed
+    with PlotQueue(enabled=make_plots and workers == 1) as plot_queue, \
+            ResultsSink(results_path, on_flush=record_done) as results_sink, \
+            OutputWriter(enabled=workers == 1) as writer:
+        process = partial(process_file, output_folder=work_folder, dir_path=dir_path,
+                          NIRSsamprate=NIRSsamprate, snirf_folder=snirf_folder, save_statistics=False,
+                          plot_queue=plot_queue if workers == 1 or not make_plots else None,
+                          report_folder=report_folder, dtype=dtype, writer=writer if workers == 1 else None,
+                          motion_correction=motion, connectivity_folder=connectivity_folder)
+        batch = run_batch(process, pending_files, handle_result, max_workers=workers,
+                          memory_budget_mb=memory_budget, prefetch=partial(read_recording, dtype=dtype),
+                          prefetch_depth=prefetch_depth, executor=executor)
+    if memory_budget:
+        print(f"Peak memory of the run: {batch['peak_rss_mb']:.0f} MB")
+
+    # Combine the stored per-file results of this and earlier runs; a shard
+    # only summarises its own files, the cohort report is built by merge()
+    completed = manifest.completed(txt_files)
+    with span('summaries'):
+        combined = rebuild_summaries(completed, results_path, work_folder, cache=summary_cache)
+    if not combined:
+        print("No data to combine.")
+        return
+
+    if connectivity_folder is not None:
+        with span('connectivity store'):
+            write_connectivity_store(completed, os.path.join(work_folder, 'connectivity.h5'), dir_path)
+
+    if report_folder is not None and not shard:
+        with span('report'):
+            build_cohort_report(report_folder, completed)
+
+    if tracer.enabled:
+        tracer.save_summary(os.path.join(work_folder, 'stage_timings.csv'))
+        tracer.save_chrome_trace(os.path.join(work_folder, 'trace.json'))
+
+    write_warning_summary(work_folder)
     print("Batch processing complete. All results have been saved.")
 
+def watch_folder(dir_path, output_folder=None, workers=max_workers, memory_budget=memory_budget_mb,
+                 dtype=precision, motion=motion_correction, connectivity=compute_connectivity):
+    """
+    Process new and changed recordings below dir_path as they are exported,
+    until interrupted with Ctrl+C.
+
+    Every time files settle (see processing.watcher.DirectoryWatcher), the
+    settled files the manifest shows new, changed or failed are processed and the
+    summaries and report updated, reading only the results of the files
+    processed since the last update. The processing modules and filter
+    designs are loaded once, and a worker pool is kept up between updates.
+    """
+    output_folder = output_folder or default_output_folder(dir_path)
+    os.makedirs(output_folder, exist_ok=True)
+    warm_up(NIRSsamprate)
+    pool = {'executor': warm_pool(workers, NIRSsamprate) if workers > 1 else None}
+    summary_cache = {}
+
+    def update(ready):
+        for _ in range(2):
+            try:
+                run(dir_path, output_folder, workers=workers, memory_budget=memory_budget, dtype=dtype,
+                    executor=pool['executor'], only_files=set(ready),
+                    summary_cache=summary_cache, motion=motion, connectivity=connectivity)
+                return
+            except BrokenProcessPool:
+                print("A worker process died, restarting the worker pool")
+                pool['executor'].shutdown(wait=False, cancel_futures=True)
+                pool['executor'] = warm_pool(workers, NIRSsamprate)
+
+    with DirectoryWatcher(dir_path, os.path.join(output_folder, 'fnirs_catalog.sqlite'), exclude=[output_folder],
+                          formats=input_formats, settle_seconds=settle_seconds,
+                          poll_interval=poll_interval) as watcher:
+        try:
+            watch(watcher, update)
+        finally:
+            if pool['executor'] is not None:
+                pool['executor'].shutdown(cancel_futures=True)
+
+def merge(dir_path, output_folder=None):
+    """
+    Combine the results of all shards of a sharded run into the cohort
+    summaries, contrast statistics, warning summary and report.
+    """
+    output_folder = output_folder or default_output_folder(dir_path)
+    folders = shard_folders(output_folder)
+    completed = []
+    for folder in folders:
+        completed.extend(Manifest(os.path.join(folder, 'manifest.jsonl')).completed())
+    print(f"Merging {len(completed)} completed files from {len(folders)} shards")
+
+    combined = rebuild_summaries(completed, [os.path.join(folder, 'results') for folder in folders], output_folder)
+    if not combined:
+        print("No data to combine.")
+        return
+
+    if any('connectivity' in entry['outputs'] for entry in completed):
+        write_connectivity_store(completed, os.path.join(output_folder, 'connectivity.h5'), dir_path)
+    if make_report:
+        build_cohort_report(os.path.join(output_folder, 'report'), completed)
+    write_warning_summary(output_folder)
+    print("Merge complete. All results have been saved.")
+
+def write_connectivity_store(completed, store_path, dir_path):
+    # One HDF5 store with the connectivity matrices of all completed sessions
+    build_connectivity_store({entry['input']: entry['outputs']['connectivity'] for entry in completed
+                              if 'connectivity' in entry['outputs']}, store_path, dir_path)
+
+def build_cohort_report(report_folder, completed):
+    # One HTML report for all completed sessions
+    build_report(report_folder, [entry['outputs']['report_panel'] for entry in completed
+                                 if 'report_panel' in entry['outputs']],
+                 title='Turning fNIRS cohort report')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Baseline-corrected turning pipeline: process every Oxysoft .txt file below a directory '
+                    'and summarise the statistics. Runs headless when the directory is given.')
+    parser.add_argument('dir_path', nargs='?', help='Directory containing the .txt files (prompted for if omitted)')
+    parser.add_argument('--output-folder', default=None, help='Output directory, <dir_path>/turning_bc_for_all by default')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='Only process shard i of N (0 <= i < N), e.g. $SLURM_ARRAY_TASK_ID/16')
+    parser.add_argument('--merge', action='store_true', help='Combine the results of all shards into the summaries')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and process new recordings as they are exported')
+    parser.add_argument('--workers', type=int, default=max_workers, help='Number of files processed at once')
+    parser.add_argument('--memory-budget-mb', type=float, default=memory_budget_mb, help='Memory budget in MB')
+    parser.add_argument('--precision', choices=DTYPES, default=precision, help='Floating point type of the signals')
+    parser.add_argument('--motion-correction', choices=METHODS, default=motion_correction,
+                        help="Motion correction: 'tddr' on every sample, or 'spline' on detected motion segments only")
+    parser.add_argument('--connectivity', action='store_true', default=compute_connectivity,
+                        help='Also compute channel correlation and coherence matrices of the walking segments')
+    args = parser.parse_args()
+
+    dir_path = args.dir_path
+    if dir_path is None:
+        # Get the directory containing the .txt files from the user
+        dir_path = input('Enter the full path of the directory containing the .txt files: ')
+
+    if not os.path.isdir(dir_path):
+        print(f"Directory {dir_path} not found. Please ensure it exists.")
+        return
+
+    if args.merge:
+        merge(dir_path, args.output_folder)
+    elif args.watch:
+        watch_folder(dir_path, args.output_folder, workers=args.workers, memory_budget=args.memory_budget_mb,
+                     dtype=args.precision, motion=args.motion_correction, connectivity=args.connectivity)
+    else:
+        run(dir_path, args.output_folder, shard=args.shard, workers=args.workers,
+            memory_budget=args.memory_budget_mb, dtype=args.precision, motion=args.motion_correction,
+            connectivity=args.connectivity)
+
 if __name__ == '__main__':
     main()
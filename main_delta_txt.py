@@ -1,49 +1,79 @@
 import os
+import argparse
+from functools import partial
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import warnings
-import glob
-from collections import defaultdict
-
-# Import processing modules
-from processing.read_txt import read_txt_file
-from processing.filter import fir_filter
-from processing.ssc_regression import ssc_regression
-from processing.tddr import tddr
-from processing.baseline import baseline_subtraction
-from processing.create_segments import create_segments
-from processing.nirs_statistics import calculate_statistics
-from processing.average_channels import average_channels
-from processing.process_file_delta_txt import process_file_delta_txt
-from processing.plot_mean_signals import plot_mean_signals
 
+# Import processing modules; scipy, matplotlib and h5py are only imported by
+# the stages that use them, see check_import_time.py
+from processing.process_file_delta_txt import process_file_delta_txt, extract_subject_condition, extract_timepoint
+from processing.process_file_bc import get_base_filename
+from processing.catalog import build_catalog
+from processing.manifest import Manifest, STATUS_DONE, STATUS_FAILED
+from processing.cohort_aggregator import CohortAggregator
+from processing.resampling_stats import subject_means, contrast_statistics
+from processing.plotting import PlotQueue
+from processing.report import build_report, panel_path
+from processing.instrumentation import Tracer, set_tracer, span
+from processing.batch import run_batch
+from processing.io_pipeline import OutputWriter
+from processing.readers import read_recording
+from processing.precision import DTYPES
+from processing.motion import METHODS
+from processing.sharding import parse_shard, shard_files, shard_folder, shard_folders
+from processing.watcher import DirectoryWatcher, warm_up, watch
 
-def main():
+
+def run(data_folder, output_folder, dir_path=None, shard=None, NIRSsamprate=50, precision='float64',
+        snirf_folder=None, make_plots=True, make_report=True, trace_stages=False, trace_memory=False,
+        max_workers=1, memory_budget_mb=None, prefetch_depth=2, only_files=None, summary_cache=None,
+        clear_logs=True, motion_correction='tddr'):
     """
-    Main function to process NIRS data files and generate analysis results.
+    Process the ST and DT files below data_folder and write the combined results.
+
+    With shard=(i, N) only the i-th of N size-balanced parts of the subjects
+    is processed, all files of a subject (ST and DT of every session) in the
+    same shard, into output_folder/shards/shard-i-of-N with its own manifest
+    and per-file results. merge() then combines the shards.
+
+    Parameters:
+        data_folder (str): Root of the study tree
+        output_folder (str): Output directory
+        dir_path (str): Base directory for relative paths, data_folder by default
+        shard (tuple): Optional (i, N) shard to process
+        NIRSsamprate (int): Analysis sampling rate, recordings at other rates are resampled to it
+        precision (str): Signal type, 'float32' halves the memory per recording (statistics stay float64)
+        snirf_folder (str): Optional folder to export the processed signals as SNIRF
+        make_plots (bool): Render the per-file plots
+        make_report (bool): Write the cohort HTML report
+        trace_stages (bool): Time every processing stage (stage_timings.csv, trace.json)
+        trace_memory (bool): Also measure the memory of every stage (slower)
+        max_workers (int): Number of files processed at once (threads)
+        memory_budget_mb (float): Over this budget, fewer files are processed at once, then in low-memory mode
+        prefetch_depth (int): Number of files read ahead while a file is processed (one file at a time)
+        only_files (set): Files known to be completely written, e.g. by a watcher; other files are only
+            processed if the manifest shows them unchanged since they were last processed (e.g. DT files
+            whose ST mean changed), new or changed ones are left for a later run
+        summary_cache (dict): Per-file results kept between runs, see load_combined_data
+        clear_logs (bool): Start new warning and excluded channel logs instead of appending to them
+        motion_correction (str): Motion correction, one of processing.motion.METHODS
     """
-    # Define paths and parameters
-    data_folder = '/Users/tsujik/Desktop/baseline_turning_nov7'  # Replace with your data folder path
-    output_folder = '/Users/tsujik/Desktop/baseline_turning_nov7/delta'  # Replace with your output folder path
-    dir_path = '/Users/tsujik/Desktop/baseline_turning_nov7'  # Base directory for relative paths
-    NIRSsamprate = 50  # Sampling rate
+    dir_path = dir_path or data_folder
+    work_folder = shard_folder(output_folder, *shard) if shard else output_folder
 
     # Ensure output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(work_folder, exist_ok=True)
 
     # Initialize data structures
-    st_data_dict = {}
     st_mean_hbo_dict = {}
-    all_snr_data = []
-    all_ratio_data = []
+    tracer = Tracer(enabled=trace_stages, memory=trace_memory)
+    set_tracer(tracer)
 
     # Define paths for warnings and channels excluded files
-    warnings_file = os.path.join(output_folder, 'warnings.txt')
-    channels_excluded_file = os.path.join(output_folder, 'channels_excluded.txt')
+    warnings_file = os.path.join(work_folder, 'warnings.txt')
+    channels_excluded_file = os.path.join(work_folder, 'channels_excluded.txt')
 
     # Clear previous warnings and channels excluded files if they exist
-    for file_path in [warnings_file, channels_excluded_file]:
+    for file_path in [warnings_file, channels_excluded_file] if clear_logs else []:
         try:
             with open(file_path, 'w') as f:
                 pass
@@ -52,19 +82,25 @@ def main():
 
     try:
         # Get a list of all data files to process (both .txt and .mat files)
-        txt_files = glob.glob(os.path.join(data_folder, '**', '*.txt'), recursive=True)
-        mat_files = glob.glob(os.path.join(data_folder, '**', '*.mat'), recursive=True)
-        data_files = txt_files + mat_files
+        # from a single cataloged walk of the data folder
+        with build_catalog(data_folder, os.path.join(work_folder, 'fnirs_catalog.sqlite'),
+                           exclude=[output_folder]) as catalog:
+            st_files = catalog.find(root=data_folder, condition='LongWalk_ST', fmt=['txt', 'mat'])
+            dt_files = catalog.find(root=data_folder, condition='LongWalk_DT', fmt=['txt', 'mat'])
+            data_files = catalog.find(root=data_folder, fmt=['txt', 'mat'])
 
         if not data_files:
             raise FileNotFoundError(f"No .txt or .mat files found in {data_folder}")
 
-        print(f"Found {len(data_files)} total files")
-
-        # Separate files into ST and DT
-        st_files = [f for f in data_files if 'LongWalk_ST' in f]
-        dt_files = [f for f in data_files if 'LongWalk_DT' in f]
+        if shard:
+            # The DT files of a subject are expressed relative to its ST mean
+            data_files = shard_files(data_files, *shard, group=lambda f: extract_subject_condition(f)[0])
+            shard_set = set(data_files)
+            st_files = [f for f in st_files if f in shard_set]
+            dt_files = [f for f in dt_files if f in shard_set]
+            print(f"Shard {shard[0]}/{shard[1]}")
 
+        print(f"Found {len(data_files)} total files")
         print(f"Found {len(st_files)} ST files and {len(dt_files)} DT files")
 
         # Print the first few files of each type for verification
@@ -75,61 +111,92 @@ def main():
         for f in dt_files[:3]:
             print(f"- {os.path.basename(f)}")
 
-        # Process all ST files first
-        print("\nProcessing ST files...")
-        for file_path in st_files:
-            try:
-                print(f"\nProcessing: {os.path.basename(file_path)}")
-                process_file_delta_txt(
-                    file_path=file_path,
-                    output_folder=output_folder,
-                    dir_path=dir_path,
-                    NIRSsamprate=NIRSsamprate,
-                    st_data_dict=st_data_dict,
-                    st_mean_hbo_dict=st_mean_hbo_dict,
-                    warnings_file=warnings_file,
-                    channels_excluded_file=channels_excluded_file,
-                    all_snr_data=all_snr_data,
-                    all_ratio_data=all_ratio_data
-                )
-            except Exception as e:
-                print(f"Error processing ST file {file_path}: {str(e)}")
-                with open(warnings_file, 'a') as f:
-                    f.write(f"Error processing ST file {file_path}: {str(e)}\n")
-                continue
-
-        # Now process all DT files
-        print("\nProcessing DT files...")
-        for file_path in dt_files:
-            try:
-                print(f"\nProcessing: {os.path.basename(file_path)}")
-                process_file_delta_txt(
-                    file_path=file_path,
-                    output_folder=output_folder,
-                    dir_path=dir_path,
-                    NIRSsamprate=NIRSsamprate,
-                    st_data_dict=st_data_dict,
-                    st_mean_hbo_dict=st_mean_hbo_dict,
-                    warnings_file=warnings_file,
-                    channels_excluded_file=channels_excluded_file,
-                    all_snr_data=all_snr_data,
-                    all_ratio_data=all_ratio_data
-                )
-            except Exception as e:
-                print(f"Error processing DT file {file_path}: {str(e)}")
-                with open(warnings_file, 'a') as f:
-                    f.write(f"Error processing DT file {file_path}: {str(e)}\n")
-                continue
-
-        # Save combined data
-        save_combined_data(all_snr_data, all_ratio_data, output_folder)
+        # The manifest records every processed file so that a rerun only
+        # processes new, changed or previously failed files
+        manifest = Manifest(os.path.join(work_folder, 'manifest.jsonl'))
+        per_file_folder = os.path.join(work_folder, 'per_file')
+        os.makedirs(per_file_folder, exist_ok=True)
+        params = {'pipeline': 'delta', 'NIRSsamprate': NIRSsamprate, 'snirf_folder': snirf_folder,
+                  'plots': make_plots, 'report': make_report, 'dtype': precision, 'motion': motion_correction}
+        report_folder = os.path.join(output_folder, 'report') if make_report else None
+        if snirf_folder is not None:
+            os.makedirs(snirf_folder, exist_ok=True)
+
+        # Restore the ST means of files completed by earlier runs, the DT
+        # condition is expressed relative to the mean of the same subject and timepoint
+        for entry in manifest.completed(st_files):
+            st_mean_hbo_dict[st_key(entry['input'])] = entry['outputs']['st_mean_hbo']
+
+        def dt_params(file_path):
+            # A DT file has to be reprocessed whenever the ST mean it depends on changes
+            return dict(params, st_mean_hbo=st_mean_hbo_dict.get(st_key(file_path)))
+
+        def pending(file_paths, label, file_params):
+            pending_files = []
+            for file_path in file_paths:
+                if (only_files is not None and file_path not in only_files
+                        and not manifest.is_unchanged(file_path)):
+                    print(f"Skipping {label} file not settled yet: {os.path.basename(file_path)}")
+                elif manifest.needs_processing(file_path, file_params(file_path)):
+                    pending_files.append(file_path)
+                else:
+                    print(f"Skipping unchanged {label} file: {os.path.basename(file_path)}")
+            return pending_files
+
+        def process_st(file_path, low_memory=False, recording=None):
+            process_and_record(file_path, 'ST', manifest, params, work_folder, per_file_folder,
+                               dir_path, NIRSsamprate, st_mean_hbo_dict,
+                               warnings_file, channels_excluded_file, snirf_folder, plot_queue,
+                               report_folder, low_memory, precision, recording, writer, motion_correction)
+
+        def process_dt(file_path, low_memory=False, recording=None):
+            process_and_record(file_path, 'DT', manifest, dt_params(file_path), work_folder, per_file_folder,
+                               dir_path, NIRSsamprate, st_mean_hbo_dict,
+                               warnings_file, channels_excluded_file, snirf_folder, plot_queue,
+                               report_folder, low_memory, precision, recording, writer, motion_correction)
+
+        def report_error(file_path, result, error):
+            if error is not None:
+                print(f"Error processing file {file_path}: {str(error)}")
+
+        # Plots are rendered by a separate worker process while the next file
+        # is processed. One file at a time, the next files are read and the
+        # outputs written on background threads as well
+        read_ahead = partial(read_recording, dtype=precision)
+        with PlotQueue(enabled=make_plots) as plot_queue, OutputWriter() as writer:
+            # Process all ST files first
+            print("\nProcessing ST files...")
+            run_batch(process_st, pending(st_files, 'ST', lambda f: params), report_error,
+                      max_workers=max_workers, memory_budget_mb=memory_budget_mb, use_processes=False,
+                      prefetch=read_ahead, prefetch_depth=prefetch_depth)
+
+            # Now process all DT files
+            print("\nProcessing DT files...")
+            run_batch(process_dt, pending(dt_files, 'DT', dt_params), report_error,
+                      max_workers=max_workers, memory_budget_mb=memory_budget_mb, use_processes=False,
+                      prefetch=read_ahead, prefetch_depth=prefetch_depth)
+
+        # Combine the stored per-file results of this and earlier runs; a shard
+        # only combines its own files, the cohort report is built by merge()
+        completed = manifest.completed(data_files)
+        with span('summaries'):
+            all_snr_data, all_ratio_data, cohort_aggregator = load_combined_data(completed, NIRSsamprate,
+                                                                                 cache=summary_cache)
+            save_combined_data(all_snr_data, all_ratio_data, work_folder)
+            cohort_aggregator.save_results(work_folder)
+        if report_folder is not None and not shard:
+            with span('report'):
+                build_cohort_report(report_folder, completed)
+        if tracer.enabled:
+            tracer.save_summary(os.path.join(work_folder, 'stage_timings.csv'))
+            tracer.save_chrome_trace(os.path.join(work_folder, 'trace.json'))
 
         # Print summary
         print("\nProcessing Summary:")
         print(f"Total files processed: {len(st_files) + len(dt_files)}")
         print(f"ST files processed: {len(st_files)}")
         print(f"DT files processed: {len(dt_files)}")
-        print(f"Subjects with ST data: {len(st_mean_hbo_dict)}")
+        print(f"Subject timepoints with ST data: {len(st_mean_hbo_dict)}")
         print(f"Total SNR records: {len(all_snr_data)}")
         print(f"Total ratio records: {len(all_ratio_data)}")
 
@@ -140,6 +207,305 @@ def main():
         raise
 
 
+def watch_folder(data_folder, output_folder, settle_seconds=30, poll_interval=5, **run_args):
+    """
+    Process new and changed recordings below data_folder as they are
+    exported, until interrupted with Ctrl+C.
+
+    Every time files settle (see processing.watcher.DirectoryWatcher), run()
+    processes the settled files the manifest shows new, changed or failed, including
+    DT files whose ST mean changed, and updates the combined results from
+    the per-file results kept in memory, reading only those of the files
+    processed since the last update. The processing modules and filter
+    designs are loaded once, before the first update.
+
+    Parameters:
+        data_folder (str): Root of the study tree
+        output_folder (str): Output directory
+        settle_seconds (float): Seconds a new file must stay unchanged before it is processed
+        poll_interval (float): Seconds between checks of the data folder
+        run_args: Other arguments of run()
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    warm_up(run_args.get('NIRSsamprate', 50))
+    summary_cache = {}
+    session = {'first_update': True}
+
+    def update(ready):
+        # The logs of a watch session cover all of its updates
+        run(data_folder, output_folder, only_files=set(ready), summary_cache=summary_cache,
+            clear_logs=session['first_update'], **run_args)
+        session['first_update'] = False
+
+    with DirectoryWatcher(data_folder, os.path.join(output_folder, 'fnirs_catalog.sqlite'), exclude=[output_folder],
+                          formats=['txt', 'mat'], settle_seconds=settle_seconds,
+                          poll_interval=poll_interval) as watcher:
+        watch(watcher, update)
+
+
+def merge(output_folder, NIRSsamprate=50, make_report=True):
+    """
+    Combine the per-file results of all shards of a sharded run into the
+    combined SNR, ratio and grand average files, the warning and excluded
+    channel logs and the cohort report.
+
+    Parameters:
+        output_folder (str): Output directory of the sharded run
+        NIRSsamprate (int): Analysis sampling rate of the run
+        make_report (bool): Write the cohort HTML report
+    """
+    folders = shard_folders(output_folder)
+    completed = []
+    for folder in folders:
+        completed.extend(Manifest(os.path.join(folder, 'manifest.jsonl')).completed())
+    print(f"Merging {len(completed)} completed files from {len(folders)} shards")
+
+    all_snr_data, all_ratio_data, cohort_aggregator = load_combined_data(completed, NIRSsamprate)
+    save_combined_data(all_snr_data, all_ratio_data, output_folder)
+    cohort_aggregator.save_results(output_folder)
+
+    for log_name in ['warnings.txt', 'channels_excluded.txt']:
+        with open(os.path.join(output_folder, log_name), 'w') as merged:
+            for folder in folders:
+                log_file = os.path.join(folder, log_name)
+                if os.path.isfile(log_file):
+                    with open(log_file, 'r') as f:
+                        merged.write(f.read())
+
+    if make_report:
+        build_cohort_report(os.path.join(output_folder, 'report'), completed)
+    print(f"Total SNR records: {len(all_snr_data)}")
+    print(f"Total ratio records: {len(all_ratio_data)}")
+
+
+def build_cohort_report(report_folder, completed):
+    # One HTML report for all completed sessions
+    build_report(report_folder, [entry['outputs']['report_panel'] for entry in completed
+                                 if 'report_panel' in entry['outputs']],
+                 title='Turning fNIRS delta cohort report')
+
+
+def main():
+    """
+    Main function to process NIRS data files and generate analysis results.
+    """
+    # Default paths, replace with your data and output folders or pass them on the command line
+    data_folder = '/Users/tsujik/Desktop/baseline_turning_nov7'
+    output_folder = '/Users/tsujik/Desktop/baseline_turning_nov7/delta'
+
+    parser = argparse.ArgumentParser(
+        description='Delta turning pipeline: process the ST and DT files below a data folder and '
+                    'combine the SNR, DT/ST ratios and grand averages.')
+    parser.add_argument('data_folder', nargs='?', default=data_folder, help='Root of the study tree')
+    parser.add_argument('output_folder', nargs='?', default=None,
+                        help='Output directory, <data_folder>/delta by default')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help="Only process shard i of N (0 <= i < N), a subject's files stay together, "
+                             "e.g. $SLURM_ARRAY_TASK_ID/16")
+    parser.add_argument('--merge', action='store_true', help='Combine the results of all shards')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and process new recordings as they are exported')
+    parser.add_argument('--settle-seconds', type=float, default=30,
+                        help='With --watch, seconds a new file must stay unchanged before it is processed')
+    parser.add_argument('--workers', type=int, default=1, help='Number of files processed at once (threads)')
+    parser.add_argument('--memory-budget-mb', type=float, default=None, help='Memory budget in MB')
+    parser.add_argument('--precision', choices=DTYPES, default='float64', help='Floating point type of the signals')
+    parser.add_argument('--snirf-folder', default=None, help='Export the processed signals as SNIRF to this folder')
+    parser.add_argument('--no-plots', action='store_true', help='Skip the per-file plots')
+    parser.add_argument('--no-report', action='store_true', help='Skip the cohort HTML report')
+    parser.add_argument('--trace', action='store_true', help='Time every processing stage')
+    parser.add_argument('--motion-correction', choices=METHODS, default='tddr',
+                        help="Motion correction: 'tddr' on every sample, or 'spline' on detected motion segments only")
+    args = parser.parse_args()
+
+    if args.output_folder is None:
+        args.output_folder = output_folder if args.data_folder == data_folder else os.path.join(args.data_folder, 'delta')
+
+    if args.merge:
+        merge(args.output_folder, make_report=not args.no_report)
+        return
+
+    run_args = dict(precision=args.precision, snirf_folder=args.snirf_folder, make_plots=not args.no_plots,
+                    make_report=not args.no_report, trace_stages=args.trace, max_workers=args.workers,
+                    memory_budget_mb=args.memory_budget_mb, motion_correction=args.motion_correction)
+    if args.watch:
+        watch_folder(args.data_folder, args.output_folder, settle_seconds=args.settle_seconds, **run_args)
+        return
+
+    run(args.data_folder, args.output_folder, shard=args.shard, **run_args)
+
+
+def st_key(file_path):
+    """
+    Key of the ST mean a recording is compared with.
+
+    Args:
+        file_path (str): Path to an ST or DT recording
+
+    Returns:
+        tuple: (subject_id, timepoint)
+    """
+    subject_id, _ = extract_subject_condition(file_path)
+    return subject_id, extract_timepoint(file_path)
+
+
+def process_and_record(file_path, label, manifest, params, output_folder, per_file_folder,
+                       dir_path, NIRSsamprate, st_mean_hbo_dict,
+                       warnings_file, channels_excluded_file, snirf_folder=None, plot_queue=None,
+                       report_folder=None, low_memory=False, dtype='float64', recording=None, writer=None,
+                       motion_correction='tddr'):
+    """
+    Process one file, store its SNR and ratio results as per-file CSVs and its
+    walking time series as grand average accumulators, and record the
+    outcome in the manifest. Callers skip files the manifest shows unchanged.
+
+    Parameters:
+        file_path (str): Data file to process
+        label (str): 'ST' or 'DT', used in messages
+        manifest (Manifest): Manifest of the output folder
+        params (dict): Processing parameters recorded with the file
+        per_file_folder (str): Directory for the per-file results
+        snirf_folder (str): Optional directory for SNIRF exports of the processed signals
+        plot_queue (PlotQueue): Optional queue that renders the plots
+        report_folder (str): Optional directory of the cohort report
+        low_memory (bool): Read the file without holding all of its lines in memory
+        dtype (str): Floating point type of the signals, 'float64' or 'float32'
+        recording (dict): Reader result of file_path if it has already been read
+        writer (OutputWriter): Optional writer of the outputs; the file is recorded as done once they are written
+        motion_correction (str): Motion correction, one of processing.motion.METHODS
+    """
+    file_snr_data = []
+    file_ratio_data = []
+    file_aggregator = new_cohort_aggregator(NIRSsamprate)
+    try:
+        print(f"\nProcessing: {os.path.basename(file_path)}")
+        process_file_delta_txt(
+            file_path=file_path,
+            output_folder=output_folder,
+            dir_path=dir_path,
+            NIRSsamprate=NIRSsamprate,
+            cohort_aggregator=file_aggregator,
+            st_mean_hbo_dict=st_mean_hbo_dict,
+            warnings_file=warnings_file,
+            channels_excluded_file=channels_excluded_file,
+            all_snr_data=file_snr_data,
+            all_ratio_data=file_ratio_data,
+            snirf_folder=snirf_folder,
+            plot_queue=plot_queue,
+            report_folder=report_folder,
+            low_memory=low_memory,
+            dtype=dtype,
+            recording=recording,
+            writer=writer,
+            motion_correction=motion_correction
+        )
+    except Exception as e:
+        print(f"Error processing {label} file {file_path}: {str(e)}")
+        with open(warnings_file, 'a') as f:
+            f.write(f"Error processing {label} file {file_path}: {str(e)}\n")
+        manifest.record(file_path, params, STATUS_FAILED, error=str(e))
+        return
+
+    # Both conditions produce SNR data on success, see warnings_file otherwise
+    if not file_snr_data:
+        manifest.record(file_path, params, STATUS_FAILED, error='No results produced')
+        return
+
+    base_filename = get_base_filename(file_path, dir_path)
+    outputs = {'snr': os.path.join(per_file_folder, base_filename + '_SNR.csv'),
+               'average': os.path.join(per_file_folder, base_filename + '_average.npz')}
+    if file_ratio_data:
+        outputs['ratios'] = os.path.join(per_file_folder, base_filename + '_ratios.csv')
+    if snirf_folder is not None:
+        outputs['snirf'] = os.path.join(snirf_folder, base_filename + '_processed.snirf')
+    if report_folder is not None:
+        outputs['report_panel'] = panel_path(report_folder, base_filename)
+    if motion_correction.startswith('spline'):
+        outputs['motion_qc'] = os.path.join(output_folder, base_filename + '_motion_qc.csv')
+    if label == 'ST':
+        outputs['st_mean_hbo'] = float(st_mean_hbo_dict[st_key(file_path)])
+
+    def save_outputs():
+        pd.concat(file_snr_data, ignore_index=True).to_csv(outputs['snr'], index=False)
+        file_aggregator.save_state(outputs['average'])
+        if file_ratio_data:
+            pd.DataFrame(file_ratio_data).to_csv(outputs['ratios'], index=False)
+        manifest.record(file_path, params, STATUS_DONE, outputs=outputs)
+
+    def record(write_error):
+        if write_error is not None:
+            print(f"Error writing the outputs of {label} file {file_path}: {write_error}")
+            manifest.record(file_path, params, STATUS_FAILED, error=str(write_error))
+        else:
+            save_outputs()
+
+    # Runs after the SNIRF export and report panel of the file have been written
+    if writer is not None:
+        writer.when_done(file_path, record)
+    else:
+        save_outputs()
+
+
+def new_cohort_aggregator(NIRSsamprate):
+    """
+    Create an aggregator for grand oxy/deoxy over the 120 s walking window.
+    """
+    return CohortAggregator(n_samples=int(120 * NIRSsamprate) + 1, sample_rate=NIRSsamprate)
+
+
+def load_combined_data(completed, NIRSsamprate, cache=None):
+    """
+    Load the stored per-file SNR and ratio results of every completed file and
+    merge their grand average accumulators, one file at a time.
+
+    Parameters:
+        completed (list): Manifest entries of the completed files of the cohort
+        NIRSsamprate (int): Sampling rate of the grand average grid
+        cache (dict): Optional {input file: (manifest version, SNR, ratios, accumulators)}
+            kept between calls, so that only the results of files added or
+            reprocessed since the last call are read from disk
+
+    Returns:
+        tuple: (list of SNR DataFrames, list of ratio dictionaries, CohortAggregator)
+    """
+    all_snr_data = []
+    all_ratio_data = []
+    cohort_aggregator = new_cohort_aggregator(NIRSsamprate)
+    # In input order, so the combined files do not depend on how the files were sharded
+    for entry in sorted(completed, key=lambda entry: entry['input']):
+        version = (entry['recorded_at'], entry['fingerprint']['sha1'])
+        if cache is not None and entry['input'] in cache and cache[entry['input']][0] == version:
+            _, snr, ratios, aggregator = cache[entry['input']]
+        else:
+            snr, ratios, aggregator = load_file_results(entry['outputs'])
+            if cache is not None:
+                cache[entry['input']] = (version, snr, ratios, aggregator)
+        all_snr_data.append(snr)
+        all_ratio_data.extend(ratios)
+        if aggregator is not None:
+            cohort_aggregator.merge(aggregator)
+    if cache is not None:
+        for input_file in set(cache) - {entry['input'] for entry in completed}:
+            del cache[input_file]
+    return all_snr_data, all_ratio_data, cohort_aggregator
+
+
+def load_file_results(outputs):
+    """
+    Load the SNR, ratio and grand average results stored for one file.
+
+    Parameters:
+        outputs (dict): Outputs recorded in the manifest entry of the file
+
+    Returns:
+        tuple: (SNR DataFrame, list of ratio dictionaries, CohortAggregator or None)
+    """
+    snr = pd.read_csv(outputs['snr'])
+    ratios = pd.read_csv(outputs['ratios']).to_dict('records') if 'ratios' in outputs else []
+    aggregator = CohortAggregator.load_state(outputs['average']) if 'average' in outputs else None
+    return snr, ratios, aggregator
+
+
 def save_combined_data(all_snr_data, all_ratio_data, output_folder):
     """
     Save combined SNR and ratio data to CSV files.
@@ -165,6 +531,18 @@ def save_combined_data(all_snr_data, all_ratio_data, output_folder):
             ratio_output_file = os.path.join(output_folder, 'combined_ratios.csv')
             combined_ratios.to_csv(ratio_output_file, index=False)
             print(f"Combined ratio data saved to {ratio_output_file}")
+
+            # The DT means are relative to the ST mean, so they are tested against 0. A subject's
+            # timepoints are averaged first so that every subject is one unit of the tests
+            ratio_columns = ['Mean_HbO_FirstHalf', 'Mean_HbO_SecondHalf', 'Mean_HbO_Overall']
+            ratio_stats = contrast_statistics(
+                subject_means(combined_ratios, ratio_columns),
+                feature_columns=ratio_columns,
+                seed=0
+            )
+            ratio_stats_file = os.path.join(output_folder, 'ratio_statistics.csv')
+            ratio_stats.to_csv(ratio_stats_file, index=False)
+            print(f"DT vs ST permutation tests and bootstrap CIs saved to {ratio_stats_file}")
         else:
             print("No ratio data to save")
 
@@ -0,0 +1,128 @@
+import time
+import argparse
+import multiprocessing
+
+import pandas as pd
+
+from processing.stream_source import ReplaySimulator, SocketSource
+from processing.online import OnlinePipeline
+
+# Seconds between the status lines printed while streaming
+status_interval = 1.0
+
+
+def stream(host, port, duration=None, output_file=None, channels_to_exclude=None):
+    """
+    Receive samples from a stream source, run them through the online chain
+    and print the rolling grand oxy/deoxy and the end-to-end latency.
+
+    Parameters:
+    - host, port: Address of the stream source
+    - duration: Optional number of seconds to stream, until the source stops by default
+    - output_file: Optional CSV file for every published update
+    - channels_to_exclude: Channel numbers left out of the regions
+
+    Returns:
+    - Latency summary, see LatencyMeter.summary()
+    """
+    # Loaded before connecting, a source sends samples as soon as a client connects
+    import scipy.signal  # noqa: F401
+
+    updates = []
+    with SocketSource(host, port) as source:
+        print(f"Receiving {len(source.channels)} channels at {source.sample_rate} Hz from {host}:{port}")
+        pipeline = OnlinePipeline(source.channels, source.sample_rate, channels_to_exclude=channels_to_exclude)
+        if output_file is not None:
+            pipeline.subscribe(updates.append)
+        pipeline.subscribe(_StatusPrinter(pipeline))
+        start = time.time()
+        try:
+            for samples, acquired_at, values in source.batches():
+                pipeline.push(samples, acquired_at, values)
+                if duration is not None and time.time() - start >= duration:
+                    break
+        except KeyboardInterrupt:
+            print("Stopped streaming.")
+
+    summary = pipeline.latency.summary()
+    if summary['count']:
+        print(f"End-to-end latency over {summary['count']} updates: median {summary['p50_ms']:.2f} ms, "
+              f"95th percentile {summary['p95_ms']:.2f} ms, 99th percentile {summary['p99_ms']:.2f} ms, "
+              f"max {summary['max_ms']:.2f} ms")
+    if output_file is not None:
+        pd.DataFrame(updates).to_csv(output_file, index=False)
+        print(f"Streamed results saved to {output_file}")
+    return summary
+
+
+class _StatusPrinter:
+    # Prints the latest update every status_interval seconds of signal
+    def __init__(self, pipeline):
+        self.every = max(int(status_interval * pipeline.sample_rate), 1)
+
+    def __call__(self, update):
+        if update['sample'] % self.every:
+            return
+        print(f"t={update['time']:7.1f} s  grand oxy {update['grand oxy']:+.4f} "
+              f"(rolling {update['rolling grand oxy']:+.4f})  grand deoxy {update['grand deoxy']:+.4f} "
+              f"(rolling {update['rolling grand deoxy']:+.4f})  latency {update['latency_ms']:.2f} ms")
+
+
+def serve(file_path, host, port, speed=1.0, loop=False, ready=None):
+    """
+    Replay an exported recording as a stream source until interrupted.
+    """
+    with ReplaySimulator(file_path, host=host, port=port, loop=loop, speed=speed) as simulator:
+        if ready is not None:
+            ready.put(simulator.address)
+        print(f"Replaying {file_path} on {simulator.address[0]}:{simulator.address[1]}")
+        try:
+            simulator.serve()
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Live pipeline: receive streamed samples, apply a causal bandpass, short channel regression '
+                    'and region averaging, and publish the rolling grand oxy/deoxy with its latency.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--simulate', metavar='FILE',
+                        help='Replay this Oxysoft .txt export from a local stand-in source and stream it')
+    source.add_argument('--serve', metavar='FILE', help='Only run the stand-in source replaying this export')
+    source.add_argument('--connect', action='store_true', help='Stream from the source at --host/--port')
+    parser.add_argument('--host', default='127.0.0.1', help='Host of the stream source')
+    parser.add_argument('--port', type=int, default=0, help='Port of the stream source (any free port with --simulate)')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed of the stand-in source, 1 = real time')
+    parser.add_argument('--loop', action='store_true', help='Replay the export over and over')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to stream, until the source stops by default')
+    parser.add_argument('--exclude-channels', type=int, nargs='*', default=None,
+                        help='Channel numbers left out of the regions')
+    parser.add_argument('--output', default=None, help='CSV file for every published update')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.host, args.port, speed=args.speed, loop=args.loop)
+        return
+
+    host, port = args.host, args.port
+    simulator = None
+    if args.simulate:
+        # The stand-in source runs in its own process, like the acquisition software would
+        ready = multiprocessing.Queue()
+        simulator = multiprocessing.Process(target=serve, args=(args.simulate, args.host, args.port),
+                                            kwargs={'speed': args.speed, 'loop': args.loop, 'ready': ready},
+                                            daemon=True)
+        simulator.start()
+        host, port = ready.get(timeout=60)
+    try:
+        stream(host, port, duration=args.duration, output_file=args.output,
+               channels_to_exclude=args.exclude_channels)
+    finally:
+        if simulator is not None:
+            simulator.terminate()
+            simulator.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 import pandas as pd
 import numpy as np
 
+# Channels averaged into each hemisphere
+LEFT_CHANNELS = [4, 5, 6]
+RIGHT_CHANNELS = [1, 2, 3]
+ROI_COLUMNS = ['left oxy', 'left deoxy', 'right oxy', 'right deoxy', 'grand oxy', 'grand deoxy']
+
 def average_channels(df: pd.DataFrame, channels_to_exclude=None) -> pd.DataFrame:
     if not isinstance(df, pd.DataFrame):
         raise TypeError(f"Must provide a DataFrame, not {type(df)}")
@@ -9,8 +14,8 @@ def average_channels(df: pd.DataFrame, channels_to_exclude=None) -> pd.DataFrame
     df_copy = df.copy()
 
     # Define hemisphere channels
-    left_channels = [ch for ch in [4, 5, 6] if ch not in channels_to_exclude]
-    right_channels = [ch for ch in [1, 2, 3] if ch not in channels_to_exclude]
+    left_channels = [ch for ch in LEFT_CHANNELS if ch not in channels_to_exclude]
+    right_channels = [ch for ch in RIGHT_CHANNELS if ch not in channels_to_exclude]
 
     # Build columns
     left_hbo_cols = [f'CH{ch} HbO' for ch in left_channels if f'CH{ch} HbO' in df_copy.columns]
@@ -31,3 +36,38 @@ def average_channels(df: pd.DataFrame, channels_to_exclude=None) -> pd.DataFrame
     })
 
     return ret_df
+
+def roi_weights(columns, channels_to_exclude=None) -> pd.DataFrame:
+    """
+    Weights that average channel columns into the regions of average_channels.
+
+    data[columns] @ weights gives the ROI_COLUMNS averages of average_channels
+    for data without missing values, e.g. for one streamed sample at a time.
+
+    Parameters:
+    - columns: Channel column names, e.g. ['CH1 HbO', 'CH1 HbR', ...]
+    - channels_to_exclude: Channel numbers left out of the averages
+
+    Returns:
+    - DataFrame of weights with one row per column and one column per ROI
+    """
+    channels_to_exclude = channels_to_exclude or []
+    left_channels = [ch for ch in LEFT_CHANNELS if ch not in channels_to_exclude]
+    right_channels = [ch for ch in RIGHT_CHANNELS if ch not in channels_to_exclude]
+    regions = {
+        'left oxy': [f'CH{ch} HbO' for ch in left_channels],
+        'left deoxy': [f'CH{ch} HbR' for ch in left_channels],
+        'right oxy': [f'CH{ch} HbO' for ch in right_channels],
+        'right deoxy': [f'CH{ch} HbR' for ch in right_channels],
+        'grand oxy': [f'CH{ch} HbO' for ch in left_channels + right_channels],
+        'grand deoxy': [f'CH{ch} HbR' for ch in left_channels + right_channels],
+    }
+    weights = pd.DataFrame(0.0, index=list(columns), columns=ROI_COLUMNS)
+    for region, region_cols in regions.items():
+        region_cols = [col for col in region_cols if col in weights.index]
+        if region_cols:
+            weights.loc[region_cols, region] = 1.0 / len(region_cols)
+        else:
+            # Like the mean of no columns in average_channels
+            weights[region] = np.nan
+    return weights
@@ -9,8 +9,9 @@ def baseline_subtraction(df: pd.DataFrame, events_df: pd.DataFrame, baseline_df:
         # Use the provided baseline_df to compute the baseline mean
         for ch in corrected_df.columns:
             if ch not in ['Sample number', 'Event', 'Time (s)']:
-                baseline_mean = baseline_df[ch].mean()
-                corrected_df[ch] = corrected_df[ch] - baseline_mean
+                baseline_mean = baseline_df[ch].astype('float64').mean()
+                # A Python float keeps float32 channels float32
+                corrected_df[ch] = corrected_df[ch] - float(baseline_mean)
     else:
         if len(events_df) != 3:
             raise ValueError(
@@ -33,8 +34,8 @@ def baseline_subtraction(df: pd.DataFrame, events_df: pd.DataFrame, baseline_df:
             if ch not in ['Sample number', 'Event', 'Time (s)']:
                 # Calculate the mean during the baseline period
                 quiet_stance = corrected_df.loc[start:end, ch]
-                quiet_stance_mean = quiet_stance.mean()
-                # Subtract the mean from the entire signal
-                corrected_df[ch] = corrected_df[ch] - quiet_stance_mean
+                quiet_stance_mean = quiet_stance.astype('float64').mean()
+                # Subtract the mean from the entire signal, a Python float keeps float32 channels float32
+                corrected_df[ch] = corrected_df[ch] - float(quiet_stance_mean)
 
     return corrected_df
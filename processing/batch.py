@@ -0,0 +1,120 @@
+from functools import partial
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from processing.memory import MemoryGovernor, MB
+from processing.io_pipeline import Prefetcher
+
+
+def run_batch(process, items, on_result, max_workers: int = 1, memory_budget_mb: float = None,
+              use_processes: bool = True, prefetch=None, prefetch_depth: int = 2, executor=None) -> dict:
+    """
+    Process items with up to max_workers workers under an optional memory budget.
+
+    process(item, low_memory=...) is run for every item and on_result(item,
+    result, error) is called in the calling thread as each one finishes, with
+    error set to the exception if process raised. When the RSS of the run
+    (including worker processes) exceeds memory_budget_mb, the runner first
+    runs fewer items at once and, at one item at a time, switches the
+    remaining items to low_memory=True instead of letting the job be killed.
+
+    With max_workers=1 items are processed in the calling process, so
+    tracer spans and plot queues of the caller keep working.
+
+    When items are processed one at a time and prefetch is given, the next
+    prefetch_depth items are read by prefetch(item, low_memory=...) on I/O
+    threads while the current one is processed, and process is called as
+    process(item, low_memory=..., recording=...) with what was read. If the
+    read failed, recording is None and process reads the item itself, so
+    read errors are reported as usual. Reading ahead stops once the run
+    switches to low-memory processing. Worker pools already overlap the
+    reads of different items and do not prefetch.
+
+    An executor passed in, e.g. a pool whose workers have already imported
+    the processing modules (see processing.watcher.warm_pool), is used for
+    max_workers > 1 instead of starting a new one, and is left running.
+
+    Parameters:
+    - process: Callable process(item, low_memory=False), picklable when use_processes is True
+    - items: Items to process, e.g. file paths
+    - on_result: Callable on_result(item, result, error)
+    - max_workers: Maximum number of items processed at once
+    - memory_budget_mb: Optional memory budget in MB
+    - use_processes: Use worker processes (True) or threads (False) when max_workers > 1
+    - prefetch: Optional callable prefetch(item, low_memory=False) that reads an item ahead of process
+    - prefetch_depth: Number of items read ahead
+    - executor: Optional running executor to submit the items to when max_workers > 1
+
+    Returns:
+    - Dictionary with the final 'workers', 'low_memory' and the 'peak_rss_mb' of the run
+    """
+    governor = MemoryGovernor(memory_budget_mb) if memory_budget_mb else None
+    state = {'workers': max(int(max_workers), 1), 'low_memory': False}
+
+    def check_budget():
+        if governor is None or not governor.over_budget():
+            return
+        if state['workers'] > 1:
+            state['workers'] -= 1
+            print(f"Memory budget of {memory_budget_mb} MB exceeded, reducing to {state['workers']} workers")
+        elif not state['low_memory']:
+            state['low_memory'] = True
+            print(f"Memory budget of {memory_budget_mb} MB exceeded, switching to low-memory processing")
+
+    stack = ExitStack()
+    try:
+        items = iter(items)
+        if state['workers'] == 1 and prefetch is not None:
+            prefetcher = Prefetcher(lambda item: prefetch(item, low_memory=state['low_memory']), items,
+                                    depth=prefetch_depth)
+            for item, recording, _ in prefetcher:
+                _run_one(partial(process, recording=recording), item, state['low_memory'], on_result)
+                del recording
+                check_budget()
+                if state['low_memory']:
+                    prefetcher.depth = 0
+        elif state['workers'] == 1:
+            for item in items:
+                _run_one(process, item, state['low_memory'], on_result)
+                check_budget()
+        else:
+            if executor is None:
+                executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+                executor = stack.enter_context(executor_class(max_workers=state['workers']))
+            with stack:
+                running = {}
+                exhausted = False
+                while running or not exhausted:
+                    while not exhausted and len(running) < state['workers']:
+                        item = next(items, _END)
+                        if item is _END:
+                            exhausted = True
+                            break
+                        running[executor.submit(process, item, low_memory=state['low_memory'])] = item
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = running.pop(future)
+                        error = future.exception()
+                        on_result(item, None if error else future.result(), error)
+                    check_budget()
+    finally:
+        if governor is not None:
+            governor.close()
+
+    state['peak_rss_mb'] = governor.run_peak_rss / MB if governor is not None else None
+    return state
+
+
+_END = object()
+
+
+def _run_one(process, item, low_memory, on_result):
+    try:
+        result = process(item, low_memory=low_memory)
+    except Exception as e:
+        on_result(item, None, e)
+        return
+    on_result(item, result, None)
+
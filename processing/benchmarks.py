@@ -0,0 +1,161 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import warnings
+import contextlib
+
+import numpy as np
+
+from processing.synthetic import synthetic_recording, write_oxysoft_txt, write_artinis_mat
+from processing.read_txt import read_txt_file
+from processing.read_mat import read_mat
+from processing.resample import resample_recording
+from processing.filter import fir_filter
+from processing.ssc_regression import ssc_regression
+from processing.tddr import tddr
+from processing.motion import detect_motion, spline_correct
+from processing.connectivity import segment_connectivity
+from processing.baseline import baseline_subtraction
+from processing.average_channels import average_channels
+from processing.plotting import PlotQueue
+
+# Recording durations in seconds benchmarked by default
+DEFAULT_DURATIONS = (120, 300, 900)
+SAMPLE_RATE = 50
+
+SHORT_CHANNELS = ['Rx2-Tx7 O2Hb', 'Rx2-Tx7 HHb', 'Rx2-Tx8 O2Hb', 'Rx2-Tx8 HHb']
+
+
+def stage_benchmarks(duration: float, workdir: str) -> dict:
+    """
+    Build the benchmarks of every stage on a synthetic recording of duration
+    seconds.
+
+    Returns:
+    - {name: callable} where each callable runs the stage once
+    """
+    # Imported here because both modules import this package's readers and plotting
+    from processing.process_file_bc import process_file
+    from processing.process_file_delta_txt import process_file_delta_txt
+
+    recording = synthetic_recording(duration=duration, sample_rate=SAMPLE_RATE, seed=0)
+    subject = 'OHSU_Turn_900'
+    txt_path = os.path.join(workdir, subject, 'Baseline', f'{subject}_LongWalk_ST_converted.txt')
+    mat_path = os.path.join(workdir, subject, 'Baseline', f'{subject}_LongWalk_ST_converted.mat')
+    write_oxysoft_txt(txt_path, recording, SAMPLE_RATE)
+    write_artinis_mat(mat_path, recording, SAMPLE_RATE)
+    output_folder = os.path.join(workdir, 'output')
+    os.makedirs(output_folder, exist_ok=True)
+
+    df = read_txt_file(txt_path)['data']
+    data_columns = [col for col in df.columns if col not in ['Sample number', 'Event']]
+    long_columns = [col for col in data_columns if col not in SHORT_CHANNELS]
+    signals = df[data_columns].astype('float64')
+    events_df = df.loc[df['Event'].notna(), ['Sample number', 'Event']].reset_index(drop=True)
+    events_df['Sample number'] -= df['Sample number'].iloc[0]
+    baseline_input = signals.reset_index(drop=True)
+    # average_channels works on the renamed CH<n> HbO/HbR columns of the bc pipeline
+    averaged_input = baseline_input.copy()
+    averaged_input.columns = [f'CH{i // 2 + 1} {"HbO" if i % 2 == 0 else "HbR"}' for i in range(len(data_columns))]
+    averaged_input['Sample number'] = df['Sample number'].to_numpy()
+    averaged_input['Event'] = df['Event'].to_numpy()
+    no_plots = PlotQueue(enabled=False)
+    motion_mask = detect_motion(signals, SAMPLE_RATE)
+
+    return {
+        'read_txt_file': lambda: read_txt_file(txt_path),
+        'read_txt_file low_memory': lambda: read_txt_file(txt_path, low_memory=True),
+        'read_txt_file float32': lambda: read_txt_file(txt_path, low_memory=True, dtype='float32'),
+        'read_mat': lambda: read_mat(mat_path),
+        'resample_recording': lambda: resample_recording(df, SAMPLE_RATE, 10),
+        'fir_filter': lambda: fir_filter(signals, order=1000, Wn=[0.01, 0.1], fs=SAMPLE_RATE),
+        'ssc_regression': lambda: ssc_regression(signals[long_columns], signals[SHORT_CHANNELS]),
+        'tddr': lambda: tddr(signals, SAMPLE_RATE),
+        'detect_motion': lambda: detect_motion(signals, SAMPLE_RATE),
+        'spline_correct': lambda: spline_correct(signals, motion_mask, SAMPLE_RATE),
+        'baseline_subtraction': lambda: baseline_subtraction(baseline_input, events_df),
+        'average_channels': lambda: average_channels(averaged_input),
+        'segment_connectivity': lambda: segment_connectivity({'Overall': averaged_input}, SAMPLE_RATE),
+        'process_file': lambda: process_file(txt_path, output_folder, workdir, NIRSsamprate=SAMPLE_RATE,
+                                             plot_queue=no_plots),
+        'process_file float32': lambda: process_file(txt_path, output_folder, workdir, NIRSsamprate=SAMPLE_RATE,
+                                                     plot_queue=no_plots, dtype='float32'),
+        'process_file spline': lambda: process_file(txt_path, output_folder, workdir, NIRSsamprate=SAMPLE_RATE,
+                                                    plot_queue=no_plots, motion_correction='spline'),
+        'process_file_delta_txt': lambda: process_file_delta_txt(
+            txt_path, output_folder, workdir, NIRSsamprate=SAMPLE_RATE, st_mean_hbo_dict={},
+            warnings_file=os.path.join(output_folder, 'warnings.txt'), plot_queue=no_plots),
+    }
+
+
+def run_benchmarks(workdir: str, durations=DEFAULT_DURATIONS, repeat: int = 5, name_filter: str = None) -> dict:
+    """
+    Time every stage benchmark repeat times per recording duration.
+
+    Returns:
+    - {'environment': {...}, 'results': {'<stage>[<duration>s]': {'min': s, 'median': s, 'repeat': n}}}
+    """
+    results = {}
+    for duration in durations:
+        benchmarks = stage_benchmarks(duration, os.path.join(workdir, f'{duration}s'))
+        for name, benchmark in benchmarks.items():
+            if name_filter and name_filter not in name:
+                continue
+            times = []
+            # Silence the progress messages and warnings of the stages
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                benchmark()  # Warm up caches and imports
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    benchmark()
+                    times.append(time.perf_counter() - start)
+            key = f'{name}[{duration:g}s]'
+            results[key] = {'min': min(times), 'median': float(np.median(times)), 'repeat': repeat}
+            print(f"{key:45s} min {min(times) * 1000:10.2f} ms   median {np.median(times) * 1000:10.2f} ms")
+    return {'environment': environment(), 'results': results}
+
+
+def environment() -> dict:
+    import scipy
+    import pandas
+    return {
+        'machine': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'pandas': pandas.__version__,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> list:
+    """
+    Compare the minimum times of results against a stored baseline.
+
+    Returns:
+    - List of (benchmark, baseline seconds, current seconds, relative change)
+      for every benchmark slower than the baseline by more than threshold
+    """
+    regressions = []
+    for key, current in results['results'].items():
+        previous = baseline['results'].get(key)
+        if previous is None:
+            continue
+        change = current['min'] / previous['min'] - 1
+        if change > threshold:
+            regressions.append((key, previous['min'], current['min'], change))
+    return regressions
+
+
+def save_results(results: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from processing.precision import ACCUMULATOR
+
 def calculate_snr(walking_data, hbo_columns):
     """
     Calculates the SNR for each HbO channel in the walking_data DataFrame.
@@ -15,8 +17,8 @@ def calculate_snr(walking_data, hbo_columns):
     snr_list = []
     for col in hbo_columns:
         signal = walking_data[col].values
-        mean_signal = np.mean(signal)
-        std_signal = np.std(signal)
+        mean_signal = np.mean(signal, dtype=ACCUMULATOR)
+        std_signal = np.std(signal, dtype=ACCUMULATOR)
         if std_signal != 0:
             snr = mean_signal / std_signal
         else:
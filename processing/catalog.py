@@ -0,0 +1,257 @@
+import os
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+SESSIONS = ['Baseline', 'Pre', 'Post']
+CONDITIONS = ['LongWalk_ST', 'LongWalk_DT']
+SUBJECT_PREFIX = 'OHSU_Turn_'
+DATA_EXTENSIONS = ('.txt', '.mat', '.snirf')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    subject TEXT,
+    session TEXT,
+    condition TEXT,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_subject_session_condition ON files (subject, session, condition);
+CREATE INDEX IF NOT EXISTS files_format ON files (format);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+"""
+
+
+def parse_recording_path(file_path: str, root: str) -> dict:
+    """
+    Parse subject ID, session, condition and format from a file path.
+
+    The subject is the first folder starting with 'OHSU_Turn_', the session the
+    first 'Baseline', 'Pre' or 'Post' folder below it, and the condition is
+    taken from the file name. Parts that cannot be found are None.
+
+    Parameters:
+    - file_path: Path to the file
+    - root: Root of the study tree
+
+    Returns:
+    - Dictionary with 'subject', 'session', 'condition' and 'format'
+    """
+    parts = os.path.relpath(file_path, root).split(os.sep)
+    folders, filename = parts[:-1], parts[-1]
+
+    subject = None
+    session = None
+    for part in folders:
+        if subject is None and part.startswith(SUBJECT_PREFIX):
+            subject = part
+        elif session is None and part in SESSIONS:
+            session = part
+
+    condition = None
+    for cond in CONDITIONS:
+        if cond in filename:
+            condition = cond
+            break
+
+    return {
+        'subject': subject,
+        'session': session,
+        'condition': condition,
+        'format': os.path.splitext(filename)[1].lower().lstrip('.'),
+    }
+
+
+class Catalog:
+    """
+    Indexed SQLite catalog of the data files in a study tree.
+
+    The tree is walked once with os.scandir and every data file is stored with
+    its subject, session, condition, format, size and mtime. On refresh, a
+    directory whose mtime is unchanged is not listed again: its files and
+    subdirectories are taken from the catalog and only the subdirectories are
+    stat'ed. Note that editing a file in place does not change its directory's
+    mtime, so the stored size/mtime of such a file is only updated once the
+    directory itself changes.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self, root: str, workers: int = 8, exclude=(), extensions=DATA_EXTENSIONS,
+                verbose: bool = True, full: bool = False) -> dict:
+        """
+        Bring the catalog of root up to date.
+
+        Parameters:
+        - root: Root of the study tree
+        - workers: Number of threads walking the top-level subdirectories in parallel
+        - exclude: Directories to leave out of the walk (e.g. output folders)
+        - extensions: File extensions to catalog
+        - verbose: Print the number of scanned and unchanged directories
+        - full: List every directory, also the unchanged ones, which updates
+          the size and mtime of files rewritten in place
+
+        Returns:
+        - Dictionary with the number of 'scanned' and 'reused' directories
+        """
+        root = os.path.abspath(root)
+        exclude = {os.path.abspath(d) for d in exclude}
+        cached = {
+            path: (mtime_ns, json.loads(subdirs))
+            for path, mtime_ns, subdirs in self.conn.execute(
+                "SELECT path, mtime_ns, subdirs FROM dirs WHERE root = ?", (root,))
+        }
+
+        reused = {} if full else cached
+
+        # Scan the root itself, then fan out over its subdirectories
+        records = []
+        top_subdirs = _scan_dir(root, os.stat(root).st_mtime_ns, reused, exclude, extensions, records)
+        if workers > 1 and len(top_subdirs) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for sub_records in executor.map(lambda d: _scan_tree(d, reused, exclude, extensions), top_subdirs):
+                    records.extend(sub_records)
+        else:
+            for d in top_subdirs:
+                records.extend(_scan_tree(d, reused, exclude, extensions))
+
+        scanned = 0
+        visited = set()
+        with self.conn:
+            for dir_path, mtime_ns, subdirs, files in records:
+                visited.add(dir_path)
+                if files is None:
+                    continue
+                scanned += 1
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+                self.conn.executemany(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, root, dir_path, os.path.basename(path), info['subject'], info['session'],
+                      info['condition'], info['format'], size, file_mtime_ns)
+                     for path, size, file_mtime_ns, info in
+                     ((p, s, m, parse_recording_path(p, root)) for p, s, m in files)]
+                )
+                self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                                  (dir_path, root, mtime_ns, json.dumps(subdirs)))
+
+            # Forget directories that disappeared from the tree
+            for dir_path in set(cached) - visited:
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+                self.conn.execute("DELETE FROM dirs WHERE path = ?", (dir_path,))
+
+        if verbose:
+            print(f"Catalog of {root}: {scanned} directories scanned, {len(records) - scanned} unchanged")
+        return {'scanned': scanned, 'reused': len(records) - scanned}
+
+    def find(self, root: str = None, subject: str = None, session=None, condition=None,
+             fmt=None, name_pattern: str = None) -> list:
+        """
+        Query the catalog. Every argument is optional; session, condition and
+        fmt also accept a list of values. name_pattern is a glob pattern on the
+        file name (e.g. 'Turn_*_LongWalk_ST.txt').
+
+        Returns:
+        - Sorted list of matching file paths
+        """
+        clauses = []
+        values = []
+        for column, value in [('root', os.path.abspath(root) if root else None), ('subject', subject),
+                              ('session', session), ('condition', condition), ('format', fmt)]:
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                values.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                values.append(value)
+        if name_pattern is not None:
+            clauses.append("name GLOB ?")
+            values.append(name_pattern)
+
+        query = "SELECT path FROM files"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY path"
+        return [row[0] for row in self.conn.execute(query, values)]
+
+    def get(self, file_path: str) -> dict:
+        """
+        Return the catalog record of a single file, or None if it is not cataloged.
+        """
+        cursor = self.conn.execute("SELECT * FROM files WHERE path = ?", (os.path.abspath(file_path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+
+def build_catalog(root: str, db_path: str, workers: int = 8, exclude=()) -> Catalog:
+    """
+    Open the catalog stored at db_path and refresh it for root.
+    """
+    catalog = Catalog(db_path)
+    catalog.refresh(root, workers=workers, exclude=exclude)
+    return catalog
+
+
+def _scan_tree(top: str, cached: dict, exclude: set, extensions) -> list:
+    # Iterative depth-first walk of one subtree
+    records = []
+    stack = [(top, os.stat(top).st_mtime_ns)]
+    while stack:
+        dir_path, mtime_ns = stack.pop()
+        for subdir in _scan_dir(dir_path, mtime_ns, cached, exclude, extensions, records):
+            try:
+                stack.append((subdir, os.stat(subdir).st_mtime_ns))
+            except OSError:
+                continue
+    return records
+
+
+def _scan_dir(dir_path: str, mtime_ns: int, cached: dict, exclude: set, extensions, records: list) -> list:
+    # Append (dir, mtime, subdirs, files) to records and return the subdirectories.
+    # files is None when the directory is unchanged and its catalog rows are kept.
+    if dir_path in cached and cached[dir_path][0] == mtime_ns:
+        subdirs = cached[dir_path][1]
+        records.append((dir_path, mtime_ns, subdirs, None))
+        return [d for d in subdirs if d not in exclude]
+
+    subdirs = []
+    files = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(extensions):
+                    st = entry.stat()
+                    files.append((entry.path, st.st_size, st.st_mtime_ns))
+            except OSError:
+                continue
+    subdirs.sort()
+    records.append((dir_path, mtime_ns, subdirs, files))
+    return [d for d in subdirs if d not in exclude]
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class CohortAggregator:
+    """
+    Running grand-average and standard-error curves across a cohort.
+
+    Time series are added one at a time and folded into Welford running
+    mean/variance accumulators on a common time grid, one per key (e.g.
+    (condition, timepoint)). Memory depends on the grid length and number of
+    keys only, not on the number of subjects. Series shorter than the grid
+    contribute to the samples they cover; series sampled at a different rate
+    are interpolated onto the grid. Aggregators can be saved, loaded and
+    merged, so per-file or per-shard states combine into the cohort result.
+    """
+
+    def __init__(self, n_samples: int, sample_rate: float, columns=('grand oxy', 'grand deoxy')):
+        self.n_samples = int(n_samples)
+        self.sample_rate = float(sample_rate)
+        self.columns = list(columns)
+        self.time = np.arange(self.n_samples) / self.sample_rate
+        self._state = {}
+
+    def keys(self) -> list:
+        return sorted(self._state)
+
+    def add(self, key: tuple, data: pd.DataFrame, sample_rate: float = None):
+        """
+        Fold one time series into the accumulators of key.
+
+        Parameters:
+        - key: Tuple identifying the curve, e.g. ('ST', 'Baseline')
+        - data: DataFrame holding the aggregated columns, first row at time 0
+        - sample_rate: Sampling rate of data if it differs from the grid
+        """
+        values = data[self.columns].to_numpy(dtype='float64')
+        if sample_rate is not None and sample_rate != self.sample_rate:
+            source_time = np.arange(len(values)) / sample_rate
+            values = np.column_stack([
+                np.interp(self.time, source_time, values[:, i], right=np.nan) for i in range(values.shape[1])
+            ])
+        x = np.full((self.n_samples, len(self.columns)), np.nan)
+        n = min(len(values), self.n_samples)
+        x[:n] = values[:n]
+
+        count, mean, m2 = self._accumulators(key)
+        valid = ~np.isnan(x)
+        count += valid
+        delta = np.where(valid, x - mean, 0.0)
+        mean += np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+        m2 += delta * np.where(valid, x - mean, 0.0)
+
+    def merge(self, other: 'CohortAggregator'):
+        """
+        Merge the accumulators of another aggregator on the same grid into this one.
+        """
+        if other.n_samples != self.n_samples or other.sample_rate != self.sample_rate \
+                or other.columns != self.columns:
+            raise ValueError("Cannot merge aggregators with different grids or columns.")
+        for key, (count_b, mean_b, m2_b) in other._state.items():
+            count_a, mean_a, m2_a = self._accumulators(key)
+            total = count_a + count_b
+            delta = mean_b - mean_a
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight_b = np.where(total > 0, count_b / total, 0.0)
+                m2_a += m2_b + np.where(total > 0, delta ** 2 * count_a * count_b / total, 0.0)
+            mean_a += delta * weight_b
+            count_a += count_b
+
+    def result(self, key: tuple) -> pd.DataFrame:
+        """
+        Return the grand-average curve of key with its standard error and the
+        number of series contributing to each sample.
+        """
+        count, mean, m2 = self._state[key]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = np.where(count > 1, m2 / (count - 1), np.nan)
+            se = np.sqrt(variance / count)
+        result = {'Time': self.time}
+        for i, col in enumerate(self.columns):
+            result[f'{col} Mean'] = np.where(count[:, i] > 0, mean[:, i], np.nan)
+            result[f'{col} SE'] = se[:, i]
+        result['N'] = count[:, 0]
+        return pd.DataFrame(result)
+
+    def save_results(self, output_folder: str, prefix: str = 'grand_average') -> list:
+        """
+        Save the curve of every key as <prefix>_<key parts>.csv.
+        """
+        paths = []
+        for key in self.keys():
+            path = os.path.join(output_folder, f"{prefix}_{'_'.join(str(k) for k in key)}.csv")
+            self.result(key).to_csv(path, index=False)
+            print(f"Grand average saved to {path}")
+            paths.append(path)
+        return paths
+
+    def save_state(self, path: str):
+        """
+        Save the accumulators to a .npz file so they can be merged later.
+        """
+        arrays = {'n_samples': self.n_samples, 'sample_rate': self.sample_rate,
+                  'columns': np.array(self.columns), 'keys': np.array(['|'.join(k) for k in self.keys()])}
+        for i, key in enumerate(self.keys()):
+            count, mean, m2 = self._state[key]
+            arrays[f'count_{i}'] = count
+            arrays[f'mean_{i}'] = mean
+            arrays[f'm2_{i}'] = m2
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load_state(cls, path: str) -> 'CohortAggregator':
+        with np.load(path) as f:
+            aggregator = cls(int(f['n_samples']), float(f['sample_rate']), [str(c) for c in f['columns']])
+            for i, key in enumerate(f['keys']):
+                aggregator._state[tuple(str(key).split('|'))] = (
+                    f[f'count_{i}'].copy(), f[f'mean_{i}'].copy(), f[f'm2_{i}'].copy())
+        return aggregator
+
+    def _accumulators(self, key: tuple) -> tuple:
+        if key not in self._state:
+            shape = (self.n_samples, len(self.columns))
+            self._state[key] = (np.zeros(shape, dtype='int64'), np.zeros(shape), np.zeros(shape))
+        return self._state[key]
@@ -0,0 +1,191 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from processing.catalog import parse_recording_path
+from processing.metadata import to_builtin
+from processing.readers import read_recording
+
+# Rows per chunk along the time axis, ~80 s at 50 Hz
+CHUNK_SAMPLES = 4096
+
+
+class CohortStore:
+    """
+    Chunked, compressed HDF5 store holding every recording of a cohort.
+
+    Recordings live in groups named subject/session/condition, each with:
+    - 'data': samples x channels float array, chunked along time and gzip compressed
+    - 'sample_number': original sample numbers of the rows
+    - 'event_samples' / 'event_labels': row positions and labels of the event markers
+    - attributes 'columns', 'metadata' (JSON) and the source file fingerprint
+
+    Slicing 'data' only reads the chunks that overlap the requested rows, so
+    any recording or time window can be loaded without touching the rest.
+    """
+
+    def __init__(self, path: str, mode: str = 'r'):
+        self.path = path
+        self.h5 = h5py.File(path, mode)
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keys(self) -> list:
+        """
+        Return the (subject, session, condition) keys of all stored recordings.
+        """
+        keys = []
+
+        def visit(name, obj):
+            if isinstance(obj, h5py.Group) and 'data' in obj:
+                keys.append(tuple(name.split('/')))
+
+        self.h5.visititems(visit)
+        return sorted(keys)
+
+    def __contains__(self, key) -> bool:
+        return _group_name(*key) in self.h5
+
+    def dataset(self, subject: str, session: str, condition: str) -> h5py.Dataset:
+        """
+        Return the lazily loaded 'data' dataset of a recording for chunked access.
+        """
+        return self.h5[_group_name(subject, session, condition)]['data']
+
+    def metadata(self, subject: str, session: str, condition: str) -> dict:
+        return json.loads(self.h5[_group_name(subject, session, condition)].attrs['metadata'])
+
+    def read(self, subject: str, session: str, condition: str, start: int = None, stop: int = None) -> dict:
+        """
+        Read a recording, or the rows start:stop of it.
+
+        Returns:
+        - Dictionary of metadata and data in the same layout as read_txt_file/read_mat
+        """
+        group = self.h5[_group_name(subject, session, condition)]
+        rows = slice(start, stop)
+        columns = json.loads(group.attrs['columns'])
+
+        df = pd.DataFrame(group['data'][rows], columns=columns)
+        df.insert(0, 'Sample number', group['sample_number'][rows])
+
+        # Place the event markers that fall inside the window
+        first, last, _ = rows.indices(group['data'].shape[0])
+        event_samples = group['event_samples'][()]
+        event_labels = group['event_labels'].asstr()[()]
+        events = pd.Series(np.nan, index=df.index, dtype=object)
+        in_window = (event_samples >= first) & (event_samples < last)
+        events.iloc[event_samples[in_window] - first] = event_labels[in_window]
+        df['Event'] = events
+
+        return {'metadata': json.loads(group.attrs['metadata']), 'data': df}
+
+    def read_time_window(self, subject: str, session: str, condition: str, t_start: float, t_stop: float) -> dict:
+        """
+        Read the samples between t_start and t_stop seconds from the start of a recording.
+        """
+        fs = float(self.metadata(subject, session, condition)['Datafile sample rate'])
+        return self.read(subject, session, condition, int(t_start * fs), int(t_stop * fs))
+
+    def write(self, subject: str, session: str, condition: str, recording: dict, fingerprint: dict = None):
+        """
+        Store a recording as returned by read_txt_file/read_mat, replacing any
+        previous version of it.
+        """
+        name = _group_name(subject, session, condition)
+        if name in self.h5:
+            del self.h5[name]
+        group = self.h5.create_group(name)
+
+        df = recording['data']
+        columns = [col for col in df.columns if col not in ['Sample number', 'Event']]
+        values = df[columns].to_numpy(dtype='float64')
+        group.create_dataset('data', data=values, chunks=(min(len(values), CHUNK_SAMPLES), len(columns)),
+                             compression='gzip', shuffle=True)
+        group.create_dataset('sample_number', data=df['Sample number'].to_numpy(dtype='int64'),
+                             compression='gzip')
+
+        event_mask = df['Event'].notna().to_numpy()
+        group.create_dataset('event_samples', data=np.flatnonzero(event_mask).astype('int64'))
+        group.create_dataset('event_labels', data=df['Event'][event_mask].astype(str).tolist(),
+                             dtype=h5py.string_dtype())
+
+        group.attrs['columns'] = json.dumps(columns)
+        group.attrs['metadata'] = json.dumps(recording['metadata'], default=to_builtin)
+        group.attrs['fingerprint'] = json.dumps(fingerprint or {})
+
+    def fingerprint(self, subject: str, session: str, condition: str) -> dict:
+        return json.loads(self.h5[_group_name(subject, session, condition)].attrs['fingerprint'])
+
+
+def ingest(file_paths, store_path: str, root: str, workers: int = 1) -> list:
+    """
+    Parse recordings of any format of processing.readers and write them into the cohort store.
+
+    Files whose size and mtime match the stored copy are not parsed again.
+    With workers > 1 the files are parsed in a process pool while the parent
+    writes the store.
+
+    Parameters:
+    - file_paths: Recordings to ingest, e.g. .txt/.mat files
+    - store_path: HDF5 file of the cohort store, created if missing
+    - root: Root of the study tree, used to parse subject/session/condition
+    - workers: Number of parsing processes
+
+    Returns:
+    - List of (subject, session, condition) keys written in this call
+    """
+    written = []
+    with CohortStore(store_path, 'a') as store:
+        pending = []
+        for file_path in file_paths:
+            info = parse_recording_path(file_path, root)
+            key = tuple(info[k] or 'Unknown' for k in ['subject', 'session', 'condition'])
+            st = os.stat(file_path)
+            fingerprint = {'source': file_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+            if key in store and store.fingerprint(*key) == fingerprint:
+                continue
+            pending.append((file_path, key, fingerprint))
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(_read_recording, [p[0] for p in pending])
+                _write_all(store, pending, results, written)
+        else:
+            _write_all(store, pending, map(_read_recording, [p[0] for p in pending]), written)
+
+    print(f"Ingested {len(written)} recordings into {store_path}")
+    return written
+
+
+def _write_all(store: CohortStore, pending: list, results, written: list):
+    for (file_path, key, fingerprint), recording in zip(pending, results):
+        if isinstance(recording, Exception):
+            print(f"Error reading file {file_path}: {recording}")
+            continue
+        store.write(*key, recording, fingerprint=fingerprint)
+        written.append(key)
+        print(f"Stored {file_path} as {'/'.join(key)}")
+
+
+def _read_recording(file_path: str):
+    # Exceptions are returned rather than raised so one bad file does not stop the ingest
+    try:
+        return read_recording(file_path)
+    except Exception as e:
+        return e
+
+
+def _group_name(subject: str, session: str, condition: str) -> str:
+    return f"{subject}/{session}/{condition}"
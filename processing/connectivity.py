@@ -0,0 +1,185 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from processing.average_channels import LEFT_CHANNELS, RIGHT_CHANNELS
+from processing.catalog import parse_recording_path
+from processing.filter import BANDPASS_WN
+from processing.precision import ACCUMULATOR
+
+# Long channels of the montage in the order of the matrices, HbO and HbR
+# alternating. Channels excluded from a recording are NaN rows and columns,
+# so the matrices of every recording line up
+CONNECTIVITY_COLUMNS = [f'CH{ch} {kind}' for ch in sorted(RIGHT_CHANNELS + LEFT_CHANNELS) for kind in ('HbO', 'HbR')]
+
+
+def segment_connectivity(segments: dict, sample_rate: float, columns=None, band=BANDPASS_WN,
+                         window_seconds: float = None) -> dict:
+    """
+    Channel x channel correlation and magnitude-squared coherence of every segment.
+
+    Each segment is reduced with one matrix product of its standardised
+    channels for the correlations, and with one FFT of all its Welch windows
+    followed by a matrix product per frequency for the cross-spectra, rather
+    than a loop over channel pairs. The coherence is averaged over the
+    frequencies of the Welch spectra that fall inside band.
+
+    Parameters:
+    - segments: Dictionary of segment name to DataFrame, e.g. from
+      split_segments or create_segments
+    - sample_rate: Sampling rate of the data in Hz
+    - columns: Channel columns of the matrices, CONNECTIVITY_COLUMNS by default
+    - band: (low, high) frequencies of the coherence in Hz
+    - window_seconds: Length of the Welch windows (Hann, half overlapping),
+      half the segment by default so that three windows are averaged
+
+    Returns:
+    - Dictionary with 'segments' and 'columns' (names), 'correlation' and
+      'coherence' (segments x columns x columns arrays, NaN for missing or
+      constant channels and segments too short for the band) and 'band'
+    """
+    columns = list(columns or CONNECTIVITY_COLUMNS)
+    names = list(segments)
+    correlation = np.full((len(names), len(columns), len(columns)), np.nan)
+    coherence = np.full_like(correlation, np.nan)
+    for s, name in enumerate(names):
+        present = [i for i, col in enumerate(columns) if col in segments[name].columns]
+        if not present:
+            continue
+        values = segments[name][[columns[i] for i in present]].to_numpy(dtype=ACCUMULATOR)
+        cells = np.ix_(present, present)
+        correlation[s][cells] = correlation_matrix(values)
+        nperseg = int(round(window_seconds * sample_rate)) if window_seconds else len(values) // 2
+        coherence[s][cells] = coherence_matrix(values, sample_rate, nperseg, band)
+    return {'segments': names, 'columns': columns, 'correlation': correlation, 'coherence': coherence,
+            'band': tuple(band)}
+
+
+def correlation_matrix(values: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlations between the columns of a samples x channels array.
+    """
+    centered = values - values.mean(axis=0)
+    norms = np.sqrt(np.einsum('ij,ij->j', centered, centered))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        standardised = centered / norms
+    return standardised.T @ standardised
+
+
+def coherence_matrix(values: np.ndarray, sample_rate: float, nperseg: int, band=BANDPASS_WN) -> np.ndarray:
+    """
+    Magnitude-squared coherence between the columns of a samples x channels
+    array, averaged over the frequencies inside band.
+
+    Uses the same estimate as scipy.signal.coherence with a Hann window,
+    nperseg samples per window and half overlapping windows.
+    """
+    n_channels = values.shape[1]
+    if nperseg < 2 or len(values) < 2 * nperseg - nperseg // 2:
+        # A single window gives a coherence of one everywhere
+        return np.full((n_channels, n_channels), np.nan)
+    from scipy.signal import get_window
+
+    step = nperseg - nperseg // 2
+    windows = np.lib.stride_tricks.sliding_window_view(values, nperseg, axis=0)[::step]
+    windows = windows - windows.mean(axis=-1, keepdims=True)
+    # One FFT of every window of every channel: windows x channels x frequencies
+    spectra = np.fft.rfft(windows * get_window('hann', nperseg), axis=-1)
+    frequencies = np.fft.rfftfreq(nperseg, 1.0 / sample_rate)
+    in_band = (frequencies >= band[0]) & (frequencies <= band[1])
+    if not in_band.any():
+        return np.full((n_channels, n_channels), np.nan)
+
+    # Cross-spectral matrices summed over the windows, one matrix product per frequency
+    x = spectra[:, :, in_band].transpose(2, 1, 0)
+    cross = x @ x.conj().transpose(0, 2, 1)
+    power = np.real(np.diagonal(cross, axis1=1, axis2=2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        msc = np.abs(cross) ** 2 / (power[:, :, None] * power[:, None, :])
+    return msc.mean(axis=0)
+
+
+def hemispheric_summary(result: dict) -> pd.DataFrame:
+    """
+    Mean correlation and coherence between the left and right hemisphere
+    channels (see average_channels) of every segment, per chromophore.
+
+    Parameters:
+    - result: Output of segment_connectivity
+
+    Returns:
+    - DataFrame with one row per segment and the columns 'Segment',
+      'oxy correlation', 'deoxy correlation', 'oxy coherence' and 'deoxy coherence'
+    """
+    columns = result['columns']
+    rows = {'Segment': result['segments']}
+    for measure in ['correlation', 'coherence']:
+        for kind, label in [('HbO', 'oxy'), ('HbR', 'deoxy')]:
+            left = [columns.index(f'CH{ch} {kind}') for ch in LEFT_CHANNELS if f'CH{ch} {kind}' in columns]
+            right = [columns.index(f'CH{ch} {kind}') for ch in RIGHT_CHANNELS if f'CH{ch} {kind}' in columns]
+            pairs = result[measure][:, left][:, :, right].reshape(len(result['segments']), -1)
+            with np.errstate(invalid='ignore'):
+                rows[f'{label} {measure}'] = np.nanmean(pairs, axis=1) if pairs.size else np.nan
+    return pd.DataFrame(rows)
+
+
+def save_connectivity(file_path: str, result: dict):
+    """
+    Save the output of segment_connectivity to a compressed .npz file.
+    """
+    np.savez_compressed(file_path, segments=np.array(result['segments']), columns=np.array(result['columns']),
+                        correlation=result['correlation'].astype('float32'),
+                        coherence=result['coherence'].astype('float32'), band=np.array(result['band']))
+
+
+def load_connectivity(file_path: str) -> dict:
+    """
+    Load a file written by save_connectivity.
+    """
+    with np.load(file_path) as f:
+        return {'segments': f['segments'].tolist(), 'columns': f['columns'].tolist(),
+                'correlation': f['correlation'], 'coherence': f['coherence'], 'band': tuple(f['band'].tolist())}
+
+
+def build_connectivity_store(file_results: dict, store_path: str, root: str) -> int:
+    """
+    Collect per-file connectivity results into one HDF5 store, replacing it.
+
+    Recordings are stored in groups named subject/session/condition, as in
+    the cohort store, each with 'correlation' and 'coherence' datasets of
+    shape segments x channels x channels (float32, gzip compressed) and the
+    attributes 'segments', 'columns' and 'band' (JSON) and 'source'. A
+    subject's matrices are read with h5py as store[subject][session][condition].
+
+    Parameters:
+    - file_results: Dictionary of source file to its save_connectivity file
+    - store_path: HDF5 file to write
+    - root: Root of the study tree, used to parse subject/session/condition
+
+    Returns:
+    - Number of recordings stored
+    """
+    # h5py is imported here so that entry points that do not write the store start quickly
+    import h5py
+
+    stored = 0
+    with h5py.File(store_path, 'w') as store:
+        for source, result_path in sorted(file_results.items()):
+            info = parse_recording_path(source, root)
+            name = '/'.join(info[k] or 'Unknown' for k in ['subject', 'session', 'condition'])
+            if name in store:
+                print(f"Warning: {source} has the same subject, session and condition as "
+                      f"{store[name].attrs['source']}, only the first is stored")
+                continue
+            result = load_connectivity(result_path)
+            group = store.create_group(name)
+            for measure in ['correlation', 'coherence']:
+                group.create_dataset(measure, data=result[measure], compression='gzip', shuffle=True)
+            group.attrs['segments'] = json.dumps(result['segments'])
+            group.attrs['columns'] = json.dumps(result['columns'])
+            group.attrs['band'] = json.dumps(list(result['band']))
+            group.attrs['source'] = source
+            stored += 1
+    print(f"Connectivity matrices of {stored} recordings saved to {store_path}")
+    return stored
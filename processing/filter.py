@@ -1,13 +1,79 @@
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
-from scipy.signal import firwin, filtfilt
 
-def fir_filter(df: pd.DataFrame, order: int, Wn: list, fs: int):
+from processing.precision import signal_dtype
+
+# 'reference' filters channel by channel, 'vectorized' filters all channels in
+# one filtfilt call and 'fft' runs the same zero-phase filter as overlap-add
+# FFT convolutions. Check engines against the golden outputs before adopting them.
+ENGINES = ('reference', 'vectorized', 'fft')
+# Bandpass of both pipelines, see fir_design()
+BANDPASS_ORDER = 1000
+BANDPASS_WN = (0.01, 0.1)
+
+
+def fir_filter(df: pd.DataFrame, order: int, Wn: list, fs: int, engine: str = 'reference'):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown FIR filter engine: {engine}, expected one of {ENGINES}")
+    # scipy.signal is imported on first use so the entry points start quickly
+    from scipy.signal import filtfilt
     filtered_df = df.copy()
     data_columns = [col for col in df.columns if col not in ['Sample number', 'Event']]
-    for ch in data_columns:
-        ch_asarray = np.array(df[ch], dtype='float64')
-        b = firwin(order + 1, Wn, pass_zero=False, fs=fs)
-        ch_filtered = filtfilt(b, [1.0], ch_asarray)
-        filtered_df[ch] = ch_filtered
+    # Channels are filtered in their own precision, float32 or float64
+    dtype = signal_dtype(df, data_columns)
+    if engine == 'reference':
+        for ch in data_columns:
+            ch_asarray = np.array(df[ch], dtype=dtype)
+            b = fir_design(order, tuple(Wn), fs).astype(dtype)
+            ch_filtered = filtfilt(b, [1.0], ch_asarray)
+            filtered_df[ch] = ch_filtered.astype(dtype, copy=False)
+        return filtered_df
+
+    b = fir_design(order, tuple(Wn), fs).astype(dtype)
+    data = df[data_columns].to_numpy(dtype=dtype)
+    if engine == 'vectorized':
+        filtered = filtfilt(b, [1.0], data, axis=0)
+    else:
+        filtered = _filtfilt_fft(b, data)
+    filtered_df[data_columns] = filtered.astype(dtype, copy=False)
     return filtered_df
+
+
+@lru_cache(maxsize=None)
+def fir_design(order: int, Wn: tuple, fs: float) -> np.ndarray:
+    """
+    Coefficients of the bandpass FIR filter, computed once per design.
+
+    Parameters:
+    - order: Filter order, the filter has order + 1 taps
+    - Wn: (low, high) cut-off frequencies in Hz
+    - fs: Sampling rate in Hz
+
+    Returns:
+    - Read-only float64 coefficients
+    """
+    from scipy.signal import firwin
+    b = firwin(order + 1, list(Wn), pass_zero=False, fs=fs)
+    b.flags.writeable = False
+    return b
+
+
+def _filtfilt_fft(b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    # filtfilt with its default odd extension of 3 * len(b) samples at both ends
+    padlen = 3 * len(b)
+    if x.shape[0] <= padlen:
+        raise ValueError(f"The length of the input must be over padlen, which is {padlen}.")
+    ext = np.concatenate([2 * x[0] - x[padlen:0:-1], x, 2 * x[-1] - x[-2:-padlen - 2:-1]])
+    y = _lfilter_fft(b, ext)
+    y = _lfilter_fft(b, y[::-1])[::-1]
+    return y[padlen:-padlen]
+
+
+def _lfilter_fft(b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    # filtfilt starts lfilter in the steady state of x[0], which for an FIR
+    # filter is the input held at x[0] before the first sample
+    from scipy.signal import oaconvolve
+    head = np.repeat(x[:1], len(b) - 1, axis=0)
+    return oaconvolve(np.concatenate([head, x]), b[:, None], mode='valid', axes=0)
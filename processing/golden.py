@@ -0,0 +1,319 @@
+import os
+import io
+import json
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+from processing.synthetic import synthetic_recording
+from processing.read_txt import read_txt_file
+from processing.read_mat import read_mat
+from processing.resample import get_sample_rate, resample_recording
+from processing import filter as fir_module, tddr as tddr_module, ssc_regression as ssc_module
+from processing.filter import fir_filter
+from processing.ssc_regression import ssc_regression
+from processing.tddr import tddr
+from processing.baseline import baseline_subtraction
+from processing.average_channels import average_channels
+from processing.nirs_statistics import calculate_statistics, split_segments
+from processing.precision import resolve_dtype, cast_channels
+
+SAMPLE_RATE = 50
+
+# Synthetic part of the corpus, fixed so the golden outputs never change
+# unless a reference implementation does
+SYNTHETIC_CORPUS = {
+    'synthetic_default': {'seed': 0},
+    'synthetic_long': {'seed': 1, 'duration': 300.0},
+    'synthetic_motion': {'seed': 2, 'n_spikes': 10, 'spike_amplitude': 8.0},
+    'synthetic_quiet': {'seed': 3, 'hrf_amplitude': 0.05, 'n_spikes': 0, 'drift': 0.05},
+}
+
+# Stages in pipeline order and the engines each one supports
+STAGE_ENGINES = {
+    'ssc': ssc_module.ENGINES,
+    'tddr': tddr_module.ENGINES,
+    'fir': fir_module.ENGINES,
+    'baseline': ('reference',),
+    'statistics': ('reference',),
+}
+
+# Allowed error per stage, relative to the largest absolute golden value of
+# the channel or feature, plus an absolute floor for values close to zero
+TOLERANCES = {
+    'ssc': {'rtol': 1e-9, 'atol': 1e-12},
+    'tddr': {'rtol': 1e-9, 'atol': 1e-12},
+    'fir': {'rtol': 1e-9, 'atol': 1e-12},
+    'baseline': {'rtol': 1e-9, 'atol': 1e-12},
+    'statistics': {'rtol': 1e-7, 'atol': 1e-10},
+    'pipeline': {'rtol': 1e-7, 'atol': 1e-10},
+}
+
+# Allowed error of float32 runs against the float64 golden outputs
+FLOAT32_TOLERANCES = {
+    'ssc': {'rtol': 1e-5, 'atol': 1e-6},
+    'tddr': {'rtol': 1e-4, 'atol': 1e-5},
+    'fir': {'rtol': 1e-4, 'atol': 1e-5},
+    'baseline': {'rtol': 1e-5, 'atol': 1e-6},
+    'statistics': {'rtol': 1e-4, 'atol': 1e-5},
+    'pipeline': {'rtol': 1e-3, 'atol': 1e-4},
+}
+
+SHORT_CHANNELS = [7, 8]
+
+
+def load_corpus(files=None) -> dict:
+    """
+    Load the recordings of the golden corpus, the synthetic recordings plus
+    any real .txt/.mat files, renamed to CH<n> HbO/HbR columns at the
+    analysis sampling rate.
+
+    Returns:
+    - {name: DataFrame}
+    """
+    corpus = {}
+    for name, kwargs in SYNTHETIC_CORPUS.items():
+        corpus[name] = _prepare(synthetic_recording(sample_rate=SAMPLE_RATE, **kwargs), SAMPLE_RATE)
+    for file_path in files or []:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if file_path.endswith('.mat'):
+                recording = read_mat(file_path)
+            else:
+                recording = read_txt_file(file_path)
+        fs = get_sample_rate(recording['metadata'], default=SAMPLE_RATE)
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        corpus[name] = _prepare(recording['data'], fs)
+    return corpus
+
+
+def _prepare(data: pd.DataFrame, sample_rate: float) -> pd.DataFrame:
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = resample_recording(data, sample_rate, SAMPLE_RATE)
+    n_channels = (len(data.columns) - 2) // 2
+    columns = ['Sample number']
+    for i in range(n_channels):
+        columns += [f'CH{i + 1} HbO', f'CH{i + 1} HbR']
+    df = data.copy()
+    df.columns = columns + ['Event']
+    df['Sample number'] = np.arange(len(df))
+    df['Event'] = pd.NA
+    return df
+
+
+def run_stages(df: pd.DataFrame, engines: dict = None, reference: dict = None) -> dict:
+    """
+    Run the stages of the bc pipeline on one recording.
+
+    Every stage is fed the reference output of the stage before it when
+    reference is given, so an engine's error is measured on its own stage
+    and does not include the error of the stages before it.
+
+    Parameters:
+    - df: Recording from load_corpus
+    - engines: {stage: engine}, stages not listed use 'reference'
+    - reference: Outputs of run_stages with the reference engines
+
+    Returns:
+    - {stage: DataFrame} with the output of every stage
+    """
+    engines = engines or {}
+    reference = reference or {}
+    outputs = {}
+
+    def stage_input(stage):
+        return reference[stage] if stage in reference else outputs[stage]
+
+    channels = [col for col in df.columns if col.startswith('CH')]
+    short_cols = [col for col in channels if int(col.split()[0][2:]) in SHORT_CHANNELS]
+    long_cols = [col for col in channels if col not in short_cols]
+    outputs['ssc'] = ssc_regression(df[long_cols], df[short_cols], engine=engines.get('ssc', 'reference'))
+
+    outputs['tddr'] = tddr(stage_input('ssc'), SAMPLE_RATE, engine=engines.get('tddr', 'reference'))
+
+    filter_input = stage_input('tddr').copy()
+    filter_input['Sample number'] = df['Sample number']
+    filter_input['Event'] = df['Event']
+    outputs['fir'] = fir_filter(filter_input, order=1000, Wn=[0.01, 0.1], fs=SAMPLE_RATE,
+                                engine=engines.get('fir', 'reference'))
+
+    total_samples = len(df)
+    events_df = pd.DataFrame({
+        'Sample number': [0, 20 * SAMPLE_RATE, int((total_samples / SAMPLE_RATE - 10) * SAMPLE_RATE)],
+        'Event': ['S1', 'S2', 'S3'],
+    })
+    outputs['baseline'] = baseline_subtraction(stage_input('fir'), events_df)
+
+    averaged = average_channels(stage_input('baseline'))
+    averaged['Time'] = averaged['Sample number'] / SAMPLE_RATE
+    walking = averaged[(averaged['Sample number'] >= events_df['Sample number'][1])
+                       & (averaged['Sample number'] <= events_df['Sample number'][2])].reset_index(drop=True)
+    trim = 2 * SAMPLE_RATE
+    walking = walking.iloc[trim:-trim].reset_index(drop=True).drop(columns=['Sample number'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        statistics = calculate_statistics(split_segments(walking), 'golden', 'golden', 'golden', 'golden')
+    outputs['statistics'] = statistics.drop(columns=['Subject', 'Condition', 'Timepoint'])
+    return {stage: _numeric(output) for stage, output in outputs.items()}
+
+
+def _numeric(df: pd.DataFrame) -> pd.DataFrame:
+    columns = [col for col in df.columns if col not in ['Sample number', 'Event']]
+    return df[columns].astype('float64').reset_index(drop=True)
+
+
+def record_golden(golden_folder: str, files=None) -> list:
+    """
+    Run the reference implementations on the corpus and store their outputs
+    as golden_folder/<recording>.npz, with a golden.json describing the run.
+
+    Returns:
+    - List of the recording names stored
+    """
+    os.makedirs(golden_folder, exist_ok=True)
+    corpus = load_corpus(files)
+    for name, df in corpus.items():
+        outputs = run_stages(df)
+        arrays = {}
+        for stage, output in outputs.items():
+            arrays[stage] = output.to_numpy()
+            arrays[f'{stage}__columns'] = np.array(output.columns, dtype=str)
+        np.savez_compressed(os.path.join(golden_folder, f'{name}.npz'), **arrays)
+        print(f"Golden outputs of {name} saved")
+
+    import scipy
+    with open(os.path.join(golden_folder, 'golden.json'), 'w') as f:
+        json.dump({'recordings': list(corpus), 'files': list(files or []), 'numpy': np.__version__,
+                   'scipy': scipy.__version__, 'pandas': pd.__version__}, f, indent=2)
+    return list(corpus)
+
+
+def load_golden(golden_folder: str, name: str) -> dict:
+    """
+    Load the golden outputs of one recording as {stage: DataFrame}.
+    """
+    with np.load(os.path.join(golden_folder, f'{name}.npz')) as arrays:
+        stages = [key for key in arrays.files if not key.endswith('__columns')]
+        return {stage: pd.DataFrame(arrays[stage], columns=arrays[f'{stage}__columns']) for stage in stages}
+
+
+def resolve_engines(engine_args) -> dict:
+    """
+    Turn engine selections into {stage: engine}. 'name' selects the engine
+    for every stage that has it, 'stage=name' selects it for one stage.
+    """
+    engines = {}
+    for arg in engine_args or []:
+        if '=' in arg:
+            stage, engine = arg.split('=', 1)
+            if stage not in STAGE_ENGINES:
+                raise ValueError(f"Unknown stage: {stage}, expected one of {list(STAGE_ENGINES)}")
+            if engine not in STAGE_ENGINES[stage]:
+                raise ValueError(f"Stage {stage} has no engine {engine}, expected one of {STAGE_ENGINES[stage]}")
+            engines[stage] = engine
+        else:
+            matched = [stage for stage, available in STAGE_ENGINES.items() if arg in available]
+            if not matched:
+                raise ValueError(f"No stage has an engine named {arg}")
+            for stage in matched:
+                engines[stage] = arg
+    return engines
+
+
+def compare_outputs(output: pd.DataFrame, golden: pd.DataFrame, tolerance: dict) -> pd.DataFrame:
+    """
+    Maximum absolute and relative error of every column of output against
+    golden, the relative error being taken against the largest absolute
+    golden value of the column.
+
+    Returns:
+    - DataFrame with 'Column', 'Max abs error', 'Max rel error' and 'Passed'
+    """
+    rows = []
+    for col in golden.columns:
+        expected = golden[col].to_numpy()
+        if col not in output.columns or len(output) != len(golden):
+            rows.append([col, np.inf, np.inf, False])
+            continue
+        actual = output[col].to_numpy()
+        # NaN in both is a match, NaN in only one is an unbounded error
+        error = np.abs(actual - expected)
+        error[np.isnan(expected) & np.isnan(actual)] = 0.0
+        max_abs = np.inf if np.isnan(error).any() else float(error.max(initial=0.0))
+        scale = float(np.nanmax(np.abs(expected), initial=0.0))
+        max_rel = max_abs / scale if scale > 0 else (0.0 if max_abs == 0 else np.inf)
+        passed = max_abs <= tolerance['atol'] + tolerance['rtol'] * scale
+        rows.append([col, max_abs, max_rel, passed])
+    return pd.DataFrame(rows, columns=['Column', 'Max abs error', 'Max rel error', 'Passed'])
+
+
+def check_engines(golden_folder: str, engines: dict, tolerances: dict = None, dtype: str = 'float64') -> pd.DataFrame:
+    """
+    Run the selected engines on the corpus stored in golden_folder and compare
+    every stage, and the statistics of the whole pipeline run with the
+    engines ('pipeline'), against the golden outputs.
+
+    With dtype='float32' the recordings and the reference stage inputs are
+    cast to float32 first, which measures the error of the float32 precision
+    mode against the float64 golden outputs.
+
+    Parameters:
+    - golden_folder: Folder written by record_golden
+    - engines: {stage: engine}, e.g. from resolve_engines
+    - tolerances: Per stage {'rtol', 'atol'}, defaults to TOLERANCES or FLOAT32_TOLERANCES
+    - dtype: Floating point type of the signals, 'float64' or 'float32'
+
+    Returns:
+    - DataFrame with 'Recording', 'Stage', 'Engine', 'Column', 'Max abs error',
+      'Max rel error', 'Passed', one row per channel or feature
+    """
+    dtype = resolve_dtype(dtype)
+    default_tolerances = FLOAT32_TOLERANCES if dtype == np.float32 else TOLERANCES
+    tolerances = {**default_tolerances, **(tolerances or {})}
+    with open(os.path.join(golden_folder, 'golden.json'), 'r') as f:
+        description = json.load(f)
+    corpus = load_corpus(description['files'])
+
+    reports = []
+    for name in description['recordings']:
+        golden = load_golden(golden_folder, name)
+        df = cast_channels(corpus[name], dtype)
+        # Stage by stage on the reference inputs, then the whole chain
+        staged = run_stages(df, engines, reference=_with_context(golden, df, dtype))
+        chained = run_stages(df, engines)
+        staged['pipeline'] = chained['statistics']
+        golden['pipeline'] = golden['statistics']
+        for stage, output in staged.items():
+            report = compare_outputs(output, golden[stage], tolerances[stage])
+            engine = engines.get(stage, 'reference') if stage != 'pipeline' else _describe(engines)
+            if dtype != np.float64:
+                engine += f' ({dtype.name})'
+            report.insert(0, 'Engine', engine)
+            report.insert(0, 'Stage', stage)
+            report.insert(0, 'Recording', name)
+            reports.append(report)
+    return pd.concat(reports, ignore_index=True)
+
+
+def _with_context(golden: dict, df: pd.DataFrame, dtype=np.float64) -> dict:
+    # baseline_subtraction and average_channels need 'Sample number' and 'Event' next to the channels
+    reference = {}
+    for stage, output in golden.items():
+        output = output.astype(dtype) if stage != 'statistics' else output.copy()
+        if stage in ('fir', 'baseline'):
+            output['Sample number'] = df['Sample number']
+            output['Event'] = df['Event']
+        reference[stage] = output
+    return reference
+
+
+def _describe(engines: dict) -> str:
+    return ', '.join(f'{stage}={engine}' for stage, engine in engines.items()) or 'reference'
+
+
+def summarize(report: pd.DataFrame) -> pd.DataFrame:
+    """
+    Worst error per recording and stage of a check_engines report.
+    """
+    return report.groupby(['Recording', 'Stage', 'Engine'], sort=False).agg(
+        **{'Max abs error': ('Max abs error', 'max'), 'Max rel error': ('Max rel error', 'max'),
+           'Passed': ('Passed', 'all')}).reset_index()
@@ -0,0 +1,79 @@
+import re
+import sys
+import subprocess
+
+# Dependencies that must not be imported when an entry point is imported;
+# the stages that need them import them on first use. pyarrow is not listed
+# because pandas imports it itself.
+HEAVY_MODULES = ('scipy', 'matplotlib', 'h5py')
+
+# Cumulative import time allowed per entry point, in milliseconds. Both
+# measured at 330-500 ms (almost all of it pandas and numpy) after the heavy
+# imports were made lazy, against about 1060 ms before.
+IMPORT_BUDGETS_MS = {
+    'main': 650,
+    'main_delta_txt': 650,
+    'main_stream': 650,
+}
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def measure_imports(module: str, cwd: str = None) -> dict:
+    """
+    Import module in a fresh interpreter with python -X importtime.
+
+    Parameters:
+    - module: Name of the module to import, e.g. 'main'
+    - cwd: Working directory of the interpreter, so that top-level scripts can be imported
+
+    Returns:
+    - {imported module: (self time in ms, cumulative time in ms)} of every
+      module imported on the way, with the total under module itself
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=cwd, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr.strip()}")
+
+    timings = {}
+    for line in completed.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)) / 1000, int(match.group(2)) / 1000)
+    return timings
+
+
+def check_import(module: str, repeat: int = 3, budget_ms: float = None, cwd: str = None) -> dict:
+    """
+    Check that importing an entry point stays within its budget and does not
+    load any of HEAVY_MODULES.
+
+    The import is repeated and the fastest run kept, which removes most of the
+    noise of a cold file system cache.
+
+    Parameters:
+    - module: Name of the entry point module
+    - repeat: Number of fresh interpreters to time
+    - budget_ms: Allowed cumulative import time, IMPORT_BUDGETS_MS[module] by default
+    - cwd: Working directory of the interpreters
+
+    Returns:
+    - Dictionary with 'module', 'total_ms', 'budget_ms', 'heavy' (heavy modules
+      that were imported), 'slowest' ([(name, self ms)] by self time) and 'passed'
+    """
+    if budget_ms is None:
+        budget_ms = IMPORT_BUDGETS_MS.get(module)
+    runs = [measure_imports(module, cwd=cwd) for _ in range(max(int(repeat), 1))]
+    timings = min(runs, key=lambda run: run[module][1])
+    total_ms = timings[module][1]
+    heavy = sorted({name.split('.')[0] for name in timings} & set(HEAVY_MODULES))
+    slowest = sorted(((name, t[0]) for name, t in timings.items()), key=lambda item: item[1], reverse=True)
+    return {
+        'module': module,
+        'total_ms': total_ms,
+        'budget_ms': budget_ms,
+        'heavy': heavy,
+        'slowest': slowest,
+        'passed': not heavy and (budget_ms is None or total_ms <= budget_ms),
+    }
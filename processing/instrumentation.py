@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from processing.memory import current_rss, MB
+
+
+class _NullSpan:
+    # Shared by all spans of a disabled tracer, so tracing costs one call
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, context):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.memory = None
+
+    def __enter__(self):
+        stack = self.tracer._span_stack()
+        parent = stack[-1] if stack else None
+        if parent is not None:
+            self.context = {**parent.context, **self.context}
+        stack.append(self)
+        if self.tracer.memory:
+            # tracemalloc keeps one peak, so it is reset per span and the
+            # peak seen so far is handed up to the enclosing span on exit
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+            self.peak = current
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        stack = self.tracer._span_stack()
+        stack.pop()
+        if self.tracer.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            self.memory = {'peak': self.peak - self.start_memory, 'retained': current - self.start_memory,
+                           'rss': current_rss()}
+        self.tracer._record(self.name, self.start, end, self.context, exc_type is not None, self.memory)
+        return False
+
+
+class Tracer:
+    """
+    Collects timed spans of the processing stages.
+
+    Spans nest: a span inherits the context (e.g. file and subject) of the
+    span it is opened in on the same thread, so the stages of one file only
+    need the context once. The collected spans can be summarised into per
+    stage percentiles and exported as CSV or as a Chrome trace
+    (chrome://tracing, Perfetto). A disabled tracer returns one shared no-op
+    span and records nothing.
+
+    With memory=True every span also records the peak and retained Python
+    heap allocations (tracemalloc) above the level at its start and the
+    process RSS at its end. Tracing allocations slows the run down, so it is
+    meant for finding the stage that needs the memory, not for every run.
+    """
+
+    def __init__(self, enabled: bool = True, memory: bool = False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name: str, **context):
+        """
+        Context manager timing the stage name, e.g.
+        with tracer.span('tddr', file=file_path): ...
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, context)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Per stage count, total and mean time and p50/p90/p99/max durations in
+        seconds, plus the maximum peak and mean retained memory and the
+        maximum RSS in MB when memory is traced.
+        """
+        columns = ['Stage', 'Count', 'Errors', 'Total (s)', 'Mean (s)', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'Max (s)']
+        if self.memory:
+            columns += ['Peak memory (MB)', 'Retained memory (MB)', 'Max RSS (MB)']
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return pd.DataFrame(columns=columns)
+
+        durations = {}
+        errors = {}
+        memory = {}
+        for span in spans:
+            durations.setdefault(span['name'], []).append(span['duration_ns'] / 1e9)
+            errors[span['name']] = errors.get(span['name'], 0) + span['error']
+            if span['memory'] is not None:
+                m = span['memory']
+                memory.setdefault(span['name'], []).append((m['peak'], m['retained'], m['rss']))
+
+        rows = []
+        for name, values in durations.items():
+            values = np.array(values)
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            row = [name, len(values), errors[name], values.sum(), values.mean(), p50, p90, p99, values.max()]
+            if self.memory:
+                m = np.array(memory.get(name, [(np.nan, np.nan, np.nan)]), dtype='float64') / MB
+                row += [m[:, 0].max(), m[:, 1].mean(), m[:, 2].max()]
+            rows.append(row)
+        return pd.DataFrame(rows, columns=columns).sort_values('Total (s)', ascending=False, ignore_index=True)
+
+    def save_summary(self, path: str):
+        """
+        Save the per stage summary to a CSV file.
+        """
+        self.summary().to_csv(path, index=False)
+        print(f"Stage timings saved to {path}")
+
+    def save_chrome_trace(self, path: str):
+        """
+        Save all spans in the Chrome trace event format.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            'name': span['name'],
+            'cat': 'pipeline',
+            'ph': 'X',
+            'ts': (span['start_ns'] - self._origin) / 1000,
+            'dur': span['duration_ns'] / 1000,
+            'pid': span['pid'],
+            'tid': span['tid'],
+            'args': {**{k: str(v) for k, v in span['context'].items()}, **(span['memory'] or {})},
+        } for span in spans]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print(f"Trace saved to {path}")
+
+    def _span_stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, start, end, context, error, memory):
+        span = {'name': name, 'start_ns': start, 'duration_ns': end - start, 'context': context,
+                'pid': os.getpid(), 'tid': threading.get_ident(), 'error': bool(error), 'memory': memory}
+        with self._lock:
+            self.spans.append(span)
+
+
+# Tracer used by the processing stages, disabled unless set_tracer is called
+_tracer = Tracer(enabled=False)
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> Tracer:
+    """
+    Make tracer the one used by span() and return the previous one.
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = tracer
+    return previous
+
+
+def span(name: str, **context):
+    """
+    Time a stage with the current tracer, see Tracer.span.
+    """
+    return _tracer.span(name, **context)
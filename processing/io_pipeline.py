@@ -0,0 +1,149 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+_STOP = object()
+
+
+class Prefetcher:
+    """
+    Reads upcoming items on I/O threads while the current one is processed.
+
+    Iterating yields (item, result, error) in the order of items, with error
+    set to the exception if read raised. At most depth items are read ahead
+    of the one being processed, so at most depth + 1 recordings are held in
+    memory however slow the processing is. Setting depth to 0 stops reading
+    ahead, e.g. when memory runs short.
+    """
+
+    def __init__(self, read, items, depth: int = 2, workers: int = 2):
+        self.read = read
+        self.depth = depth
+        self._items = iter(items)
+        self._pending = deque()
+        self._exhausted = False
+        self._executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix='prefetch')
+
+    def __iter__(self):
+        try:
+            while True:
+                # Keep the next item plus depth items in flight
+                while not self._exhausted and len(self._pending) < self.depth + 1:
+                    item = next(self._items, _STOP)
+                    if item is _STOP:
+                        self._exhausted = True
+                        break
+                    self._pending.append((item, self._executor.submit(self.read, item)))
+                if not self._pending:
+                    return
+                item, future = self._pending.popleft()
+                error = future.exception()
+                yield item, None if error else future.result(), error
+                del future
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Cancel the reads that have not started and wait for the running ones.
+        """
+        self._pending.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class OutputWriter:
+    """
+    Writes outputs on a background thread so processing does not wait for
+    the disk.
+
+    submit(write, *args, **kwargs) queues a call; calls run one at a time in
+    submission order, so a call that records an output as complete can
+    follow the calls that write it. At most max_pending calls are queued and
+    submit blocks while the queue is full, which bounds the memory held by
+    outputs waiting to be written. With enabled=False every call runs
+    synchronously in submit and a failed write raises there.
+
+    Writes submitted with a group (e.g. the source file of the outputs) can
+    be followed by when_done(group, callback), which learns whether all of
+    them succeeded, so a file is only recorded as complete once its outputs
+    exist. Failed writes are also reported on close.
+
+    Writes receive the submitted objects as they are, so callers must not
+    modify them afterwards; pass a shallow copy of a DataFrame that is
+    extended later.
+    """
+
+    def __init__(self, max_pending: int = 8, enabled: bool = True):
+        self.enabled = enabled
+        self._errors = []
+        self._group_errors = {}
+        self._thread = None
+        if enabled:
+            self._queue = queue.Queue(maxsize=max(int(max_pending), 1))
+            self._thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, write, *args, message: str = None, group=None, **kwargs) -> Future:
+        """
+        Queue write(*args, **kwargs), printing message once it has succeeded.
+
+        Returns:
+        - Future of the result of write
+        """
+        future = Future()
+        if self._thread is None:
+            future.set_result(write(*args, **kwargs))
+            if message:
+                print(message)
+            return future
+        self._queue.put((write, args, kwargs, message, group, future))
+        return future
+
+    def when_done(self, group, callback):
+        """
+        Call callback(error) once the writes submitted so far have run, with
+        error the first exception raised by a write of group, or None if they
+        all succeeded. The callback runs on the writer thread.
+        """
+        if self._thread is None:
+            # Failed synchronous writes have already raised
+            callback(None)
+            return
+        self.submit(lambda: callback(self._group_errors.pop(group, None)))
+
+    def close(self):
+        """
+        Wait for the queued writes and report the ones that failed.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        for write, error in self._errors:
+            print(f"Error writing output with {getattr(write, '__name__', write)}: {error}")
+        self._errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is _STOP:
+                return
+            write, args, kwargs, message, group, future = task
+            try:
+                future.set_result(write(*args, **kwargs))
+                if message:
+                    print(message)
+            except Exception as e:
+                future.set_exception(e)
+                self._errors.append((write, e))
+                if group is not None:
+                    self._group_errors.setdefault(group, e)
+            del task, write, args, kwargs, future
@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import time
+import threading
+
+# Bump whenever a processing stage changes in a way that alters results, so
+# that files processed by an older pipeline are picked up again.
+PIPELINE_VERSION = '2'
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def file_fingerprint(file_path: str, previous: dict = None) -> dict:
+    """
+    Compute the fingerprint of an input file.
+
+    The content hash is only recomputed when size or modification time differ
+    from the previous fingerprint, so unchanged files on a network share are
+    not read again.
+
+    Parameters:
+    - file_path: Path to the input file
+    - previous: Optional fingerprint recorded by an earlier run
+
+    Returns:
+    - Dictionary with 'size', 'mtime_ns' and 'sha1'
+    """
+    st = os.stat(file_path)
+    if previous and previous.get('size') == st.st_size and previous.get('mtime_ns') == st.st_mtime_ns:
+        return dict(previous)
+
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1.hexdigest()}
+
+
+class Manifest:
+    """
+    Append-only JSON-lines record of every processed input file.
+
+    Each line holds the input path, its fingerprint, the pipeline version, the
+    processing parameters, the status ('done' or 'failed') and the locations of
+    the per-file outputs. The last line written for a path wins, so a crash
+    never corrupts earlier entries and a rerun can resume where it stopped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partially written last line from a crashed run
+                        continue
+                    self.entries[entry['input']] = entry
+
+    def needs_processing(self, file_path: str, params: dict) -> bool:
+        """
+        Return True if the file is new, changed, failed previously, or was
+        processed with a different pipeline version or parameters.
+        """
+        entry = self.entries.get(file_path)
+        if entry is None or entry['status'] != STATUS_DONE:
+            return True
+        if entry['pipeline_version'] != PIPELINE_VERSION or entry['params'] != params:
+            return True
+        if not all(os.path.exists(p) for p in _output_paths(entry['outputs'])):
+            return True
+        try:
+            fingerprint = file_fingerprint(file_path, entry['fingerprint'])
+        except OSError:
+            return True
+        return fingerprint['sha1'] != entry['fingerprint']['sha1']
+
+    def is_unchanged(self, file_path: str) -> bool:
+        """
+        Return True if file_path has an entry and its size and mtime are
+        still the recorded ones, without reading the file.
+        """
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == (entry['fingerprint']['size'], entry['fingerprint']['mtime_ns'])
+
+    def record(self, file_path: str, params: dict, status: str, outputs: dict = None, error: str = None):
+        """
+        Append an entry for file_path and flush it to disk immediately.
+        Safe to call from several threads.
+        """
+        with self._lock:
+            self._record(file_path, params, status, outputs, error)
+
+    def _record(self, file_path, params, status, outputs, error):
+        previous = self.entries.get(file_path)
+        entry = {
+            'input': file_path,
+            'fingerprint': file_fingerprint(file_path, previous['fingerprint'] if previous else None),
+            'pipeline_version': PIPELINE_VERSION,
+            'params': params,
+            'status': status,
+            'outputs': outputs or {},
+            'error': error,
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[file_path] = entry
+
+    def completed(self, file_paths=None) -> list:
+        """
+        Return the entries with status 'done', optionally restricted to file_paths.
+        """
+        if file_paths is None:
+            file_paths = self.entries.keys()
+        return [self.entries[p] for p in file_paths
+                if p in self.entries and self.entries[p]['status'] == STATUS_DONE]
+
+    def failed(self) -> list:
+        """
+        Return the entries whose last recorded status is 'failed'.
+        """
+        return [e for e in self.entries.values() if e['status'] == STATUS_FAILED]
+
+
+def _output_paths(outputs: dict) -> list:
+    # Output values can be paths, lists of paths or plain values (e.g. means)
+    paths = []
+    for value in outputs.values():
+        if isinstance(value, str):
+            paths.append(value)
+        elif isinstance(value, list):
+            paths.extend(v for v in value if isinstance(v, str))
+    return paths
@@ -0,0 +1,114 @@
+import os
+import sys
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+
+
+def current_rss(include_children: bool = False) -> int:
+    """
+    Resident set size of this process in bytes, optionally plus that of its
+    child processes (worker pools).
+
+    Uses psutil if it is installed, /proc on Linux otherwise. Without either,
+    the peak RSS reported by getrusage is returned instead.
+    """
+    if psutil is not None:
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        if include_children:
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        return rss
+
+    if os.path.exists('/proc/self/statm'):
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        rss = _statm_rss('/proc/self/statm', page_size)
+        if include_children:
+            for pid in _child_pids(os.getpid()):
+                rss += _statm_rss(f'/proc/{pid}/statm', page_size)
+        return rss
+
+    import resource
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    if include_children:
+        rss += resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return rss
+
+
+def _statm_rss(path: str, page_size: int) -> int:
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().split()[1]) * page_size
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _child_pids(pid: int) -> list:
+    children = []
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+            children = [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+    for child in list(children):
+        children.extend(_child_pids(child))
+    return children
+
+
+class MemoryGovernor:
+    """
+    Samples the RSS of the run (including worker processes) in a background
+    thread and reports when it exceeds a budget.
+
+    The batch runner checks over_budget() after every file and reacts by
+    running fewer files at once and, at one file at a time, by switching to
+    low-memory processing. The peak is reset after every check, so the
+    governor reacts to the memory used since the last decision.
+    """
+
+    def __init__(self, budget_mb: float, interval: float = 0.2):
+        self.budget = budget_mb * MB
+        self.interval = interval
+        self.peak_rss = current_rss(include_children=True)
+        self.run_peak_rss = self.peak_rss
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-governor', daemon=True)
+        self._thread.start()
+
+    def over_budget(self) -> bool:
+        """
+        Return True if the RSS exceeded the budget since the last call.
+        """
+        with self._lock:
+            peak = max(self.peak_rss, current_rss(include_children=True))
+            self.peak_rss = 0
+        return peak > self.budget
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss(include_children=True)
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+                self.run_peak_rss = max(self.run_peak_rss, rss)
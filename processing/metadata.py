@@ -0,0 +1,11 @@
+import numpy as np
+
+
+def to_builtin(value):
+    """
+    json.dumps default for the reader metadata: NumPy scalars become Python
+    numbers and any other object its string.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
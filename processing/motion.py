@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+
+from processing.precision import ACCUMULATOR
+from processing.instrumentation import span
+from processing.tddr import tddr
+
+# 'tddr' repairs every sample of every channel, 'spline' only corrects the
+# segments flagged by detect_motion, 'spline+tddr' runs TDDR after the spline
+# correction and 'none' leaves the signals as they are
+METHODS = ('tddr', 'spline', 'spline+tddr', 'none')
+
+
+def detect_motion(data: pd.DataFrame, sample_rate: float, window_seconds: float = 0.5, sd_threshold: float = 5.0,
+                  amp_threshold: float = 10.0, mask_seconds: float = 1.0) -> pd.DataFrame:
+    """
+    Flag motion artifacts in every float column at once.
+
+    A window of window_seconds is flagged when its standard deviation, or the
+    change of the signal across it, exceeds sd_threshold (amp_threshold) times
+    the median over all windows of the channel. Thresholds relative to each
+    channel's own typical variability work the same for concentrations and
+    optical densities. The moving sums are computed from cumulative sums, so
+    the cost does not depend on the window length. Every sample of a flagged
+    window and mask_seconds on either side of it is marked.
+
+    Parameters:
+    - data: DataFrame of fNIRS channels
+    - sample_rate: Sampling rate of the data in Hz
+    - window_seconds: Length of the moving window
+    - sd_threshold: Moving standard deviation threshold, in medians of the channel
+    - amp_threshold: Amplitude change threshold, in medians of the channel
+    - mask_seconds: Margin marked around flagged windows
+
+    Returns:
+    - Boolean DataFrame of the float columns, True where motion was detected
+    """
+    columns = [col for col in data.columns if pd.api.types.is_float_dtype(data[col])]
+    values = data[columns].to_numpy(dtype=ACCUMULATOR)
+    n = len(values)
+    w = max(int(round(window_seconds * sample_rate)), 2)
+    if n <= w:
+        return pd.DataFrame(False, index=data.index, columns=columns)
+
+    # Moving mean and variance of every window [i, i + w), centered to limit cancellation
+    centered = values - values.mean(axis=0)
+    zeros = np.zeros((1, len(columns)))
+    sums = np.concatenate([zeros, np.cumsum(centered, axis=0)])
+    squares = np.concatenate([zeros, np.cumsum(centered ** 2, axis=0)])
+    mean = (sums[w:] - sums[:-w]) / w
+    sd = np.sqrt(np.maximum((squares[w:] - squares[:-w]) / w - mean ** 2, 0.0))
+    amp = np.abs(values[w - 1:] - values[:n - w + 1])
+
+    sd_scale = np.median(sd, axis=0)
+    amp_scale = np.median(amp, axis=0)
+    flagged = ((sd > sd_threshold * sd_scale) & (sd_scale > 0)) | ((amp > amp_threshold * amp_scale) & (amp_scale > 0))
+
+    # Sample t lies in windows t - w + 1 .. t, widened by the margin on both sides
+    margin = int(round(mask_seconds * sample_rate))
+    counts = np.concatenate([zeros, np.cumsum(flagged, axis=0)])
+    t = np.arange(n)
+    low = np.clip(t - w + 1 - margin, 0, len(flagged))
+    high = np.clip(t + margin + 1, 0, len(flagged))
+    mask = (counts[high] - counts[low]) > 0
+    return pd.DataFrame(mask, index=data.index, columns=columns)
+
+
+def motion_segments(mask: pd.DataFrame, sample_rate: float) -> pd.DataFrame:
+    """
+    List the flagged segments of a detect_motion mask, one row per segment.
+
+    Returns:
+    - DataFrame with 'Channel', 'Start sample', 'End sample' (exclusive),
+      'Start (s)' and 'Duration (s)'
+    """
+    rows = []
+    for col in mask.columns:
+        for start, stop in _runs(mask[col].to_numpy()):
+            rows.append({'Channel': col, 'Start sample': start, 'End sample': stop,
+                         'Start (s)': start / sample_rate, 'Duration (s)': (stop - start) / sample_rate})
+    return pd.DataFrame(rows, columns=['Channel', 'Start sample', 'End sample', 'Start (s)', 'Duration (s)'])
+
+
+def spline_correct(data: pd.DataFrame, mask: pd.DataFrame, sample_rate: float,
+                   cutoff_hz: float = 5.0) -> pd.DataFrame:
+    """
+    Correct the flagged segments of every channel by spline interpolation
+    (Scholkmann et al. 2010).
+
+    The artifact of a flagged segment is modelled by a smoothing spline that
+    follows the signal up to about cutoff_hz, and subtracted. Every segment
+    after it is then shifted so that its first second continues the level of
+    the last second before it, which removes the baseline jumps artifacts
+    leave behind. Channels without flagged segments are returned unchanged
+    and cost nothing.
+
+    Parameters:
+    - data: DataFrame of fNIRS channels
+    - mask: detect_motion mask of data
+    - sample_rate: Sampling rate of the data in Hz
+    - cutoff_hz: Frequency up to which the spline follows the artifact; steps
+      are only removed by a spline that follows them closely
+
+    Returns:
+    - DataFrame with corrected channels, in the float type of the input
+    """
+    from scipy.interpolate import make_smoothing_spline
+
+    # The spline minimises sum((y - f)^2) + lam * integral(f''^2) over time in seconds, which
+    # damps frequencies where lam * (2 pi f)^4 exceeds the sample spacing. A fixed lam costs a
+    # fraction of choosing one by cross-validation
+    lam = 1.0 / (sample_rate * (2 * np.pi * cutoff_hz) ** 4)
+    corrected_df = data.copy()
+    level_samples = max(int(sample_rate), 1)
+    for col in mask.columns[mask.any(axis=0).to_numpy()]:
+        flags = mask[col].to_numpy()
+        signal = data[col].to_numpy(dtype=ACCUMULATOR)
+        corrected = signal.copy()
+        for start, stop in _runs(flags):
+            if stop - start >= 5:
+                t = np.arange(stop - start, dtype=ACCUMULATOR) / sample_rate
+                spline = make_smoothing_spline(t, signal[start:stop], lam=lam)
+                corrected[start:stop] = signal[start:stop] - spline(t)
+
+        # Align every segment, flagged or not, to the end of the one before it
+        bounds = np.flatnonzero(np.diff(flags.astype(np.int8))) + 1
+        edges = np.concatenate([[0], bounds, [len(flags)]])
+        for previous_start, start, stop in zip(edges[:-2], edges[1:-1], edges[2:]):
+            before = corrected[max(previous_start, start - level_samples):start].mean()
+            after = corrected[start:min(stop, start + level_samples)].mean()
+            corrected[start:] += before - after
+        corrected_df[col] = corrected.astype(data[col].dtype, copy=False)
+    return corrected_df
+
+
+def correct_motion(data: pd.DataFrame, sample_rate: float, method: str = 'tddr', **detect_args) -> tuple:
+    """
+    Apply the motion correction selected by method, one of METHODS.
+
+    Parameters:
+    - data: DataFrame of fNIRS channels, other float columns are corrected as well
+    - sample_rate: Sampling rate of the data in Hz
+    - method: Motion correction to apply
+    - detect_args: Thresholds passed to detect_motion
+
+    Returns:
+    - (corrected DataFrame, detect_motion mask or None when motion was not detected)
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown motion correction: {method}, expected one of {METHODS}")
+    mask = None
+    corrected = data
+    if method.startswith('spline'):
+        with span('motion detection'):
+            mask = detect_motion(corrected, sample_rate, **detect_args)
+        with span('spline'):
+            corrected = spline_correct(corrected, mask, sample_rate)
+    if method.endswith('tddr'):
+        with span('tddr'):
+            corrected = tddr(corrected, sample_rate)
+    if corrected is data:
+        corrected = data.copy()
+    return corrected, mask
+
+
+def _runs(flags: np.ndarray) -> list:
+    # (start, stop) of every run of True values
+    padded = np.concatenate([[False], flags, [False]]).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return list(zip(changes[::2].tolist(), changes[1::2].tolist()))
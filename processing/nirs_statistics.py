@@ -1,9 +1,11 @@
 import pandas as pd
 import numpy as np
-from scipy import integrate
-from scipy import stats
 
 def calculate_statistics(segments: dict, file: str, subject_id: str, condition: str, timepoint: str) -> pd.DataFrame:
+    # scipy is imported on first use so the entry points start quickly
+    from scipy import integrate
+    from scipy import stats
+
     stats_dict = {
         'Subject': subject_id,
         'Condition': condition,
@@ -22,17 +24,20 @@ def calculate_statistics(segments: dict, file: str, subject_id: str, condition:
                 print(f"Warning: Column {col} in segment {seg_name} is empty or all NaN for file {file}. Skipping calculations for this column.")
                 continue
 
+            # Statistics are computed in float64 also for float32 signals
+            values = seg_df[col].astype('float64')
+
             # 1. Mean oxygenation
-            stats_dict[f'{seg_name} {col} Mean'] = seg_df[col].mean()
+            stats_dict[f'{seg_name} {col} Mean'] = values.mean()
 
             # 2. Standard deviation of oxygenation
-            stats_dict[f'{seg_name} {col} StdDev'] = seg_df[col].std()
+            stats_dict[f'{seg_name} {col} StdDev'] = values.std()
 
             # 3. Peak amplitude
-            stats_dict[f'{seg_name} {col} Peak Amplitude'] = seg_df[col].max() - seg_df[col].min()
+            stats_dict[f'{seg_name} {col} Peak Amplitude'] = values.max() - values.min()
 
             # 4. Time to peak
-            max_idx = seg_df[col].idxmax()
+            max_idx = values.idxmax()
             if pd.isna(max_idx):
                 print(f"Warning: Cannot find peak in column {col} for segment {seg_name} in file {file}.")
                 stats_dict[f'{seg_name} {col} Time to Peak'] = np.nan
@@ -41,11 +46,11 @@ def calculate_statistics(segments: dict, file: str, subject_id: str, condition:
                 stats_dict[f'{seg_name} {col} Time to Peak'] = peak_time - seg_df['Time'].iloc[0]
 
             # 5. Area under the curve
-            auc = integrate.trapz(seg_df[col], seg_df['Time'])
+            auc = integrate.trapz(values, seg_df['Time'])
             stats_dict[f'{seg_name} {col} AUC'] = auc
 
             # 6. Slope (linear trend)
-            slope, _, _, _, _ = stats.linregress(seg_df['Time'], seg_df[col])
+            slope, _, _, _, _ = stats.linregress(seg_df['Time'], values)
             stats_dict[f'{seg_name} {col} Slope'] = slope
 
     return pd.DataFrame([stats_dict])
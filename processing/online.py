@@ -0,0 +1,214 @@
+import time
+
+import numpy as np
+
+from processing.average_channels import roi_weights, ROI_COLUMNS
+from processing.filter import BANDPASS_WN
+
+# Short channels of the 8-channel montage, as in the baseline-corrected pipeline
+SHORT_CHANNELS = [7, 8]
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the latest samples of every channel.
+
+    Samples are stored in a (capacity x channels) array that is overwritten
+    from the oldest sample on once it is full, so memory stays constant
+    however long the stream runs.
+    """
+
+    def __init__(self, capacity: int, n_channels: int, dtype: str = 'float64'):
+        self.capacity = int(capacity)
+        self._data = np.full((self.capacity, n_channels), np.nan, dtype=dtype)
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def extend(self, values: np.ndarray):
+        """
+        Append samples of shape (samples x channels).
+        """
+        n = len(values)
+        # Only the last capacity samples are kept, written where they would have landed
+        values = values[-self.capacity:]
+        start = (self.total + n - len(values)) % self.capacity
+        first = min(len(values), self.capacity - start)
+        self._data[start:start + first] = values[:first]
+        self._data[:len(values) - first] = values[first:]
+        self.total += n
+
+    def latest(self, n: int = None) -> np.ndarray:
+        """
+        Return a copy of the latest n samples (all buffered samples by default), oldest first.
+        """
+        n = len(self) if n is None else min(int(n), len(self))
+        end = self.total % self.capacity
+        return np.take(self._data, np.arange(end - n, end), axis=0, mode='wrap')
+
+
+class CausalBandpass:
+    """
+    Butterworth bandpass applied sample by sample with the filter state kept
+    between calls.
+
+    The offline pipelines filter zero-phase with filtfilt, which needs the
+    whole recording. This causal filter only uses past samples, at the cost
+    of a phase delay of several seconds at the 0.01-0.1 Hz band.
+    """
+
+    def __init__(self, n_channels: int, sample_rate: float, Wn=BANDPASS_WN, order: int = 3):
+        from scipy.signal import butter
+        self.sos = butter(order, list(Wn), btype='bandpass', output='sos', fs=sample_rate)
+        self.n_channels = n_channels
+        self._zi = None
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:
+        from scipy.signal import sosfilt, sosfilt_zi
+        if self._zi is None:
+            # Start in the steady state of the first sample to avoid a step response
+            self._zi = sosfilt_zi(self.sos)[:, :, None] * values[0][None, None, :]
+        filtered, self._zi = sosfilt(self.sos, values, axis=0, zi=self._zi)
+        return filtered
+
+
+class OnlineSSC:
+    """
+    Short channel regression with exponentially forgotten regression sums.
+
+    As in ssc_regression, every long channel y is corrected by y - beta * x
+    where x is the mean of the short channels, but beta = sum(x * y) / sum(x * x)
+    is computed over the samples up to the current one with weights that halve
+    every half_life_seconds. beta is updated with every sample, so the output
+    does not depend on how the stream is split into batches.
+    """
+
+    def __init__(self, sample_rate: float, n_long: int, half_life_seconds: float = 30.0):
+        half_life = half_life_seconds * sample_rate
+        self.decay = 0.5 ** (1.0 / half_life)
+        # Batches are processed in blocks over which decay ** -k grows at most 2 ** 32 times
+        self.block = max(int(32 * half_life), 1)
+        self.sxy = np.zeros(n_long)
+        self.sxx = 0.0
+
+    def __call__(self, long_values: np.ndarray, short_values: np.ndarray) -> np.ndarray:
+        x = short_values.mean(axis=1)
+        corrected = np.empty(long_values.shape)
+        for start in range(0, len(x), self.block):
+            xb = x[start:start + self.block]
+            yb = long_values[start:start + self.block]
+            # Sums after sample k of the block: decay ** k * (decay * sums before the block
+            # + cumulative sum of decay ** -j * x_j * y_j), for every k at once
+            scale = self.decay ** np.arange(len(xb))
+            sxy = scale[:, None] * (self.decay * self.sxy + np.cumsum((xb / scale)[:, None] * yb, axis=0))
+            sxx = scale * (self.decay * self.sxx + np.cumsum(xb * xb / scale))
+            beta = np.divide(sxy, sxx[:, None], out=np.zeros_like(sxy), where=sxx[:, None] > 0)
+            corrected[start:start + len(xb)] = yb - xb[:, None] * beta
+            self.sxy = sxy[-1]
+            self.sxx = sxx[-1]
+        return corrected
+
+
+class LatencyMeter:
+    """
+    End-to-end latency from the acquisition of a sample to the publication
+    of the result that includes it, over the latest capacity updates.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self._latencies = RingBuffer(capacity, 1)
+
+    def add(self, acquired_at: float, published_at: float):
+        self._latencies.extend(np.array([[published_at - acquired_at]]))
+
+    def summary(self) -> dict:
+        """
+        Return the 'count', 'p50_ms', 'p95_ms', 'p99_ms' and 'max_ms' of the recorded latencies.
+        """
+        latencies = self._latencies.latest()[:, 0] * 1000
+        if not len(latencies):
+            return {'count': 0}
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {'count': self._latencies.total, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                'max_ms': latencies.max()}
+
+
+class OnlinePipeline:
+    """
+    Online counterpart of the baseline-corrected chain for streamed samples:
+    causal bandpass of every channel, short channel regression of the long
+    channels and averaging into the regions of average_channels.
+
+    Every batch of samples publishes an update to the subscribers with the
+    latest grand oxy/deoxy, their rolling means over rolling_seconds and the
+    end-to-end latency of the newest sample. The raw and region signals of
+    the last buffer_seconds are kept in ring buffers.
+    """
+
+    def __init__(self, channels: list, sample_rate: float, channels_to_exclude=None, buffer_seconds: float = 120,
+                 rolling_seconds: float = 10):
+        channels_to_exclude = channels_to_exclude or []
+        self.channels = list(channels)
+        self.sample_rate = sample_rate
+        channel_number = {col: int(col.split()[0][2:]) for col in self.channels}
+        self.short_idx = [i for i, col in enumerate(self.channels)
+                          if channel_number[col] in SHORT_CHANNELS and channel_number[col] not in channels_to_exclude]
+        self.long_idx = [i for i, col in enumerate(self.channels)
+                         if channel_number[col] not in SHORT_CHANNELS and channel_number[col] not in channels_to_exclude]
+        long_columns = [self.channels[i] for i in self.long_idx]
+        self.weights = roi_weights(long_columns, channels_to_exclude).to_numpy()
+
+        self.bandpass = CausalBandpass(len(self.channels), sample_rate)
+        self.ssc = OnlineSSC(sample_rate, len(self.long_idx)) if self.short_idx else None
+        capacity = int(buffer_seconds * sample_rate)
+        self.raw = RingBuffer(capacity, len(self.channels))
+        self.roi = RingBuffer(capacity, len(ROI_COLUMNS))
+        self.rolling_samples = max(int(rolling_seconds * sample_rate), 1)
+        self.latency = LatencyMeter()
+        self._subscribers = []
+        self._grand = [ROI_COLUMNS.index('grand oxy'), ROI_COLUMNS.index('grand deoxy')]
+
+    def subscribe(self, callback):
+        """
+        Call callback(update) with every published update, see push().
+        """
+        self._subscribers.append(callback)
+
+    def push(self, samples: np.ndarray, acquired_at: np.ndarray, values: np.ndarray) -> dict:
+        """
+        Process a batch of streamed samples and publish the update.
+
+        Parameters:
+        - samples: Sample indices of the batch
+        - acquired_at: Acquisition times of the samples, in seconds since the epoch
+        - values: Samples x channels values in the order of channels
+
+        Returns:
+        - The published update: 'sample', 'time' (s since the first sample),
+          'grand oxy', 'grand deoxy', 'rolling grand oxy', 'rolling grand deoxy'
+          and 'latency_ms'
+        """
+        self.raw.extend(values)
+        filtered = self.bandpass(values)
+        long_values = filtered[:, self.long_idx]
+        if self.ssc is not None:
+            long_values = self.ssc(long_values, filtered[:, self.short_idx])
+        self.roi.extend(long_values @ self.weights)
+
+        recent = self.roi.latest(self.rolling_samples)[:, self._grand]
+        rolling = recent.mean(axis=0)
+        published_at = time.time()
+        self.latency.add(float(acquired_at[-1]), published_at)
+        update = {
+            'sample': int(samples[-1]),
+            'time': int(samples[-1]) / self.sample_rate,
+            'grand oxy': float(recent[-1, 0]),
+            'grand deoxy': float(recent[-1, 1]),
+            'rolling grand oxy': float(rolling[0]),
+            'rolling grand deoxy': float(rolling[1]),
+            'latency_ms': (published_at - float(acquired_at[-1])) * 1000,
+        }
+        for callback in self._subscribers:
+            callback(update)
+        return update
@@ -0,0 +1,199 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+# Traces are decimated to at most this many points before rendering
+MAX_POINTS = 2000
+
+
+def bin_means(values: np.ndarray, samples_per_bin: int, first_sample: int = 0) -> tuple:
+    """
+    Average consecutive samples into bins with a single NumPy reshape.
+
+    Bins are aligned to multiples of samples_per_bin in absolute sample
+    numbers, so with samples_per_bin equal to the sampling rate the result
+    matches grouping by whole seconds. Partial first and last bins are
+    averaged over the samples they hold.
+
+    Parameters:
+    - values: 1-D or 2-D (samples x traces) array of contiguous samples
+    - samples_per_bin: Number of samples per bin
+    - first_sample: Absolute sample number of values[0]
+
+    Returns:
+    - (bin numbers, bin means) with one row per bin
+    """
+    bins, binned, squeeze = _reshape_bins(values, samples_per_bin, first_sample)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.nanmean(binned, axis=1)
+    return bins, means[:, 0] if squeeze else means
+
+
+def bin_min_max(values: np.ndarray, samples_per_bin: int, first_sample: int = 0) -> tuple:
+    """
+    Minimum and maximum of consecutive samples per bin, see bin_means. Unlike
+    the mean, the min/max envelope keeps spikes and motion artifacts visible
+    after decimation.
+
+    Returns:
+    - (bin numbers, bin minima, bin maxima)
+    """
+    bins, binned, squeeze = _reshape_bins(values, samples_per_bin, first_sample)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        minima = np.nanmin(binned, axis=1)
+        maxima = np.nanmax(binned, axis=1)
+    if squeeze:
+        return bins, minima[:, 0], maxima[:, 0]
+    return bins, minima, maxima
+
+
+def _reshape_bins(values, samples_per_bin, first_sample):
+    # Pad with NaN to whole bins and reshape to (bins x samples per bin x traces)
+    values = np.asarray(values, dtype='float64')
+    squeeze = values.ndim == 1
+    if squeeze:
+        values = values[:, None]
+    k = max(int(samples_per_bin), 1)
+    first_bin, offset = divmod(int(first_sample), k)
+
+    n_bins = -(-(offset + len(values)) // k)
+    padded = np.full((n_bins * k, values.shape[1]), np.nan)
+    padded[offset:offset + len(values)] = values
+    bins = first_bin + np.arange(n_bins)
+    return bins, padded.reshape(n_bins, k, values.shape[1]), squeeze
+
+
+def decimate_trace(values: np.ndarray, sample_rate: float, max_points: int = MAX_POINTS) -> tuple:
+    """
+    Decimate a trace starting at time 0 to at most max_points bin means.
+
+    Returns:
+    - (time of each bin start in seconds, bin means)
+    """
+    k = max(-(-len(values) // max_points), 1)
+    bins, means = bin_means(values, k)
+    return bins * k / sample_rate, means
+
+
+def render_mean_signals(seconds, oxy, deoxy, events, output_file):
+    """
+    Render the per-second mean HbO/HbR plot with event markers to a file.
+
+    Parameters:
+    - seconds, oxy, deoxy: Arrays of the binned traces
+    - events: List of (second, label) pairs
+    - output_file: Path of the image to write, or None to show the plot
+    """
+    fig = _new_figure(output_file)
+    ax = fig.add_subplot()
+    ax.plot(seconds, oxy, label='Mean HbO', color='red')
+    ax.plot(seconds, deoxy, label='Mean HbR', color='blue')
+
+    # Annotations are placed at the maximum signal value
+    max_signal = max(np.nanmax(oxy), np.nanmax(deoxy))
+    for second, label in events:
+        ax.axvline(x=second, color='green', linestyle='--', alpha=0.7)
+        ax.text(second, max_signal, str(label), rotation=90, verticalalignment='bottom', color='green')
+
+    ax.set_title('Overall Mean HbO and HbR Signals Over Time')
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Signal Amplitude')
+    ax.legend()
+    ax.grid(True)
+    fig.tight_layout()
+    if _save_figure(fig, output_file):
+        print(f"Plot saved to {output_file}")
+
+
+def render_signals(time_points, oxy, deoxy, title, output_file):
+    """
+    Render the oxygenated/deoxygenated walking signals to a file.
+    """
+    fig = _new_figure(output_file)
+    ax = fig.add_subplot()
+    ax.plot(time_points, oxy, 'r-', label='Oxygenated')
+    ax.plot(time_points, deoxy, 'b-', label='Deoxygenated')
+    ax.set_xlabel('Time (seconds)')
+    ax.set_ylabel('Signal Amplitude')
+    ax.set_title(title)
+    ax.legend()
+    ax.grid(True)
+    if _save_figure(fig, output_file):
+        print(f"Signal plot saved to {output_file}")
+
+
+def _new_figure(output_file):
+    # Saved plots are drawn on a bare Agg canvas; pyplot is only used to show
+    if output_file is None:
+        import matplotlib.pyplot as plt
+        return plt.figure(figsize=(12, 6))
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _save_figure(fig, output_file) -> bool:
+    if output_file is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+        return False
+    fig.savefig(output_file)
+    return True
+
+
+class PlotQueue:
+    """
+    Renders plots on a worker process so numeric processing does not wait for
+    them.
+
+    Callers bin/decimate their traces first and submit one of the render_*
+    functions with the small arrays, so little data crosses the process
+    boundary. Rendering uses the Agg canvas directly and never touches pyplot
+    state. With enabled=False every submitted plot is skipped, e.g. in batch
+    runs where only the numbers are needed.
+    """
+
+    def __init__(self, max_workers: int = 1, enabled: bool = True, use_processes: bool = True):
+        self.enabled = enabled
+        self._executor = None
+        self._futures = []
+        if enabled:
+            executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            self._executor = executor_class(max_workers=max_workers)
+
+    def submit(self, render, *args):
+        """
+        Queue render(*args), or render synchronously if the queue is closed.
+        """
+        if not self.enabled:
+            return
+        if self._executor is None:
+            render(*args)
+            return
+        self._futures.append((self._executor.submit(render, *args), args[-1]))
+
+    def close(self):
+        """
+        Wait for the queued plots and report the ones that failed.
+        """
+        if self._executor is None:
+            return
+        for future, output_file in self._futures:
+            error = future.exception()
+            if error is not None:
+                print(f"Error rendering plot {output_file}: {error}")
+        self._futures = []
+        self._executor.shutdown()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
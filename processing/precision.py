@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+# Floating point types recordings can be processed in. The readers cast the
+# channels to the chosen type and every stage keeps the type of its input,
+# so float32 halves the memory and bandwidth of a recording. Accumulations
+# (regression dot products, baseline means, TDDR weights and cumulative sums,
+# statistics) are computed in ACCUMULATOR whatever the signal type.
+DTYPES = ('float64', 'float32')
+ACCUMULATOR = np.float64
+
+
+def resolve_dtype(dtype) -> np.dtype:
+    """
+    Validate a signal dtype ('float64', 'float32' or the numpy types).
+    """
+    resolved = np.dtype(dtype)
+    if resolved.name not in DTYPES:
+        raise ValueError(f"Unsupported signal dtype: {resolved.name}, expected one of {DTYPES}")
+    return resolved
+
+
+def signal_dtype(df: pd.DataFrame, columns=None) -> np.dtype:
+    """
+    Type to process the float channels of df in: float32 when all of them
+    are float32, float64 otherwise.
+    """
+    columns = df.columns if columns is None else columns
+    dtypes = {df[col].dtype for col in columns if pd.api.types.is_float_dtype(df[col])}
+    return np.dtype('float32') if dtypes == {np.dtype('float32')} else np.dtype('float64')
+
+
+def cast_channels(df: pd.DataFrame, dtype) -> pd.DataFrame:
+    """
+    Cast the float channel columns of df to dtype in place and return df.
+    'Sample number' and 'Event' are left as they are.
+    """
+    dtype = resolve_dtype(dtype)
+    columns = [col for col in df.columns
+               if col not in ['Sample number', 'Event'] and pd.api.types.is_float_dtype(df[col])
+               and df[col].dtype != dtype]
+    if columns:
+        df[columns] = df[columns].astype(dtype)
+    return df
@@ -3,16 +3,79 @@ import pandas as pd
 import numpy as np
 import warnings
 
-from processing.read_txt import read_txt_file
-from processing.filter import fir_filter
+from processing.readers import read_recording
+from processing.filter import fir_filter, BANDPASS_ORDER, BANDPASS_WN
 from processing.ssc_regression import ssc_regression
-from processing.tddr import tddr
+from processing.motion import correct_motion, motion_segments
 from processing.baseline import baseline_subtraction
 from processing.average_channels import average_channels
 from processing.nirs_statistics import calculate_statistics, split_segments
 from processing.plot_mean_signals import plot_mean_signals  # Ensure this is imported
-
-def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
+from processing.snirf import write_snirf
+from processing.resample import get_sample_rate, resample_recording
+from processing.report import write_panel
+from processing.instrumentation import span
+from processing.io_pipeline import OutputWriter
+from processing.connectivity import segment_connectivity, hemispheric_summary, save_connectivity
+
+def get_base_filename(file_path, dir_path):
+    """
+    Build the unique base filename used for a file's outputs from its path
+    relative to dir_path.
+    """
+    base_filename = os.path.relpath(file_path, dir_path).replace(os.sep, '_')
+    return os.path.splitext(base_filename)[0]
+
+
+def process_file(file_path, output_folder, dir_path, NIRSsamprate=50, snirf_folder=None, save_statistics=True,
+                 plot_queue=None, report_folder=None, low_memory=False, dtype='float64', recording=None,
+                 writer=None, motion_correction='tddr', connectivity_folder=None):
+    """
+    Process a single Oxysoft .txt file and save its statistics and mean signal plot.
+    Other formats of processing.readers are read as well, as long as their
+    event markers follow the Oxysoft S1/S2/S3 layout.
+
+    NIRSsamprate is the analysis sampling rate; recordings sampled at a
+    different rate are resampled to it first.
+
+    If snirf_folder is given, the motion corrected and bandpass filtered
+    channels are also exported there as SNIRF. With save_statistics=False the
+    statistics are only returned, e.g. for a ResultsSink, and no per-file
+    CSV is written. The mean signal plot is rendered through plot_queue if
+    one is given. If report_folder is given, a panel with the averaged traces,
+    events and quality metrics is added to the cohort report there.
+
+    With low_memory=True the file is read without holding all of its lines
+    in memory. dtype is the floating point type the channels are read and
+    processed in, 'float64' or 'float32', see processing.precision. Every
+    stage is timed as a span of the current tracer, see
+    processing.instrumentation.
+
+    recording is the reader result of file_path if it has already been read,
+    e.g. by a Prefetcher. If writer (an OutputWriter) is given, the SNIRF
+    export, statistics CSV and report panel are written by it in the
+    background, as writes of the group file_path (see OutputWriter.when_done).
+
+    motion_correction is one of processing.motion.METHODS. With the spline
+    methods the flagged motion segments are saved to a _motion_qc.csv file
+    next to the statistics.
+
+    If connectivity_folder is given, the channel x channel correlation and
+    coherence matrices of the walking segments are saved there, see
+    processing.connectivity.
+    """
+    subject_id = os.path.relpath(file_path, dir_path).split(os.sep)[0]
+    with span('process_file', file=file_path, subject=subject_id):
+        return _process_file(file_path, output_folder, dir_path, NIRSsamprate, snirf_folder, save_statistics,
+                             plot_queue, report_folder, low_memory, dtype, recording, writer, motion_correction,
+                             connectivity_folder)
+
+
+def _process_file(file_path, output_folder, dir_path, NIRSsamprate, snirf_folder, save_statistics,
+                  plot_queue, report_folder, low_memory, dtype, recording, writer, motion_correction,
+                  connectivity_folder):
+    if writer is None:
+        writer = OutputWriter(enabled=False)
     print(f"Processing file: {file_path}")
 
     # Initialize a flag to indicate if the specific warning occurred
@@ -43,7 +106,11 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
         warnings.simplefilter("always")
 
         # Read and structure the data
-        result = read_txt_file(file_path)
+        if recording is not None:
+            result = recording
+        else:
+            with span('read'):
+                result = read_recording(file_path, low_memory=low_memory, dtype=dtype)
         dataMatrix = result['data']
         metadata = result['metadata']
 
@@ -52,6 +119,11 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
             print(f"Error: Could not read the file {file_path}. Please check the format.")
             return None, False
 
+        # Bring the recording to the analysis sampling rate
+        file_samprate = get_sample_rate(metadata, default=NIRSsamprate)
+        with span('resample'):
+            dataMatrix = resample_recording(dataMatrix, file_samprate, NIRSsamprate)
+
         # Exclude 'Sample number' and 'Event' columns
         data_columns = dataMatrix.columns[1:-1]  # Data columns only
         num_channels = len(data_columns) // 2  # Number of channels
@@ -75,8 +147,8 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
         # Assign the new column names
         dataMatrix.columns = data_column_names
 
-        # Proceed with dataMatrix as df
-        df = dataMatrix.copy()
+        # Proceed with dataMatrix as df, it is not used afterwards
+        df = dataMatrix
 
         # Remove initial second of data and reset index
         df = df.iloc[NIRSsamprate:].reset_index(drop=True)
@@ -88,28 +160,29 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
         df['Event'] = pd.NA
 
         # Identify and exclude columns with all zeros
-        for i in range(1, num_channels + 1):
-            hbo_col = f'CH{i} HbO'
-            hbr_col = f'CH{i} HbR'
-
-            if hbo_col in df.columns and hbr_col in df.columns:
-                # Check if either HbO or HbR column has all zeros
-                hbo_zero = df[hbo_col].eq(0).all()
-                hbr_zero = df[hbr_col].eq(0).all()
-                if hbo_zero or hbr_zero:
-                    # Add channel number to the exclusion list
-                    channels_to_exclude.append(i)
-                    zero_col = 'HbO and HbR' if hbo_zero and hbr_zero else ('HbO' if hbo_zero else 'HbR')
-                    print(f"Channel {i} has zero data in {zero_col}. Excluding both HbO and HbR columns for this channel.")
-
-        # Exclude the identified channels
-        for ch in channels_to_exclude:
-            hbo_col = f'CH{ch} HbO'
-            hbr_col = f'CH{ch} HbR'
-            if hbo_col in df.columns:
-                df.drop(columns=[hbo_col], inplace=True)
-            if hbr_col in df.columns:
-                df.drop(columns=[hbr_col], inplace=True)
+        with span('zero channel check'):
+            for i in range(1, num_channels + 1):
+                hbo_col = f'CH{i} HbO'
+                hbr_col = f'CH{i} HbR'
+
+                if hbo_col in df.columns and hbr_col in df.columns:
+                    # Check if either HbO or HbR column has all zeros
+                    hbo_zero = df[hbo_col].eq(0).all()
+                    hbr_zero = df[hbr_col].eq(0).all()
+                    if hbo_zero or hbr_zero:
+                        # Add channel number to the exclusion list
+                        channels_to_exclude.append(i)
+                        zero_col = 'HbO and HbR' if hbo_zero and hbr_zero else ('HbO' if hbo_zero else 'HbR')
+                        print(f"Channel {i} has zero data in {zero_col}. Excluding both HbO and HbR columns for this channel.")
+
+            # Exclude the identified channels
+            for ch in channels_to_exclude:
+                hbo_col = f'CH{ch} HbO'
+                hbr_col = f'CH{ch} HbR'
+                if hbo_col in df.columns:
+                    df.drop(columns=[hbo_col], inplace=True)
+                if hbr_col in df.columns:
+                    df.drop(columns=[hbr_col], inplace=True)
 
         # Write excluded channels to a TXT file if any channels were excluded
         if channels_to_exclude:
@@ -177,15 +250,21 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
             long_data = df[long_channel_cols].copy()
 
             # Apply short channel regression
-            long_corrected_data = ssc_regression(long_data, short_data)
+            with span('ssc'):
+                long_corrected_data = ssc_regression(long_data, short_data)
 
             # Ensure 'Sample number' and 'Event' columns are preserved
             long_corrected = long_corrected_data.copy()
             long_corrected['Sample number'] = df['Sample number']
             long_corrected['Event'] = df['Event']
 
-        # TDDR Motion Correction
-        tddr_corrected_data = tddr(long_corrected, NIRSsamprate)
+        # Motion Correction, TDDR by default
+        tddr_corrected_data, motion_mask = correct_motion(long_corrected, NIRSsamprate, method=motion_correction)
+        if motion_mask is not None:
+            motion_output_file = os.path.join(output_folder, get_base_filename(file_path, dir_path) + '_motion_qc.csv')
+            with span('write motion qc'):
+                writer.submit(motion_segments(motion_mask, NIRSsamprate).to_csv, motion_output_file, index=False,
+                              group=file_path, message=f"Motion segments saved to {motion_output_file}")
 
         # Ensure 'Sample number' and 'Event' columns are preserved
         tddr_corrected = tddr_corrected_data.copy()
@@ -193,10 +272,21 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
         tddr_corrected['Event'] = df['Event']
 
         # Bandpass Filtering
-        filtered_data = fir_filter(tddr_corrected, order=1000, Wn=[0.01, 0.1], fs=NIRSsamprate)
+        with span('fir'):
+            filtered_data = fir_filter(tddr_corrected, order=BANDPASS_ORDER, Wn=BANDPASS_WN,
+                                       fs=NIRSsamprate)
+
+        # Export the corrected signals for other tools
+        if snirf_folder is not None:
+            snirf_output_file = os.path.join(snirf_folder, get_base_filename(file_path, dir_path) + '_processed.snirf')
+            with span('write snirf'):
+                writer.submit(write_snirf, snirf_output_file, filtered_data.copy(deep=False), NIRSsamprate,
+                              metadata, stage=f'ssc+{motion_correction}+fir',
+                              group=file_path, message=f"Processed signals saved to {snirf_output_file}")
 
         # Baseline Correction
-        baseline_corrected = baseline_subtraction(filtered_data, events_df)
+        with span('baseline'):
+            baseline_corrected = baseline_subtraction(filtered_data, events_df)
 
         # Ensure 'Sample number' and 'Event' columns are preserved
         baseline_corrected['Sample number'] = df['Sample number']
@@ -206,7 +296,8 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
         baseline_corrected.reset_index(drop=True, inplace=True)
 
         # Average Channels
-        averaged_df = average_channels(baseline_corrected, channels_to_exclude=channels_to_exclude)
+        with span('average'):
+            averaged_df = average_channels(baseline_corrected, channels_to_exclude=channels_to_exclude)
 
         # Create a time axis for plotting
         averaged_df['Time'] = averaged_df['Sample number'] / NIRSsamprate
@@ -244,22 +335,41 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
             return None, False
 
         # Statistical Analysis
-        stats_df = calculate_statistics(segments, file_path, subject_id, condition, timepoint)
+        with span('statistics'):
+            stats_df = calculate_statistics(segments, file_path, subject_id, condition, timepoint)
 
         # Generate a unique base filename based on the relative path
-        base_filename = os.path.relpath(file_path, dir_path).replace(os.sep, '_')
-        base_filename = os.path.splitext(base_filename)[0]
+        base_filename = get_base_filename(file_path, dir_path)
+
+        # Connectivity between the channels over the same segments
+        hemispheric = None
+        if connectivity_folder is not None:
+            with span('connectivity'):
+                channel_walking = baseline_corrected[
+                    (baseline_corrected['Sample number'] >= s2_sample) & (baseline_corrected['Sample number'] <= s3_sample)
+                    ].iloc[samples_to_exclude:-samples_to_exclude].reset_index(drop=True)
+                channel_walking['Time'] = channel_walking['Sample number'] / NIRSsamprate
+                connectivity = segment_connectivity(split_segments(channel_walking), NIRSsamprate)
+                hemispheric = hemispheric_summary(connectivity).set_index('Segment')
+            connectivity_output_file = os.path.join(connectivity_folder, base_filename + '_connectivity.npz')
+            with span('write connectivity'):
+                writer.submit(save_connectivity, connectivity_output_file, connectivity,
+                              group=file_path, message=f"Connectivity matrices saved to {connectivity_output_file}")
 
         # Now use base_filename for output files
         stats_output_file = os.path.join(output_folder, base_filename + '_statistics.csv')
         plot_output_file = os.path.join(output_folder, base_filename + '_mean_signals.png')
 
         # Save the statistical analysis to a CSV file
-        stats_df.to_csv(stats_output_file, index=False)
-        print(f"Statistical analysis saved to {stats_output_file}")
+        if save_statistics:
+            with span('write statistics'):
+                writer.submit(stats_df.to_csv, stats_output_file, index=False,
+                              group=file_path, message=f"Statistical analysis saved to {stats_output_file}")
 
         # Plot the mean signals
-        plot_mean_signals(averaged_df, events_df, NIRSsamprate=NIRSsamprate, output_file=plot_output_file)
+        with span('plot'):
+            plot_mean_signals(averaged_df, events_df, NIRSsamprate=NIRSsamprate, output_file=plot_output_file,
+                              plot_queue=plot_queue)
 
     # After processing, check for warnings
     for warning in w:
@@ -270,4 +380,32 @@ def process_file(file_path, output_folder, dir_path, NIRSsamprate=50):
     if invalid_divide_warning_occurred:
         print(f"Warning: 'invalid value encountered in divide' occurred during processing of {file_path}")
 
+    # Add the session to the cohort report
+    if report_folder is not None:
+        metrics = {
+            'Channels excluded': ', '.join(str(ch) for ch in channels_to_exclude) or 'none',
+            'Invalid divide warning': invalid_divide_warning_occurred,
+            'Walking duration (s)': len(walking_data_trimmed) / NIRSsamprate,
+        }
+        if motion_mask is not None:
+            metrics['Motion flagged (%)'] = 100 * motion_mask.to_numpy().mean()
+        if hemispheric is not None:
+            metrics['Left-right oxy coherence'] = hemispheric.loc['Overall', 'oxy coherence']
+            metrics['Left-right oxy correlation'] = hemispheric.loc['Overall', 'oxy correlation']
+        for col in ['Overall grand oxy Mean', 'Overall grand oxy StdDev', 'First Half grand oxy Mean',
+                    'Second Half grand oxy Mean', 'Overall grand oxy Slope']:
+            # Segments too short for a statistic (e.g. halves of short walks) have no column
+            metrics[col] = stats_df[col].iloc[0] if col in stats_df else np.nan
+        with span('write report panel'):
+            writer.submit(
+                write_panel,
+                report_folder, base_filename,
+                traces={'HbO': averaged_df['grand oxy'].to_numpy(), 'HbR': averaged_df['grand deoxy'].to_numpy()},
+                sample_rate=NIRSsamprate,
+                events=[(row['Sample number'] / NIRSsamprate, row['Event']) for _, row in events_df.iterrows()],
+                metrics=metrics,
+                info={'Subject': subject_id, 'Timepoint': timepoint, 'Condition': condition},
+                group=file_path
+            )
+
     return stats_df, invalid_divide_warning_occurred  # Return the stats_df and warning flag
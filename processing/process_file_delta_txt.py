@@ -3,13 +3,19 @@ import pandas as pd
 import numpy as np
 import warnings
 import logging
-import matplotlib.pyplot as plt
 
-from processing.read_txt import read_txt_file
-from processing.read_mat import read_mat
-from processing.filter import fir_filter
-from processing.tddr import tddr
+from processing.filter import fir_filter, BANDPASS_ORDER, BANDPASS_WN
+from processing.motion import correct_motion, motion_segments
 from processing.ssc_regression import ssc_regression
+from processing.snirf import write_snirf
+from processing.process_file_bc import get_base_filename
+from processing.resample import get_sample_rate, resample_recording
+from processing.plotting import decimate_trace, render_signals
+from processing.report import write_panel
+from processing.instrumentation import span
+from processing.io_pipeline import OutputWriter
+from processing.readers import read_recording
+from processing.precision import ACCUMULATOR
 
 
 def extract_timepoint(file_path):
@@ -20,7 +26,21 @@ def extract_timepoint(file_path):
     return timepoint
 
 
-def plot_signals(walking_data, subject_id, condition, output_folder):
+def extract_subject_condition(file_path):
+    """
+    Extracts the subject ID and condition from the file name.
+
+    Returns:
+        tuple: (subject_id, condition), 'Unknown' for parts that are not found
+    """
+    filename_without_ext = os.path.splitext(os.path.basename(file_path))[0]
+    for cond in ['LongWalk_ST', 'LongWalk_DT']:
+        if cond in filename_without_ext:
+            return filename_without_ext.replace(f'_{cond}_converted', ''), cond
+    return 'Unknown', 'Unknown'
+
+
+def plot_signals(walking_data, subject_id, condition, output_folder, NIRSsamprate=50, plot_queue=None):
     """
     Plots the average oxygenated and deoxygenated signals and saves the plot.
 
@@ -29,23 +49,20 @@ def plot_signals(walking_data, subject_id, condition, output_folder):
         subject_id (str): Subject identifier
         condition (str): Task condition (ST or DT)
         output_folder (str): Output directory for saving plots
+        NIRSsamprate (float): Sampling rate of walking_data in Hz
+        plot_queue (PlotQueue): Optional queue that renders the plot off the processing path
     """
-    plt.figure(figsize=(12, 6))
-    time_points = np.arange(len(walking_data)) / 50  # Assuming 50Hz sampling rate
-
-    plt.plot(time_points, walking_data['grand oxy'], 'r-', label='Oxygenated')
-    plt.plot(time_points, walking_data['grand deoxy'], 'b-', label='Deoxygenated')
-
-    plt.xlabel('Time (seconds)')
-    plt.ylabel('Signal Amplitude')
-    plt.title(f'Average Signals for Subject {subject_id} - {condition}')
-    plt.legend()
-    plt.grid(True)
+    if plot_queue is not None and not plot_queue.enabled:
+        return
 
+    time_points, signals = decimate_trace(walking_data[['grand oxy', 'grand deoxy']].to_numpy(), NIRSsamprate)
+    title = f'Average Signals for Subject {subject_id} - {condition}'
     plot_filename = os.path.join(output_folder, f"{subject_id}_{condition}_signals.png")
-    plt.savefig(plot_filename)
-    plt.close()
-    print(f"Signal plot saved to {plot_filename}")
+
+    if plot_queue is not None:
+        plot_queue.submit(render_signals, time_points, signals[:, 0], signals[:, 1], title, plot_filename)
+    else:
+        render_signals(time_points, signals[:, 0], signals[:, 1], title, plot_filename)
 
 
 def calculate_snr(walking_data, hbo_columns):
@@ -55,8 +72,8 @@ def calculate_snr(walking_data, hbo_columns):
     snr_list = []
     for col in hbo_columns:
         signal = walking_data[col].values
-        mean_signal = np.mean(signal)
-        std_signal = np.std(signal)
+        mean_signal = np.mean(signal, dtype=ACCUMULATOR)
+        std_signal = np.std(signal, dtype=ACCUMULATOR)
         snr = mean_signal / std_signal if std_signal != 0 else np.nan
         snr_list.append({'Channel': col, 'SNR': snr})
 
@@ -68,16 +85,71 @@ def process_file_delta_txt(
             output_folder,
             dir_path,
             NIRSsamprate=50,
-            st_data_dict=None,
+            cohort_aggregator=None,
             st_mean_hbo_dict=None,
             warnings_file=None,
             channels_excluded_file=None,
             all_snr_data=None,
-            all_ratio_data=None
+            all_ratio_data=None,
+            snirf_folder=None,
+            plot_queue=None,
+            report_folder=None,
+            low_memory=False,
+            dtype='float64',
+            recording=None,
+            writer=None,
+            motion_correction='tddr'
     ):
     """
     Process NIRS data files and calculate various metrics.
+
+    NIRSsamprate is the analysis sampling rate; recordings sampled at a
+    different rate are resampled to it first.
+
+    st_mean_hbo_dict maps (subject, timepoint) to the mean walking HbO of the
+    ST recording. ST files add their mean to it and DT files are expressed
+    relative to the mean of the same subject and timepoint.
+
+    If snirf_folder is given, the filtered, short channel regressed and TDDR
+    corrected signals are also exported there as SNIRF. If cohort_aggregator
+    is given, the walking grand oxy/deoxy time series is added to it under
+    the key ('ST' or 'DT', timepoint). Plots are rendered through plot_queue
+    if one is given. If report_folder is given, a panel with the grand
+    averages, walking window and quality metrics is added to the cohort
+    report there.
+
+    With low_memory=True .txt files are read without holding all of their
+    lines in memory. dtype is the floating point type the channels are read
+    and processed in, 'float64' or 'float32', see processing.precision.
+
+    recording is the reader result of file_path if it has already been
+    read, e.g. by a Prefetcher. If writer (an OutputWriter) is given, the
+    SNIRF export and report panel are written by it in the background, as
+    writes of the group file_path (see OutputWriter.when_done).
+
+    motion_correction is one of processing.motion.METHODS. With the spline
+    methods the flagged motion segments are saved to a _motion_qc.csv file
+    in output_folder.
+
+    Returns:
+        dict: Quality metrics of the walking window, None if the file could not be processed
     """
+    subject_id, _ = extract_subject_condition(file_path)
+    with span('process_file', file=file_path, subject=subject_id):
+        return _process_file_delta_txt(
+            file_path, output_folder, dir_path, NIRSsamprate, cohort_aggregator, st_mean_hbo_dict,
+            warnings_file, channels_excluded_file, all_snr_data, all_ratio_data, snirf_folder,
+            plot_queue, report_folder, low_memory, dtype, recording, writer, motion_correction
+        )
+
+
+def _process_file_delta_txt(file_path, output_folder, dir_path, NIRSsamprate, cohort_aggregator,
+                            st_mean_hbo_dict, warnings_file, channels_excluded_file, all_snr_data,
+                            all_ratio_data, snirf_folder, plot_queue, report_folder, low_memory, dtype,
+                            recording, writer, motion_correction):
+    if writer is None:
+        writer = OutputWriter(enabled=False)
+
     # Initialize logging if warnings_file is not provided
     if warnings_file is None:
         warnings_file = os.path.join(output_folder, 'warnings.txt')
@@ -95,26 +167,17 @@ def process_file_delta_txt(
 
     print(f"Processing file: {file_path}")
 
-    # Extract filename information
-    filename = os.path.basename(file_path)
-    filename_without_ext = os.path.splitext(filename)[0]
-    conditions = ['LongWalk_ST', 'LongWalk_DT']
-
     # Initialize variables
-    subject_id = 'Unknown'
-    condition = 'Unknown'
     dataMatrix = None
 
     # Load data based on file extension
     try:
-        if file_path.endswith('.txt'):
-            result = read_txt_file(file_path)
-        elif file_path.endswith('.mat'):
-            result = read_mat(file_path)
+        # The format is recognised from the file header, see processing.readers
+        if recording is not None:
+            result = recording
         else:
-            warning_msg = f"Unsupported file format for {file_path}"
-            warnings.warn(warning_msg)
-            return
+            with span('read'):
+                result = read_recording(file_path, low_memory=low_memory, dtype=dtype)
 
         dataMatrix = result['data']
         metadata = result['metadata']
@@ -129,28 +192,30 @@ def process_file_delta_txt(
         warnings.warn(warning_msg)
         return
 
+    # Bring the recording to the analysis sampling rate
+    file_samprate = get_sample_rate(metadata, default=NIRSsamprate)
+    with span('resample'):
+        dataMatrix = resample_recording(dataMatrix, file_samprate, NIRSsamprate)
+
     # Extract condition and subject ID
-    for cond in conditions:
-        if cond in filename_without_ext:
-            condition = cond
-            subject_id = filename_without_ext.replace(f'_{cond}_converted', '')
-            break
+    subject_id, condition = extract_subject_condition(file_path)
 
     timepoint = extract_timepoint(file_path)
 
-    # Create a copy of dataMatrix
-    df = dataMatrix.copy()
+    # dataMatrix is not used afterwards, and every stage below returns a new frame
+    df = dataMatrix
 
     # Apply FIR bandpass filter
     try:
-        order = 1000
-        Wn = [0.01, 0.1]
+        order = BANDPASS_ORDER
+        Wn = BANDPASS_WN
         fs = NIRSsamprate
         if len(df) <= 3 * order:
             warning_msg = f"Data too short to apply FIR filter for file {file_path}."
             warnings.warn(warning_msg)
             return
-        df_filtered = fir_filter(df.copy(), order=order, Wn=Wn, fs=fs)
+        with span('fir'):
+            df_filtered = fir_filter(df, order=order, Wn=Wn, fs=fs)
         print(f"FIR bandpass filter applied to file {file_path}")
     except Exception as e:
         warning_msg = f"Error applying FIR filter to file {file_path}: {e}"
@@ -171,7 +236,8 @@ def process_file_delta_txt(
         long_data = df_filtered[long_channel_cols]
 
         try:
-            df_corrected = ssc_regression(long_data=long_data, short_data=short_data)
+            with span('ssc'):
+                df_corrected = ssc_regression(long_data=long_data, short_data=short_data)
             print(f"Short Channel Regression applied to file {file_path}")
         except Exception as e:
             warning_msg = f"Error applying Short Channel Regression to file {file_path}: {e}"
@@ -181,14 +247,34 @@ def process_file_delta_txt(
         print("No short channel columns found. Proceeding without Short Channel Regression.")
         df_corrected = df_filtered
 
-    # Apply TDDR for motion artifact correction
+    # Apply motion artifact correction, TDDR by default
     try:
-        df_corrected = tddr(df_corrected.copy(), sample_rate=NIRSsamprate)
-        print(f"TDDR motion artifact correction applied for file {file_path}")
+        df_corrected, motion_mask = correct_motion(df_corrected, NIRSsamprate, method=motion_correction)
+        if motion_correction == 'tddr':
+            print(f"TDDR motion artifact correction applied for file {file_path}")
+        else:
+            print(f"Motion artifact correction '{motion_correction}' applied for file {file_path}")
     except Exception as e:
-        warning_msg = f"Error applying TDDR to file {file_path}: {e}"
+        warning_msg = f"Error applying motion correction to file {file_path}: {e}"
         warnings.warn(warning_msg)
         return
+    if motion_mask is not None:
+        motion_output_file = os.path.join(output_folder, get_base_filename(file_path, dir_path) + '_motion_qc.csv')
+        with span('write motion qc'):
+            writer.submit(motion_segments(motion_mask, NIRSsamprate).to_csv, motion_output_file, index=False,
+                          group=file_path, message=f"Motion segments saved to {motion_output_file}")
+
+    # Export the corrected signals for other tools
+    if snirf_folder is not None:
+        snirf_output_file = os.path.join(snirf_folder, get_base_filename(file_path, dir_path) + '_processed.snirf')
+        try:
+            with span('write snirf'):
+                # A shallow copy, the grand averages are added to df_corrected below
+                writer.submit(write_snirf, snirf_output_file, df_corrected.copy(deep=False), NIRSsamprate,
+                              metadata, stage=f'fir+ssc+{motion_correction}',
+                              group=file_path, message=f"Processed signals saved to {snirf_output_file}")
+        except Exception as e:
+            warnings.warn(f"Error exporting SNIRF for file {file_path}: {e}")
 
     # Average HbO and HbR channels
     hbo_cols = [col for col in df_corrected.columns if 'O2Hb' in col]
@@ -199,8 +285,9 @@ def process_file_delta_txt(
         warnings.warn(warning_msg)
         return
 
-    df_corrected['grand oxy'] = df_corrected[hbo_cols].mean(axis=1)
-    df_corrected['grand deoxy'] = df_corrected[hbr_cols].mean(axis=1)
+    with span('average'):
+        df_corrected['grand oxy'] = df_corrected[hbo_cols].mean(axis=1)
+        df_corrected['grand deoxy'] = df_corrected[hbr_cols].mean(axis=1)
 
     # Define sample intervals
     s2_sample = int(20 * NIRSsamprate)
@@ -212,64 +299,103 @@ def process_file_delta_txt(
 
     # Process data based on condition
     if condition == 'LongWalk_ST':
-        return process_st_condition(
+        metrics = process_st_condition(
             df_corrected, subject_id, timepoint, s2_sample, s3_sample,
-            output_folder, hbo_cols, st_mean_hbo_dict, st_data_dict, all_snr_data
+            output_folder, hbo_cols, st_mean_hbo_dict, cohort_aggregator, all_snr_data, NIRSsamprate,
+            plot_queue
         )
     elif condition == 'LongWalk_DT':
-        return process_dt_condition(
+        metrics = process_dt_condition(
             df_corrected, subject_id, timepoint, s2_sample, s3_sample,
-            output_folder, hbo_cols, st_mean_hbo_dict, all_snr_data, all_ratio_data
+            output_folder, hbo_cols, st_mean_hbo_dict, all_snr_data, all_ratio_data, cohort_aggregator,
+            NIRSsamprate, plot_queue
         )
+    else:
+        return
+
+    # Add the session to the cohort report
+    if report_folder is not None and metrics is not None:
+        metrics['Channels'] = len(hbo_cols)
+        if motion_mask is not None:
+            metrics['Motion flagged (%)'] = 100 * motion_mask.to_numpy().mean()
+        with span('write report panel'):
+            writer.submit(
+                write_panel,
+                report_folder, get_base_filename(file_path, dir_path),
+                traces={'HbO': df_corrected['grand oxy'].to_numpy(), 'HbR': df_corrected['grand deoxy'].to_numpy()},
+                sample_rate=NIRSsamprate,
+                events=[(s2_sample / NIRSsamprate, 'Walk start'), (s3_sample / NIRSsamprate, 'Walk end')],
+                metrics=metrics,
+                info={'Subject': subject_id, 'Timepoint': timepoint, 'Condition': condition},
+                group=file_path
+            )
+    return metrics
 
 
 def process_st_condition(df_corrected, subject_id, timepoint, s2_sample, s3_sample,
-                        output_folder, hbo_cols, st_mean_hbo_dict, st_data_dict, all_snr_data):
+                        output_folder, hbo_cols, st_mean_hbo_dict, cohort_aggregator, all_snr_data,
+                        NIRSsamprate=50, plot_queue=None):
     """
     Process Single Task (ST) condition data.
+
+    Returns:
+        dict: Quality metrics of the walking window for the cohort report
     """
     walking_data_st = df_corrected.iloc[s2_sample:s3_sample + 1].copy()
     walking_data_st.reset_index(drop=True, inplace=True)
 
     # Plot signals before calculating ratios
-    plot_signals(walking_data_st, subject_id, 'ST', output_folder)
+    with span('plot'):
+        plot_signals(walking_data_st, subject_id, 'ST', output_folder, NIRSsamprate, plot_queue)
 
-    mean_hbo_st = walking_data_st['grand oxy'].mean()
+    mean_hbo_st = walking_data_st['grand oxy'].astype(ACCUMULATOR).mean()
     print(f"Mean HbO for ST condition ({subject_id}): {mean_hbo_st}")
 
     if st_mean_hbo_dict is not None:
-        st_mean_hbo_dict[subject_id] = mean_hbo_st
+        st_mean_hbo_dict[(subject_id, timepoint)] = mean_hbo_st
 
-    if st_data_dict is not None:
-        st_data_dict[subject_id] = walking_data_st.copy()
+    if cohort_aggregator is not None:
+        cohort_aggregator.add(('ST', timepoint), walking_data_st)
 
     # Calculate SNR and add to the combined DataFrame
-    if all_snr_data is not None:
+    with span('snr'):
         snr_st = calculate_snr(walking_data_st, hbo_cols)
+    if all_snr_data is not None:
         snr_st['Subject'] = subject_id
         snr_st['Condition'] = 'ST'
         snr_st['Timepoint'] = timepoint
         all_snr_data.append(snr_st)
 
+    return {'Mean HbO': mean_hbo_st, 'Mean SNR': snr_st['SNR'].mean(), 'Min SNR': snr_st['SNR'].min()}
+
 
 def process_dt_condition(df_corrected, subject_id, timepoint, s2_sample, s3_sample,
-                        output_folder, hbo_cols, st_mean_hbo_dict, all_snr_data, all_ratio_data):
+                        output_folder, hbo_cols, st_mean_hbo_dict, all_snr_data, all_ratio_data,
+                        cohort_aggregator=None, NIRSsamprate=50, plot_queue=None):
     """
     Process Dual Task (DT) condition data.
+
+    Returns:
+        dict: Quality metrics of the walking window for the cohort report, None without an ST mean
     """
-    if st_mean_hbo_dict is None or subject_id not in st_mean_hbo_dict:
-        warning_msg = f"No ST mean HbO data found for subject {subject_id}"
+    if st_mean_hbo_dict is None or (subject_id, timepoint) not in st_mean_hbo_dict:
+        warning_msg = f"No ST mean HbO data found for subject {subject_id} at {timepoint}"
         warnings.warn(warning_msg)
         return
 
-    mean_hbo_st = st_mean_hbo_dict[subject_id]
+    mean_hbo_st = st_mean_hbo_dict[(subject_id, timepoint)]
     walking_data_dt = df_corrected.iloc[s2_sample:s3_sample + 1].copy()
     walking_data_dt.reset_index(drop=True, inplace=True)
 
     # Plot signals before calculating ratios
-    plot_signals(walking_data_dt, subject_id, 'DT', output_folder)
+    with span('plot'):
+        plot_signals(walking_data_dt, subject_id, 'DT', output_folder, NIRSsamprate, plot_queue)
+
+    if cohort_aggregator is not None:
+        cohort_aggregator.add(('DT', timepoint), walking_data_dt)
 
-    walking_data_dt['grand oxy'] -= mean_hbo_st
+    # The DT means and ratio are computed in float64 also for float32 signals
+    walking_data_dt['grand oxy'] = walking_data_dt['grand oxy'].astype(ACCUMULATOR) - mean_hbo_st
 
     # Calculate means and ratios
     mid_index = len(walking_data_dt) // 2
@@ -290,13 +416,18 @@ def process_dt_condition(df_corrected, subject_id, timepoint, s2_sample, s3_samp
         })
 
     # Calculate SNR and add to the combined DataFrame
-    if all_snr_data is not None:
+    with span('snr'):
         snr_dt = calculate_snr(walking_data_dt, hbo_cols)
+    if all_snr_data is not None:
         snr_dt['Subject'] = subject_id
         snr_dt['Condition'] = 'DT'
         snr_dt['Timepoint'] = timepoint
         all_snr_data.append(snr_dt)
 
+    return {'Mean HbO (relative to ST)': mean_hbo_overall, 'Mean HbO first half': mean_hbo_first_half,
+            'Mean HbO second half': mean_hbo_second_half, 'Ratio DT/ST': ratio_dt_st,
+            'Mean SNR': snr_dt['SNR'].mean(), 'Min SNR': snr_dt['SNR'].min()}
+
 
 def save_combined_data(all_snr_data, all_ratio_data, output_folder):
     """
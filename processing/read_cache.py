@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from processing.precision import resolve_dtype
+from processing.metadata import to_builtin
+
+# Members of a cached recording, also used to recognise the format
+CACHE_MEMBERS = ('values', 'columns', 'index', 'sample_number', 'event_rows', 'event_labels', 'metadata')
+
+
+def write_cache(file_path: str, recording: dict):
+    """
+    Save a recording read by any reader as an uncompressed .npz binary cache,
+    which reads many times faster than the text export it came from.
+
+    Parameters:
+    - file_path: Output .npz path
+    - recording: Dictionary of metadata and data as returned by the readers
+    """
+    df = recording['data']
+    columns = [col for col in df.columns if col not in ['Sample number', 'Event']]
+    events = df['Event'] if 'Event' in df.columns else pd.Series(np.nan, index=df.index)
+    event_rows = np.flatnonzero(events.notna().to_numpy())
+    np.savez(
+        file_path,
+        values=df[columns].to_numpy(),
+        columns=np.array(columns, dtype=str),
+        index=df.index.to_numpy(),
+        sample_number=df['Sample number'].to_numpy() if 'Sample number' in df.columns else np.arange(len(df)),
+        event_rows=event_rows,
+        event_labels=np.array([str(label) for label in events.iloc[event_rows]], dtype=str),
+        metadata=np.array(json.dumps(recording['metadata'], default=to_builtin))
+    )
+
+
+def read_cache(file_path: str, dtype: str = 'float64') -> dict:
+    """
+    Read a recording saved by write_cache.
+
+    Returns:
+    - Dictionary of metadata and data in the same layout as read_txt_file/read_mat
+    """
+    dtype = resolve_dtype(dtype)
+    with np.load(file_path, allow_pickle=False) as cache:
+        df = pd.DataFrame(cache['values'].astype(dtype, copy=False), columns=list(cache['columns']),
+                          index=cache['index'])
+        df.insert(0, 'Sample number', cache['sample_number'])
+        events = pd.Series(np.nan, index=df.index, dtype=object)
+        events.iloc[cache['event_rows']] = cache['event_labels']
+        df['Event'] = events
+        metadata = json.loads(str(cache['metadata']))
+    return {'metadata': metadata, 'data': df}
@@ -1,23 +1,23 @@
 import pandas as pd
-import scipy.io as sio
-import scipy.signal as signal
 import numpy as np
 
+from processing.precision import resolve_dtype
 
-def read_mat(file_path: str) -> dict:
+
+def read_mat(file_path: str, dtype: str = 'float64') -> dict:
     """
     Read Artinis export of raw fNIRS data in the .mat format.
 
     :param file_path: path to the raw data file
+    :param dtype: floating point type of the channels, 'float64' or 'float32'
     :return: dictionary of metadata and raw fnirs data
     """
+    # Imported here so that reading other formats does not load scipy.io
+    import scipy.io as sio
+
     # Load the .mat file into a dictionary
     mat_dict = sio.loadmat(file_path)
 
-    # Get metadata
-    fs = mat_dict['nirs_data']['Fs'][0, 0][0, 0]
-    metadata = {'Datafile sample rate': fs, 'Export file': file_path}
-
     # Get the channel labels. 'labels' is an array of arrays
     # so need to unpack into a list.
     labels = mat_dict['nirs_data']['label'][0, 0][0]
@@ -25,9 +25,42 @@ def read_mat(file_path: str) -> dict:
     for label in labels:
         labels_list.append(label[0])
 
+    return _build_recording(
+        file_path, mat_dict['nirs_data']['Fs'][0, 0][0, 0], labels_list,
+        mat_dict['nirs_data']['oxyvals'][0, 0], mat_dict['nirs_data']['dxyvals'][0, 0],
+        mat_dict['nirs_data']['ADvalues'][0, 0], dtype
+    )
+
+
+def read_mat_v73(file_path: str, dtype: str = 'float64') -> dict:
+    """
+    Read Artinis export of raw fNIRS data saved as a MATLAB v7.3 (HDF5) .mat file.
+
+    :param file_path: path to the raw data file
+    :param dtype: floating point type of the channels, 'float64' or 'float32'
+    :return: dictionary of metadata and raw fnirs data
+    """
+    import h5py
+
+    with h5py.File(file_path, 'r') as f:
+        nirs_data = f['nirs_data']
+        # MATLAB stores arrays column-major, so HDF5 sees them transposed
+        labels_list = [''.join(chr(c) for c in f[ref][()].ravel()) for ref in nirs_data['label'][()].ravel()]
+        return _build_recording(
+            file_path, nirs_data['Fs'][()].ravel()[0], labels_list,
+            nirs_data['oxyvals'][()].T, nirs_data['dxyvals'][()].T, nirs_data['ADvalues'][()].T, dtype
+        )
+
+
+def _build_recording(file_path, fs, labels_list, oxyvals, dxyvals, ad_values, dtype) -> dict:
+    dtype = resolve_dtype(dtype)
+    # Exports can have fractional rates, e.g. 10.0125 Hz
+    fs = float(fs)
+    metadata = {'Datafile sample rate': fs, 'Export file': file_path}
+
     # Get oxy and dxy data (type is numpy.ndarray)
-    oxyvals = mat_dict['nirs_data']['oxyvals'][0, 0]
-    dxyvals = mat_dict['nirs_data']['dxyvals'][0, 0]
+    oxyvals = oxyvals.astype(dtype, copy=False)
+    dxyvals = dxyvals.astype(dtype, copy=False)
 
     # Create dataframe for oxy and dxy, then merge
     oxy = pd.DataFrame(
@@ -39,7 +72,7 @@ def read_mat(file_path: str) -> dict:
     df = pd.concat([oxy, dxy], axis=1)
 
     # Get event markers, add to dataframe
-    events = _get_events(mat_dict)
+    events = _get_events(ad_values)
     df.insert(len(df.columns), 'Event', events)
 
     # Create new column 'Sample number'
@@ -47,12 +80,12 @@ def read_mat(file_path: str) -> dict:
     df.rename(columns={'index': 'Sample number'}, inplace=True)
 
     # Drop initial ~1s of recording
-    df.drop(df.index[range(fs)], inplace=True)
+    df.drop(df.index[range(int(round(fs)))], inplace=True)
 
     return {'metadata': metadata, 'data': df}
 
 
-def _get_events(raw: dict) -> pd.Series:
+def _get_events(ad_values: np.ndarray) -> pd.Series:
     """
     Extract event markers from PortaSync signal.
 
@@ -60,7 +93,7 @@ def _get_events(raw: dict) -> pd.Series:
     By finding the peaks in the signal we can get the frame where an event was
     marked by the person collecting data.
 
-    :param raw: a dictionary of loaded .mat data
+    :param ad_values: samples x 3 array of the ADvalues channels
     :return: a pd.Series containing the frames where events were marked
     """
     # Define series of NaN to return if no events are found
@@ -68,11 +101,12 @@ def _get_events(raw: dict) -> pd.Series:
 
     # If column containing event signal is not present, return series that will
     # make entire 'Event' column np.nan
-    if raw['nirs_data']['ADvalues'][0, 0].shape[1] != 3:
+    if ad_values.ndim != 2 or ad_values.shape[1] != 3:
         return events
 
     # Look for events
-    raw_event_signal = raw['nirs_data']['ADvalues'][0, 0][:, 1]
+    import scipy.signal as signal
+    raw_event_signal = ad_values[:, 1]
     peaks, _ = signal.find_peaks(raw_event_signal, height=0.02)
 
     # If no events were found return NaN series
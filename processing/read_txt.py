@@ -1,14 +1,22 @@
 import pandas as pd
 import numpy as np
 
+from processing.precision import resolve_dtype, cast_channels
 
-def read_txt_file(file_path: str) -> dict:
+
+def read_txt_file(file_path: str, low_memory: bool = False, dtype: str = 'float64') -> dict:
     """
     Parse a .txt export of fNIRS data generated in Oxysoft.
 
     :param file_path: path to raw data file
+    :param low_memory: parse the data rows with pandas straight from the file
+        instead of holding all lines of the file as Python lists
+    :param dtype: floating point type of the channels, 'float64' or 'float32'
     :return: dictionary of metadata and raw fnirs data
     """
+    if low_memory:
+        return _read_txt_file_low_memory(file_path, dtype)
+
     lines = None
     with open(file_path, 'r') as f:
         # Split the .txt file into lines
@@ -21,10 +29,13 @@ def read_txt_file(file_path: str) -> dict:
     rows = [[i for i in j.split('\t')] for j in lines]
 
     metadata = _read_metadata(rows)
-    df = _read_data(rows)
+    df = cast_channels(_read_data(rows), dtype)
 
     # Add info to metadata
     metadata['Export file'] = file_path
+    # The sample rate row can lie outside the header rows read above
+    if 'Datafile sample rate' not in metadata:
+        metadata['Datafile sample rate'] = _read_sample_rate(rows)
 
     return {'metadata': metadata, 'data': df}
 
@@ -39,6 +50,8 @@ def _read_metadata(rows: list) -> dict:
             pass
         elif 'OxySoft export of:' in row:
             metadata['Original file'] = row[1]
+        elif 'Datafile sample rate:' in row:
+            metadata['Datafile sample rate'] = float(row[1])
         else:
             # Remove trailing ":" before setting as key
             metadata[row[0].split(':')[0]] = row[1]
@@ -46,19 +59,58 @@ def _read_metadata(rows: list) -> dict:
     return metadata
 
 
-def _read_data(rows: list) -> pd.DataFrame:
-    # Copy to avoid accidental mutation to original list
-    rows_copy = [i for i in rows]
+def _read_sample_rate(rows: list) -> float:
+    # Exports can have fractional rates, e.g. 10.0125 Hz
+    for row in rows:
+        if "Datafile sample rate:" in row:
+            return float(row[1])
+    return None
 
+
+def _read_txt_file_low_memory(file_path: str, dtype: str = 'float64') -> dict:
+    # Only the header is split into Python lists, the data rows are parsed by
+    # pandas from the open file
+    header = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            header.append(row)
+            if "(Event)" in row:
+                break
+        col_labels, _, sample_rate = _read_columns(header)
+        # The data rows start three lines after the (Event) label
+        for _ in range(3):
+            f.readline()
+        # Rows with event markers have a trailing tab, i.e. one extra column.
+        # The channels are parsed straight into the requested type.
+        channel_dtype = resolve_dtype(dtype)
+        dtypes = {label: channel_dtype for label in col_labels if label not in ['Sample number', 'Event']}
+        dtypes['Event'] = object
+        df = pd.read_csv(f, sep='\t', header=None, names=col_labels + ['_trailing'], usecols=col_labels,
+                         dtype=dtypes, skip_blank_lines=True)
+
+    metadata = _read_metadata(header)
+    metadata['Export file'] = file_path
+    if 'Datafile sample rate' not in metadata:
+        metadata['Datafile sample rate'] = sample_rate
+
+    # Drop initial 1 second of recording, keeping the index of the full read
+    df.drop(df.index[range(int(round(sample_rate)))], inplace=True)
+    df.loc[df['Event'] == '', 'Event'] = np.nan
+
+    return {'metadata': metadata, 'data': df}
+
+
+def _read_columns(rows: list) -> tuple:
     # Get column labels to use for DataFrame, also get sample rate
     start = None
     end = None
     sample_rate = None
 
     # Find the start/end indexes of the columns labels
-    for idx, row in enumerate(rows_copy):
+    for idx, row in enumerate(rows):
         if "Datafile sample rate:" in row:
-            sample_rate = int(float(row[1]))
+            sample_rate = float(row[1])
         elif "(Sample number)" in row:
             start = idx
         elif "(Event)" in row:
@@ -66,7 +118,7 @@ def _read_data(rows: list) -> pd.DataFrame:
             break
 
     if start is not None and end is not None and sample_rate is not None:
-        col_labels = rows_copy[start:(end + 1)]
+        col_labels = rows[start:(end + 1)]
         col_labels = [i[1] for i in col_labels]
     else:
         raise ValueError(f"""Could not find start, end, or sample rate in the
@@ -83,6 +135,14 @@ def _read_data(rows: list) -> pd.DataFrame:
         else:
             raise KeyError(f"Unexpected value found in column labels: {label}")
 
+    return col_labels, end, sample_rate
+
+
+def _read_data(rows: list) -> pd.DataFrame:
+    # Copy to avoid accidental mutation to original list
+    rows_copy = [i for i in rows]
+    col_labels, end, sample_rate = _read_columns(rows_copy)
+
     # Create DataFrame
     data = rows_copy[(end + 4):-1]  # Last line is empty, ignore it
     for idx, row in enumerate(data):
@@ -99,7 +159,7 @@ def _read_data(rows: list) -> pd.DataFrame:
     df = pd.DataFrame(data=data, columns=col_labels)
 
     # Drop initial 1 second of recording
-    df.drop(df.index[range(sample_rate)], inplace=True)
+    df.drop(df.index[range(int(round(sample_rate)))], inplace=True)
     # Cast columns to most logical dtype
     df = df.apply(pd.to_numeric, errors='ignore')
     # Replace '' with np.nan in the 'Event' columns
@@ -0,0 +1,204 @@
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Bytes read from the start of a file to recognise its format
+HEADER_BYTES = 1024
+
+_HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+_ZIP_SIGNATURE = b'PK\x03\x04'
+
+
+class Reader:
+    """
+    A registered file format: sniff(header, file_path) recognises a file
+    from its first HEADER_BYTES bytes and read(file_path, low_memory=False,
+    dtype='float64') returns the common recording dictionary of metadata and
+    data (see read_txt_file).
+    """
+
+    def __init__(self, name: str, sniff, read, extensions=()):
+        self.name = name
+        self.sniff = sniff
+        self.read = read
+        self.extensions = tuple(extensions)
+
+
+_READERS = []
+
+
+def register_reader(name: str, sniff, read, extensions=(), first: bool = False):
+    """
+    Register a reader for a file format; readers registered later (or
+    before the built-in ones with first=True) are tried in turn.
+
+    Readers should import their backend inside read so it is only loaded
+    when a file of the format is read.
+
+    Parameters:
+    - name: Format name, e.g. 'oxysoft_txt'
+    - sniff: Callable sniff(header bytes, file_path) returning True for files of the format
+    - read: Callable read(file_path, low_memory=False, dtype='float64') returning the recording
+    - extensions: Usual file extensions of the format, e.g. ('.txt',)
+    - first: Try this reader before the registered ones
+    """
+    reader = Reader(name, sniff, read, extensions)
+    _READERS[:] = [r for r in _READERS if r.name != name]
+    if first:
+        _READERS.insert(0, reader)
+    else:
+        _READERS.append(reader)
+    return reader
+
+
+def readers() -> list:
+    """
+    Return the registered readers in the order they are tried.
+    """
+    return list(_READERS)
+
+
+def detect_format(file_path: str) -> Reader:
+    """
+    Recognise the format of a file from its header.
+
+    Raises:
+    - ValueError if no registered reader recognises the file
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+    for reader in _READERS:
+        if reader.sniff(header, file_path):
+            return reader
+    raise ValueError(f"Unsupported file format for {file_path}")
+
+
+def read_recording(file_path: str, low_memory: bool = False, dtype: str = 'float64') -> dict:
+    """
+    Read a recording of any registered format.
+
+    Returns:
+    - Dictionary of metadata and data as returned by read_txt_file, with
+      the detected format in metadata['Format']
+    """
+    reader = detect_format(file_path)
+    recording = reader.read(file_path, low_memory=low_memory, dtype=dtype)
+    recording['metadata']['Format'] = reader.name
+    return recording
+
+
+def open_directory(folder: str, workers: int = 8, recursive: bool = True, formats=None,
+                   low_memory: bool = False, dtype: str = 'float64', use_processes: bool = True) -> dict:
+    """
+    Read every recording below folder in parallel.
+
+    Files no reader recognises are skipped; files that fail to read are
+    reported and skipped.
+
+    Parameters:
+    - folder: Folder to read
+    - workers: Number of files read at once
+    - recursive: Also read the subfolders
+    - formats: Optional format names to read, all registered formats by default
+    - low_memory, dtype: Passed to the readers
+    - use_processes: Parse in worker processes (True) or threads (False)
+
+    Returns:
+    - {file path: recording} in sorted path order
+    """
+    file_paths = []
+    for dir_path, dir_names, file_names in os.walk(folder):
+        dir_names.sort()
+        file_paths.extend(os.path.join(dir_path, name) for name in sorted(file_names))
+        if not recursive:
+            break
+
+    selected = []
+    for file_path in file_paths:
+        try:
+            reader = detect_format(file_path)
+        except (ValueError, OSError):
+            continue
+        if formats is None or reader.name in formats:
+            selected.append(file_path)
+
+    recordings = {}
+    if not selected:
+        return recordings
+    executor_class = ProcessPoolExecutor if use_processes and workers > 1 else ThreadPoolExecutor
+    with executor_class(max_workers=max(int(workers), 1)) as executor:
+        futures = [executor.submit(read_recording, file_path, low_memory=low_memory, dtype=dtype)
+                   for file_path in selected]
+        for file_path, future in zip(selected, futures):
+            error = future.exception()
+            if error is not None:
+                print(f"Error reading file {file_path}: {error}")
+                continue
+            recordings[file_path] = future.result()
+    return recordings
+
+
+def _is_oxysoft_txt(header: bytes, file_path: str) -> bool:
+    return header.lstrip(b'\xef\xbb\xbf').lower().startswith(b'oxysoft export')
+
+
+def _is_mat_v5(header: bytes, file_path: str) -> bool:
+    return header.startswith(b'MATLAB 5.0 MAT-file')
+
+
+def _is_mat_v73(header: bytes, file_path: str) -> bool:
+    # A 512 byte MATLAB text header in front of an HDF5 file
+    return header.startswith(b'MATLAB 7.3 MAT-file') and header[512:520] == _HDF5_SIGNATURE
+
+
+def _is_snirf(header: bytes, file_path: str) -> bool:
+    if not header.startswith(_HDF5_SIGNATURE):
+        return False
+    if file_path.lower().endswith('.snirf'):
+        return True
+    import h5py
+    with h5py.File(file_path, 'r') as f:
+        return 'nirs' in f and 'formatVersion' in f
+
+
+def _is_cache(header: bytes, file_path: str) -> bool:
+    if not header.startswith(_ZIP_SIGNATURE):
+        return False
+    from processing.read_cache import CACHE_MEMBERS
+    with zipfile.ZipFile(file_path) as archive:
+        return set(CACHE_MEMBERS) <= {os.path.splitext(name)[0] for name in archive.namelist()}
+
+
+def _read_oxysoft_txt(file_path, low_memory=False, dtype='float64'):
+    from processing.read_txt import read_txt_file
+    return read_txt_file(file_path, low_memory=low_memory, dtype=dtype)
+
+
+def _read_mat_v5(file_path, low_memory=False, dtype='float64'):
+    from processing.read_mat import read_mat
+    return read_mat(file_path, dtype=dtype)
+
+
+def _read_mat_v73(file_path, low_memory=False, dtype='float64'):
+    from processing.read_mat import read_mat_v73
+    return read_mat_v73(file_path, dtype=dtype)
+
+
+def _read_snirf(file_path, low_memory=False, dtype='float64'):
+    from processing.snirf import read_snirf
+    from processing.precision import cast_channels
+    recording = read_snirf(file_path)
+    recording['data'] = cast_channels(recording['data'], dtype)
+    return recording
+
+
+def _read_cache(file_path, low_memory=False, dtype='float64'):
+    from processing.read_cache import read_cache
+    return read_cache(file_path, dtype=dtype)
+
+
+register_reader('oxysoft_txt', _is_oxysoft_txt, _read_oxysoft_txt, extensions=('.txt',))
+register_reader('mat_v5', _is_mat_v5, _read_mat_v5, extensions=('.mat',))
+register_reader('mat_v73', _is_mat_v73, _read_mat_v73, extensions=('.mat',))
+register_reader('snirf', _is_snirf, _read_snirf, extensions=('.snirf',))
+register_reader('cache', _is_cache, _read_cache, extensions=('.npz',))
@@ -0,0 +1,292 @@
+import os
+import re
+import json
+import glob
+import base64
+import html
+
+import numpy as np
+
+from processing.plotting import bin_min_max
+
+# Min/max bins stored per trace, about one per horizontal pixel of a panel
+REPORT_BINS = 1000
+
+
+def write_panel(report_folder: str, panel_id: str, traces: dict, sample_rate: float, events: list = None,
+                metrics: dict = None, info: dict = None) -> str:
+    """
+    Store one session panel of the cohort report.
+
+    Every trace is reduced to REPORT_BINS min/max pairs and written as base64
+    float32 arrays to data/<panel_id>.js, which the report only loads when the
+    panel is scrolled into view. Title, events and QC metrics go to the small
+    data/<panel_id>.json that build_report collects, so panels written by
+    earlier runs are reused without reprocessing.
+
+    Parameters:
+    - report_folder: Directory of the report
+    - panel_id: Unique name of the panel, e.g. the base filename of the input
+    - traces: {label: 1-D array}, e.g. {'HbO': grand oxy, 'HbR': grand deoxy}, first sample at time 0
+    - sample_rate: Sampling rate of the traces in Hz
+    - events: Optional list of (time in s, label) pairs
+    - metrics: Optional {name: value} of quality metrics shown next to the traces
+    - info: Optional {'Subject', 'Timepoint', 'Condition'} used to group and title the panel
+
+    Returns:
+    - Path of the panel's .json file
+    """
+    meta_path = panel_path(report_folder, panel_id)
+    data_folder = os.path.dirname(meta_path)
+    panel_id = os.path.splitext(os.path.basename(meta_path))[0]
+    os.makedirs(data_folder, exist_ok=True)
+
+    n_samples = max(len(values) for values in traces.values())
+    samples_per_bin = max(-(-n_samples // REPORT_BINS), 1)
+    data = {'dt': samples_per_bin / sample_rate, 'traces': {}}
+    for label, values in traces.items():
+        _, minima, maxima = bin_min_max(np.asarray(values), samples_per_bin)
+        data['traces'][label] = {'min': _encode(minima), 'max': _encode(maxima)}
+
+    # Loaded through a script tag, which also works for reports opened from disk
+    with open(os.path.join(data_folder, panel_id + '.js'), 'w') as f:
+        f.write(f'reportData({json.dumps(panel_id)}, {json.dumps(data)});\n')
+
+    meta = {
+        'id': panel_id,
+        'info': {k: str(v) for k, v in (info or {}).items()},
+        'duration': n_samples / sample_rate,
+        'events': [[float(t), str(label)] for t, label in (events or [])],
+        'metrics': {k: _json_value(v) for k, v in (metrics or {}).items()},
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return meta_path
+
+
+def panel_path(report_folder: str, panel_id: str) -> str:
+    """
+    Return the path of the .json file write_panel writes for panel_id.
+    """
+    return os.path.join(report_folder, 'data', re.sub(r'[^\w.-]', '_', panel_id) + '.json')
+
+
+def build_report(report_folder: str, panel_files: list = None, title: str = 'fNIRS cohort report') -> str:
+    """
+    Write index.html for the given panels, grouped by subject.
+
+    Only the panel titles, events and metrics are embedded in the page; the
+    decimated traces stay in their data/*.js chunks until a panel comes into
+    view.
+
+    Parameters:
+    - report_folder: Directory of the report
+    - panel_files: Panel .json files returned by write_panel, all panels in the folder by default
+    - title: Title of the report
+
+    Returns:
+    - Path of the report
+    """
+    if panel_files is None:
+        panel_files = glob.glob(os.path.join(report_folder, 'data', '*.json'))
+
+    panels = []
+    for panel_file in panel_files:
+        with open(panel_file, 'r') as f:
+            panels.append(json.load(f))
+    panels.sort(key=lambda p: (p['info'].get('Subject', ''), p['info'].get('Timepoint', ''),
+                               p['info'].get('Condition', ''), p['id']))
+
+    # Keep the embedded JSON from closing the script element
+    panels_json = json.dumps(panels).replace('</', '<\\/')
+    report_path = os.path.join(report_folder, 'index.html')
+    with open(report_path, 'w') as f:
+        f.write(_TEMPLATE.replace('{{title}}', html.escape(title)).replace('{{panels}}', panels_json))
+    print(f"Report with {len(panels)} panels saved to {report_path}")
+    return report_path
+
+
+def _encode(values: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def _json_value(value):
+    # NumPy scalars to Python, NaN to null
+    if isinstance(value, (np.generic,)):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{{title}}</title>
+<style>
+body { font-family: sans-serif; margin: 20px; color: #222; }
+h2 { border-bottom: 1px solid #ccc; padding-bottom: 4px; margin-top: 32px; }
+.panel { display: flex; gap: 16px; margin: 12px 0; min-height: 220px; }
+.panel canvas { flex: 1; height: 220px; border: 1px solid #ddd; min-width: 0; }
+.panel table { font-size: 12px; border-collapse: collapse; width: 300px; align-self: flex-start; }
+.panel td { padding: 2px 6px; border-bottom: 1px solid #eee; }
+.panel td.value { text-align: right; font-family: monospace; }
+.panel h3 { margin: 0 0 4px 0; font-size: 14px; }
+.missing { color: #b00; }
+#filter { width: 300px; padding: 4px; }
+</style>
+</head>
+<body>
+<h1>{{title}}</h1>
+<p><input id="filter" placeholder="Filter by subject, timepoint or condition"> <span id="count"></span></p>
+<div id="report"></div>
+<script>
+var PANELS = {{panels}};
+var COLORS = {'HbO': '#d62728', 'HbR': '#1f77b4'};
+var OTHER_COLORS = ['#2ca02c', '#9467bd', '#8c564b', '#e377c2'];
+var panelData = {};
+var pending = {};
+
+function reportData(id, data) {
+  panelData[id] = data;
+  if (pending[id]) { draw(pending[id], id); delete pending[id]; }
+}
+
+function decode(b64) {
+  var bytes = atob(b64), buffer = new ArrayBuffer(bytes.length), view = new Uint8Array(buffer);
+  for (var i = 0; i < bytes.length; i++) view[i] = bytes.charCodeAt(i);
+  return new Float32Array(buffer);
+}
+
+function niceStep(range, ticks) {
+  var raw = range / ticks, power = Math.pow(10, Math.floor(Math.log10(raw)));
+  var steps = [1, 2, 5, 10];
+  for (var i = 0; i < steps.length; i++) if (raw <= steps[i] * power) return steps[i] * power;
+  return 10 * power;
+}
+
+function draw(canvas, id) {
+  var meta = canvas.panelMeta, data = panelData[id];
+  var ratio = window.devicePixelRatio || 1;
+  var w = canvas.clientWidth, h = canvas.clientHeight;
+  canvas.width = w * ratio; canvas.height = h * ratio;
+  var ctx = canvas.getContext('2d');
+  ctx.scale(ratio, ratio);
+  var left = 50, right = 10, top = 10, bottom = 25;
+  var traces = {}, lo = Infinity, hi = -Infinity;
+  for (var label in data.traces) {
+    var t = {min: decode(data.traces[label].min), max: decode(data.traces[label].max)};
+    for (var i = 0; i < t.min.length; i++) {
+      if (!isNaN(t.min[i])) { lo = Math.min(lo, t.min[i]); hi = Math.max(hi, t.max[i]); }
+    }
+    traces[label] = t;
+  }
+  if (!isFinite(lo)) { lo = -1; hi = 1; }
+  if (hi === lo) { hi += 1; lo -= 1; }
+  var duration = meta.duration || 1;
+  function x(time) { return left + (w - left - right) * time / duration; }
+  function y(value) { return top + (h - top - bottom) * (hi - value) / (hi - lo); }
+
+  ctx.font = '10px sans-serif'; ctx.fillStyle = '#555'; ctx.strokeStyle = '#eee'; ctx.lineWidth = 1;
+  var step = niceStep(duration, 8);
+  for (var s = 0; s <= duration; s += step) {
+    ctx.beginPath(); ctx.moveTo(x(s), top); ctx.lineTo(x(s), h - bottom); ctx.stroke();
+    ctx.fillText(s.toFixed(0) + ' s', x(s) - 8, h - 8);
+  }
+  ctx.fillText(hi.toPrecision(3), 2, top + 8);
+  ctx.fillText(lo.toPrecision(3), 2, h - bottom);
+
+  var k = 0;
+  for (var label in traces) {
+    var t = traces[label];
+    ctx.strokeStyle = COLORS[label] || OTHER_COLORS[k++ % OTHER_COLORS.length];
+    ctx.beginPath();
+    var drawing = false;
+    for (var i = 0; i < t.min.length; i++) {
+      if (isNaN(t.min[i])) { drawing = false; continue; }
+      var xi = x(i * data.dt);
+      if (!drawing) { ctx.moveTo(xi, y(t.max[i])); drawing = true; } else { ctx.lineTo(xi, y(t.max[i])); }
+      ctx.lineTo(xi, y(t.min[i]));
+    }
+    ctx.stroke();
+  }
+
+  ctx.strokeStyle = 'green'; ctx.fillStyle = 'green'; ctx.setLineDash([4, 3]);
+  meta.events.forEach(function (e) {
+    ctx.beginPath(); ctx.moveTo(x(e[0]), top); ctx.lineTo(x(e[0]), h - bottom); ctx.stroke();
+    ctx.fillText(e[1], x(e[0]) + 3, top + 10);
+  });
+  ctx.setLineDash([]);
+}
+
+function load(canvas) {
+  var id = canvas.panelMeta.id;
+  if (panelData[id]) { draw(canvas, id); return; }
+  pending[id] = canvas;
+  var script = document.createElement('script');
+  script.src = 'data/' + encodeURIComponent(id) + '.js';
+  script.onerror = function () { canvas.parentNode.classList.add('missing'); };
+  document.body.appendChild(script);
+}
+
+var observer = new IntersectionObserver(function (entries) {
+  entries.forEach(function (entry) {
+    if (entry.isIntersecting) { observer.unobserve(entry.target); load(entry.target); }
+  });
+}, {rootMargin: '300px'});
+
+function formatValue(value) {
+  if (value === null) return 'n/a';
+  if (typeof value === 'number' && !Number.isInteger(value)) return value.toPrecision(4);
+  return String(value);
+}
+
+function render() {
+  var report = document.getElementById('report'), subject = null, shown = 0;
+  var query = document.getElementById('filter').value.toLowerCase();
+  report.innerHTML = '';
+  PANELS.forEach(function (meta) {
+    var info = meta.info;
+    var name = [info.Subject, info.Timepoint, info.Condition].filter(Boolean).join(' / ') || meta.id;
+    if (query && name.toLowerCase().indexOf(query) < 0) return;
+    shown++;
+    if ((info.Subject || '') !== subject) {
+      subject = info.Subject || '';
+      var heading = document.createElement('h2');
+      heading.textContent = subject || 'Unknown subject';
+      report.appendChild(heading);
+    }
+    var panel = document.createElement('div');
+    panel.className = 'panel';
+    var canvas = document.createElement('canvas');
+    canvas.panelMeta = meta;
+    var side = document.createElement('div');
+    var title = document.createElement('h3');
+    title.textContent = name;
+    side.appendChild(title);
+    var table = document.createElement('table');
+    Object.keys(meta.metrics).forEach(function (key) {
+      var row = table.insertRow();
+      row.insertCell().textContent = key;
+      var cell = row.insertCell();
+      cell.className = 'value';
+      cell.textContent = formatValue(meta.metrics[key]);
+    });
+    side.appendChild(table);
+    panel.appendChild(canvas);
+    panel.appendChild(side);
+    report.appendChild(panel);
+    observer.observe(canvas);
+  });
+  document.getElementById('count').textContent = shown + ' of ' + PANELS.length + ' sessions';
+}
+
+document.getElementById('filter').addEventListener('input', render);
+render();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,66 @@
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+from processing.precision import signal_dtype
+
+
+def get_sample_rate(metadata: dict, default: float = None) -> float:
+    """
+    Return the sampling rate reported by read_txt_file/read_mat metadata, or
+    default if the file does not report one.
+    """
+    value = metadata.get('Datafile sample rate')
+    if value is None or value == '':
+        return default
+    return float(value)
+
+
+def resample_recording(df: pd.DataFrame, fs_in: float, fs_out: float) -> pd.DataFrame:
+    """
+    Bring a recording to the analysis sampling rate.
+
+    All numeric channels are resampled at once with a polyphase filter
+    (resample_poly along the time axis of the 2-D array). 'Sample number' is
+    renumbered at the new rate from the rescaled first sample, and event
+    markers are moved to the row closest to their original time.
+
+    Parameters:
+    - df: DataFrame with 'Sample number', channel columns and optionally 'Event'
+    - fs_in: Sampling rate of df in Hz
+    - fs_out: Target sampling rate in Hz
+
+    Returns:
+    - Resampled DataFrame with the same columns in the same order
+    """
+    if fs_in == fs_out:
+        return df
+    # scipy.signal is imported on first use so the entry points start quickly
+    from scipy.signal import resample_poly
+
+    ratio = Fraction(fs_out / fs_in).limit_denominator(1000)
+    up, down = ratio.numerator, ratio.denominator
+
+    channel_cols = [col for col in df.columns
+                    if col not in ['Sample number', 'Event'] and pd.api.types.is_numeric_dtype(df[col])]
+    # Resampled in the float type of the channels, float32 or float64
+    dtype = signal_dtype(df, channel_cols)
+    resampled = resample_poly(df[channel_cols].to_numpy(dtype=dtype), up, down, axis=0).astype(dtype, copy=False)
+    n_out = resampled.shape[0]
+
+    out = pd.DataFrame(resampled, columns=channel_cols)
+
+    if 'Sample number' in df.columns:
+        first_sample = int(round(df['Sample number'].iloc[0] * up / down))
+        out['Sample number'] = np.arange(first_sample, first_sample + n_out)
+
+    if 'Event' in df.columns:
+        events = pd.Series(np.nan, index=out.index, dtype=object)
+        rows = np.flatnonzero(df['Event'].notna().to_numpy())
+        new_rows = np.minimum(np.rint(rows * up / down).astype(int), n_out - 1)
+        events.iloc[new_rows] = df['Event'].iloc[rows].to_numpy()
+        out['Event'] = events
+
+    print(f"Resampled from {fs_in:g} Hz to {fs_out:g} Hz")
+    return out[[col for col in df.columns if col in out.columns]]
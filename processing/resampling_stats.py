@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Resamples evaluated per batch, bounds the size of the index/sign matrices
+BATCH_SIZE = 2000
+
+
+def paired_differences(stats_df: pd.DataFrame, condition_a: str = 'LongWalk_DT', condition_b: str = 'LongWalk_ST',
+                       feature_columns: list = None, condition_column: str = 'Condition') -> pd.DataFrame:
+    """
+    Pair the feature rows of two conditions per subject and timepoint and
+    return their differences (a - b).
+
+    Parameters:
+    - stats_df: Per-subject feature table, e.g. combined calculate_statistics output
+    - condition_a, condition_b: Conditions to contrast
+    - feature_columns: Numeric columns to contrast, all numeric columns by default
+
+    Returns:
+    - DataFrame with 'Subject', 'Timepoint' and one difference column per feature
+    """
+    if feature_columns is None:
+        feature_columns = [col for col in stats_df.select_dtypes('number').columns]
+    keys = ['Subject', 'Timepoint']
+    a = stats_df[stats_df[condition_column] == condition_a].set_index(keys)[feature_columns]
+    b = stats_df[stats_df[condition_column] == condition_b].set_index(keys)[feature_columns]
+    a, b = a.align(b, join='inner')
+    # Sorted so the seeded resamples do not depend on the order the rows were written in
+    return (a - b).sort_index().reset_index()
+
+
+def subject_means(df: pd.DataFrame, feature_columns: list = None, subject_column: str = 'Subject') -> pd.DataFrame:
+    """
+    Average the rows of every subject, e.g. differences of several timepoints.
+
+    The permutation test and bootstrap of contrast_statistics treat rows as
+    independent units, which rows of the same subject are not, so they are
+    reduced to one row per subject first. Missing values are left out of the
+    means.
+
+    Returns:
+    - DataFrame with the subject column and one mean column per feature, sorted by subject
+    """
+    if feature_columns is None:
+        feature_columns = [col for col in df.select_dtypes('number').columns]
+    return df.groupby(subject_column, sort=True)[feature_columns].mean().reset_index()
+
+
+def contrast_statistics(differences: pd.DataFrame, feature_columns: list = None, n_resamples: int = 10000,
+                        confidence: float = 0.95, null_value: float = 0.0, seed: int = 0,
+                        n_jobs: int = 1) -> pd.DataFrame:
+    """
+    Paired permutation tests and bootstrap confidence intervals for the mean
+    of every feature column.
+
+    The permutation test flips the sign of each subject's (difference -
+    null_value) at random; the bootstrap resamples subjects with replacement.
+    Resamples are drawn as sign/index matrices and evaluated for all features
+    at once with one matrix product each, in batches of BATCH_SIZE. Batches can be spread over n_jobs
+    processes. Every batch has its own seed spawned from seed, so results do
+    not depend on n_jobs.
+
+    Parameters:
+    - differences: Table with one row per subject of differences or values to
+      test against null_value (see paired_differences and subject_means)
+    - feature_columns: Columns to test, all numeric columns by default
+    - n_resamples: Number of permutations and bootstrap resamples
+    - confidence: Confidence level of the bootstrap percentile intervals
+    - null_value: Value of the mean under the null hypothesis
+    - seed: Seed for reproducible resampling
+    - n_jobs: Number of worker processes
+
+    Returns:
+    - DataFrame with one row per feature: N, Mean, CI Lower, CI Upper, p-value
+    """
+    if feature_columns is None:
+        feature_columns = list(differences.select_dtypes('number').columns)
+
+    # Subjects with missing values differ per feature, so features are grouped
+    # by their set of valid subjects and each group is resampled as a matrix
+    values = differences[feature_columns].to_numpy(dtype='float64')
+    valid = ~np.isnan(values)
+    groups = {}
+    for j, col in enumerate(feature_columns):
+        groups.setdefault(valid[:, j].tobytes(), []).append(j)
+
+    results = {}
+    for mask_bytes, columns in groups.items():
+        mask = np.frombuffer(mask_bytes, dtype=bool)
+        x = values[mask][:, columns]
+        if len(x) < 2:
+            for j in columns:
+                results[j] = (len(x), np.nan, np.nan, np.nan, np.nan)
+            continue
+        perm_means, boot_means = _resample_means(x - null_value, n_resamples, seed, n_jobs)
+        observed = (x - null_value).mean(axis=0)
+        # Two-sided p-value, counting the observed statistic as one permutation
+        extreme = (np.abs(perm_means) >= np.abs(observed) - 1e-12).sum(axis=0)
+        p_values = (extreme + 1) / (n_resamples + 1)
+        alpha = (1 - confidence) / 2
+        lower, upper = np.quantile(boot_means + null_value, [alpha, 1 - alpha], axis=0)
+        for k, j in enumerate(columns):
+            results[j] = (len(x), observed[k] + null_value, lower[k], upper[k], p_values[k])
+
+    rows = []
+    for j, col in enumerate(feature_columns):
+        n, mean, lower, upper, p = results[j]
+        rows.append({'Feature': col, 'N': n, 'Mean': mean, 'CI Lower': lower, 'CI Upper': upper,
+                     'p-value': p})
+    return pd.DataFrame(rows)
+
+
+def _resample_means(x: np.ndarray, n_resamples: int, seed: int, n_jobs: int) -> tuple:
+    # Split the resamples into batches with independent, reproducible seeds
+    n_batches = -(-n_resamples // BATCH_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    sizes = [min(BATCH_SIZE, n_resamples - i * BATCH_SIZE) for i in range(n_batches)]
+    tasks = [(x, size, s) for size, s in zip(sizes, seeds)]
+
+    if n_jobs > 1 and n_batches > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            batches = list(executor.map(_resample_batch, tasks))
+    else:
+        batches = [_resample_batch(task) for task in tasks]
+
+    perm_means = np.concatenate([b[0] for b in batches])
+    boot_means = np.concatenate([b[1] for b in batches])
+    return perm_means, boot_means
+
+
+def _resample_batch(task: tuple) -> tuple:
+    x, size, seed_sequence = task
+    rng = np.random.default_rng(seed_sequence)
+    n = x.shape[0]
+
+    # Sign-flip permutations: (size x n) @ (n x features)
+    signs = rng.choice(np.array([-1.0, 1.0]), size=(size, n))
+    perm_means = signs @ x / n
+
+    # Bootstrap: (size x n) index matrix, turned into per-resample subject
+    # counts so the means are again one matrix product
+    indices = rng.integers(0, n, size=(size, n))
+    counts = np.bincount((indices + n * np.arange(size)[:, None]).ravel(), minlength=size * n).reshape(size, n)
+    boot_means = counts @ x / n
+
+    return perm_means, boot_means
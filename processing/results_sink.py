@@ -0,0 +1,245 @@
+import os
+import time
+import uuid
+import queue
+import threading
+
+import pandas as pd
+
+from processing.instrumentation import span
+
+PARTITION_COLUMNS = ['Subject', 'Timepoint', 'Condition']
+SOURCE_COLUMN = 'Source file'
+WRITTEN_COLUMN = 'Written at'
+# Schema of every column written to the dataset so far, next to the data files
+SCHEMA_FILE = '_common_metadata'
+
+_STOP = object()
+
+
+class ResultsSink:
+    """
+    Background writer that appends per-file feature rows to a Parquet dataset
+    partitioned by subject, timepoint and condition.
+
+    Rows are buffered by a writer thread and written as one file per
+    partition once flush_rows rows are buffered or the oldest buffered row
+    has waited flush_seconds, so a file's row is on disk (and reported to
+    on_flush) at most flush_seconds after it is appended. An interrupted run
+    loses at most those rows, and their files are processed again by the
+    next run. Each row is tagged with its source file and write time;
+    reprocessing a file appends a new row and read_results keeps only the
+    latest one.
+
+    The union of the columns of every flush is kept in the dataset's
+    _common_metadata file, so read_results does not have to open the footer
+    of every data file to learn the schema.
+
+    on_flush, if given, is called from the writer thread with the list of
+    (source file, payload) pairs whose rows have just been written to disk.
+    """
+
+    def __init__(self, dataset_path: str, flush_rows: int = 256, flush_seconds: float = 10.0, on_flush=None,
+                 partition_columns=PARTITION_COLUMNS):
+        self.dataset_path = dataset_path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.on_flush = on_flush
+        self.partition_columns = list(partition_columns)
+        self._run_id = uuid.uuid4().hex[:12]
+        self._flush_count = 0
+        self._schema = None
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='results-sink', daemon=True)
+        self._thread.start()
+
+    def append(self, rows: pd.DataFrame, source: str, payload=None):
+        """
+        Queue the feature rows of one source file for writing.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((rows, source, payload))
+
+    def close(self):
+        """
+        Flush the remaining rows and stop the writer thread.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        buffered = []
+        n_rows = 0
+        deadline = None
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None and self._error is None:
+                rows, source, payload = item
+                buffered.append((rows, source, payload))
+                n_rows += len(rows)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            if buffered and (n_rows >= self.flush_rows or time.monotonic() >= deadline):
+                self._flush(buffered)
+                buffered = []
+                n_rows = 0
+                deadline = None
+        if buffered and self._error is None:
+            self._flush(buffered)
+
+    def _flush(self, buffered: list):
+        # pyarrow is imported on first use so the entry points start quickly
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        try:
+            frames = []
+            written_at = time.time_ns()
+            for rows, source, _ in buffered:
+                rows = rows.copy()
+                rows[SOURCE_COLUMN] = source
+                rows[WRITTEN_COLUMN] = written_at
+                frames.append(rows)
+            with span('write results', rows=sum(len(f) for f in frames)):
+                table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True), preserve_index=False)
+                # The schema is extended before the data is written, so it never misses a written column
+                self._update_schema(table.schema)
+                ds.write_dataset(
+                    table, self.dataset_path, format='parquet',
+                    partitioning=self.partition_columns, partitioning_flavor='hive',
+                    basename_template=f'part-{self._run_id}-{self._flush_count}-{{i}}.parquet',
+                    existing_data_behavior='overwrite_or_ignore'
+                )
+            self._flush_count += 1
+            if self.on_flush is not None:
+                self.on_flush([(source, payload) for _, source, payload in buffered])
+        except Exception as e:
+            print(f"Error writing results to {self.dataset_path}: {e}")
+            self._error = e
+
+    def _update_schema(self, schema):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Partition columns are stored in the directory names, not in the files
+        schema = pa.schema([f for f in schema.remove_metadata() if f.name not in self.partition_columns])
+        path = os.path.join(self.dataset_path, SCHEMA_FILE)
+        if self._schema is None and os.path.isfile(path):
+            self._schema = pq.read_schema(path)
+        elif self._schema is None and os.path.isdir(self.dataset_path):
+            # Data files written before the schema file was kept
+            self._schema = _data_file_schema(self.dataset_path, self.partition_columns)
+        if self._schema is not None:
+            schema = pa.unify_schemas([self._schema, schema], promote_options='permissive')
+            if schema.equals(self._schema):
+                return
+        os.makedirs(self.dataset_path, exist_ok=True)
+        # Replaced atomically; names starting with '_' are not read as data files
+        pq.write_metadata(schema, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self._schema = schema
+
+
+def _data_file_schema(dataset_path: str, partition_columns: list):
+    # Union of the columns of all data files of a dataset, without the partition columns
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fragments = ds.dataset(dataset_path, format='parquet').get_fragments()
+    schemas = [f.physical_schema.remove_metadata() for f in fragments]
+    if not schemas:
+        return None
+    schema = pa.unify_schemas(schemas, promote_options='permissive')
+    return pa.schema([f for f in schema if f.name not in partition_columns])
+
+
+def read_results(dataset_path: str, filters: dict = None, columns: list = None, sources: list = None) -> pd.DataFrame:
+    """
+    Read feature rows from a results dataset.
+
+    Filters are pushed down to the dataset scan: partitions that do not match
+    are never opened and row groups are skipped using Parquet statistics.
+    Only the latest row of each source file is returned.
+
+    Parameters:
+    - dataset_path: Directory of the results dataset, or a list of them (e.g. one per shard)
+    - filters: Optional {column: value or list of values}, e.g. {'Condition': 'LongWalk_ST'}
+    - columns: Optional list of columns to read
+    - sources: Optional list of source files to restrict the rows to
+
+    Returns:
+    - DataFrame of the matching rows
+    """
+    if isinstance(dataset_path, (list, tuple)):
+        scan_columns = None
+        if columns is not None:
+            scan_columns = list(dict.fromkeys(list(columns) + [SOURCE_COLUMN, WRITTEN_COLUMN]))
+        frames = [read_results(path, filters, scan_columns, sources) for path in dataset_path]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        df = df.sort_values(WRITTEN_COLUMN, kind='stable').drop_duplicates(SOURCE_COLUMN, keep='last')
+        if columns is not None:
+            df = df[columns]
+        return df.reset_index(drop=True)
+
+    if not os.path.isdir(dataset_path):
+        return pd.DataFrame(columns=columns)
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    # Partition values are always read as strings, e.g. numeric subject IDs
+    partition_schema = pa.schema([(c, pa.string()) for c in PARTITION_COLUMNS])
+    partitioning = ds.partitioning(partition_schema, flavor='hive')
+    # Files written in different flushes can hold different feature columns
+    schema_path = os.path.join(dataset_path, SCHEMA_FILE)
+    if os.path.isfile(schema_path):
+        file_schema = pq.read_schema(schema_path)
+    else:
+        # Written before the schema file was kept: open the footer of every data file
+        file_schema = _data_file_schema(dataset_path, PARTITION_COLUMNS)
+        if file_schema is None:
+            return pd.DataFrame(columns=columns)
+    schema = pa.unify_schemas([file_schema, partition_schema])
+    dataset = ds.dataset(dataset_path, format='parquet', partitioning=partitioning, schema=schema)
+
+    filters = dict(filters or {})
+    if sources is not None:
+        filters[SOURCE_COLUMN] = list(sources)
+    expression = None
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple)):
+            condition = ds.field(column).isin(value)
+        else:
+            condition = ds.field(column) == value
+        expression = condition if expression is None else expression & condition
+
+    scan_columns = None
+    if columns is not None:
+        scan_columns = list(dict.fromkeys(list(columns) + [SOURCE_COLUMN, WRITTEN_COLUMN]))
+    df = dataset.to_table(columns=scan_columns, filter=expression).to_pandas()
+
+    # Keep the latest row per source file
+    df = df.sort_values(WRITTEN_COLUMN, kind='stable').drop_duplicates(SOURCE_COLUMN, keep='last')
+    if columns is not None:
+        df = df[columns]
+    return df.reset_index(drop=True)
@@ -0,0 +1,104 @@
+import os
+import re
+
+SHARDS_FOLDER = 'shards'
+_SHARD_PATTERN = re.compile(r'^shard-(\d+)-of-(\d+)$')
+
+
+def parse_shard(text: str) -> tuple:
+    """
+    Parse a shard specification 'i/N' (0 <= i < N), e.g. '3/16' or
+    f'{SLURM_ARRAY_TASK_ID}/16'.
+
+    Returns:
+    - (index, count)
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text)
+    if match is None:
+        raise ValueError(f"Invalid shard {text!r}, expected i/N, e.g. 0/4")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {text!r}, i must be between 0 and N - 1")
+    return index, count
+
+
+def shard_files(file_paths, index: int, count: int, group=None, size=os.path.getsize) -> list:
+    """
+    Return the files of shard index out of count.
+
+    Files are partitioned into groups (every file on its own by default)
+    that always land in the same shard, e.g. all files of one subject. The
+    groups are assigned largest first to the shard with the fewest bytes so
+    far, so the shards are balanced by file size. The partition only depends
+    on the file paths and sizes, so every job of an array computes the same
+    one without talking to the others.
+
+    Parameters:
+    - file_paths: All input files of the cohort
+    - index: Shard to return, 0 <= index < count
+    - count: Number of shards
+    - group: Optional callable group(file_path) returning the group key
+    - size: Callable size(file_path) in bytes
+
+    Returns:
+    - Files of the shard, in the order of file_paths
+    """
+    groups = {}
+    for file_path in file_paths:
+        key = group(file_path) if group is not None else file_path
+        groups.setdefault(key, []).append(file_path)
+
+    group_sizes = {key: sum(_size(size, f) for f in files) for key, files in groups.items()}
+    loads = [0] * count
+    assignment = {}
+    # Largest group first, ties broken by key so the order never depends on the input order
+    for key in sorted(groups, key=lambda k: (-group_sizes[k], str(k))):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        assignment[key] = shard
+        loads[shard] += group_sizes[key]
+
+    selected = {key for key, shard in assignment.items() if shard == index}
+    return [f for f in file_paths if (group(f) if group is not None else f) in selected]
+
+
+def _size(size, file_path) -> int:
+    try:
+        return size(file_path)
+    except OSError:
+        return 0
+
+
+def shard_folder(output_folder: str, index: int, count: int) -> str:
+    """
+    Folder holding the partial results of one shard.
+    """
+    return os.path.join(output_folder, SHARDS_FOLDER, f'shard-{index:03d}-of-{count:03d}')
+
+
+def shard_folders(output_folder: str) -> list:
+    """
+    Return the folders of all shards of the last sharded run, checking that
+    every shard is present.
+
+    Raises:
+    - ValueError if shards are missing or shards of different counts are present
+    """
+    shards_root = os.path.join(output_folder, SHARDS_FOLDER)
+    found = {}
+    if os.path.isdir(shards_root):
+        for name in os.listdir(shards_root):
+            match = _SHARD_PATTERN.match(name)
+            if match and os.path.isdir(os.path.join(shards_root, name)):
+                found.setdefault(int(match.group(2)), set()).add(int(match.group(1)))
+
+    if not found:
+        raise ValueError(f"No shard results found in {shards_root}")
+    if len(found) > 1:
+        raise ValueError(f"Shards of different runs ({', '.join(str(n) for n in sorted(found))} shards) found in "
+                         f"{shards_root}, remove the stale ones before merging")
+
+    count, indices = next(iter(found.items()))
+    missing = sorted(set(range(count)) - indices)
+    if missing:
+        raise ValueError(f"Shards {missing} of {count} have no results in {shards_root}")
+    return [shard_folder(output_folder, i, count) for i in range(count)]
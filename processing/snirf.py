@@ -0,0 +1,201 @@
+import re
+import json
+
+import numpy as np
+import pandas as pd
+
+from processing.metadata import to_builtin
+
+SNIRF_FORMAT_VERSION = '1.1'
+# SNIRF dataType for processed (e.g. concentration) data
+PROCESSED_DATA_TYPE = 99999
+# Rows per chunk along the time axis, ~80 s at 50 Hz
+CHUNK_SAMPLES = 4096
+# Nominal PortaLite/Oxymon wavelengths, used when the export does not report them
+DEFAULT_WAVELENGTHS = [760.0, 850.0]
+
+_NON_SIGNAL_COLUMNS = ['Sample number', 'Event', 'Time', 'Time (s)', 'Second']
+_REQUIRED_TAGS = ['SubjectID', 'MeasurementDate', 'MeasurementTime']
+
+
+def write_snirf(file_path: str, df: pd.DataFrame, sample_rate: float, metadata: dict = None,
+                stage: str = 'raw'):
+    """
+    Write fNIRS data to a SNIRF (HDF5) file.
+
+    Every float column except time/sample/event columns becomes one entry of
+    the measurement list, labelled HbO or HbR from its name ('O2Hb'/'HbO'/'oxy'
+    or 'HHb'/'HbR'/'deoxy'). 'RxA-TxB' channel names map to detector A and
+    source B. The time series is chunked along time and gzip compressed, so
+    time windows can be read back without loading the whole file. Event
+    markers become stim groups.
+
+    Parameters:
+    - file_path: Output .snirf path
+    - df: DataFrame with 'Sample number', signal columns and optionally 'Event'
+    - sample_rate: Sampling rate in Hz
+    - metadata: Optional reader metadata, stored as metaDataTags
+    - stage: Processing stage the data is from (e.g. 'raw', 'tddr', 'filtered')
+    """
+    metadata = metadata or {}
+    columns = [col for col in df.columns
+               if col not in _NON_SIGNAL_COLUMNS and pd.api.types.is_float_dtype(df[col])]
+    values = df[columns].to_numpy()
+    if 'Sample number' in df.columns:
+        first_sample = int(df['Sample number'].iloc[0])
+    else:
+        first_sample = 0
+
+    # h5py is imported here so that entry points that do not touch SNIRF start quickly
+    import h5py
+
+    with h5py.File(file_path, 'w') as f:
+        f.create_dataset('formatVersion', data=SNIRF_FORMAT_VERSION, dtype=h5py.string_dtype())
+        nirs = f.create_group('nirs')
+
+        tags = nirs.create_group('metaDataTags')
+        tag_values = {
+            'SubjectID': 'unknown', 'MeasurementDate': 'unknown', 'MeasurementTime': 'unknown',
+            'LengthUnit': 'mm', 'TimeUnit': 's', 'FrequencyUnit': 'Hz',
+            'ProcessingStage': stage, 'ColumnNames': json.dumps(columns),
+            'ReaderMetadata': json.dumps(metadata, default=to_builtin),
+        }
+        for key in _REQUIRED_TAGS:
+            if key in metadata:
+                tag_values[key] = str(metadata[key])
+        for key, value in tag_values.items():
+            tags.create_dataset(key, data=value, dtype=h5py.string_dtype())
+
+        data = nirs.create_group('data1')
+        data.create_dataset('dataTimeSeries', data=values,
+                            chunks=(max(1, min(len(values), CHUNK_SAMPLES)), max(1, len(columns))),
+                            compression='gzip', shuffle=True)
+        # Regularly sampled data: time is stored as [start time, sample spacing]
+        data.create_dataset('time', data=np.array([first_sample / sample_rate, 1.0 / sample_rate]))
+
+        sources = []
+        detectors = []
+        for i, col in enumerate(columns):
+            source, detector = _source_detector(col, i)
+            sources.append(source)
+            detectors.append(detector)
+            ml = data.create_group(f'measurementList{i + 1}')
+            ml.create_dataset('sourceIndex', data=source, dtype='int32')
+            ml.create_dataset('detectorIndex', data=detector, dtype='int32')
+            ml.create_dataset('wavelengthIndex', data=1, dtype='int32')
+            ml.create_dataset('dataType', data=PROCESSED_DATA_TYPE, dtype='int32')
+            ml.create_dataset('dataTypeLabel', data=_data_type_label(col), dtype=h5py.string_dtype())
+            ml.create_dataset('dataTypeIndex', data=1, dtype='int32')
+
+        probe = nirs.create_group('probe')
+        probe.create_dataset('wavelengths', data=np.array(DEFAULT_WAVELENGTHS))
+        probe.create_dataset('sourcePos2D', data=np.zeros((max(sources, default=0), 2)))
+        probe.create_dataset('detectorPos2D', data=np.zeros((max(detectors, default=0), 2)))
+
+        if 'Event' in df.columns:
+            events = df['Event']
+            rows = np.flatnonzero(events.notna().to_numpy())
+            labels = events.iloc[rows].astype(str).to_numpy()
+            for i, label in enumerate(pd.unique(labels)):
+                onsets = (first_sample + rows[labels == label]) / sample_rate
+                stim = nirs.create_group(f'stim{i + 1}')
+                stim.create_dataset('name', data=label, dtype=h5py.string_dtype())
+                stim.create_dataset('data', data=np.column_stack(
+                    [onsets, np.zeros_like(onsets), np.ones_like(onsets)]))
+
+
+def read_snirf(file_path: str, start: int = None, stop: int = None) -> dict:
+    """
+    Read a SNIRF file, or the rows start:stop of it.
+
+    Only the chunks overlapping the requested rows are read from disk.
+
+    Returns:
+    - Dictionary of metadata and data in the same layout as read_txt_file/read_mat
+    """
+    import h5py
+
+    with h5py.File(file_path, 'r') as f:
+        nirs = f['nirs']
+        data = nirs['data1']
+        series = data['dataTimeSeries']
+        first, last, _ = slice(start, stop).indices(series.shape[0])
+        values = series[first:last]
+
+        t0, sample_rate = _time_base(data['time'][()], series.shape[0])
+
+        tags = {key: _read_string(nirs['metaDataTags'][key]) for key in nirs['metaDataTags']}
+        if 'ColumnNames' in tags:
+            columns = json.loads(tags['ColumnNames'])
+        else:
+            columns = []
+            for i in range(series.shape[1]):
+                ml = data[f'measurementList{i + 1}']
+                label = _read_string(ml['dataTypeLabel']) if 'dataTypeLabel' in ml else str(i + 1)
+                columns.append(f"S{int(ml['sourceIndex'][()])}-D{int(ml['detectorIndex'][()])} {label}")
+
+        df = pd.DataFrame(values, columns=columns)
+        first_sample = int(round(t0 * sample_rate))
+        df.insert(0, 'Sample number', np.arange(first_sample + first, first_sample + last))
+
+        # Place the stim onsets that fall inside the window
+        events = pd.Series(np.nan, index=df.index, dtype=object)
+        for key in nirs:
+            if not key.startswith('stim'):
+                continue
+            name = _read_string(nirs[key]['name'])
+            onsets = np.atleast_2d(nirs[key]['data'][()])[:, 0]
+            rows = np.rint((onsets - t0) * sample_rate).astype(int) - first
+            events.iloc[rows[(rows >= 0) & (rows < len(df))]] = name
+        df['Event'] = events
+
+    metadata = json.loads(tags.get('ReaderMetadata', '{}'))
+    metadata['Datafile sample rate'] = sample_rate
+    metadata['Processing stage'] = tags.get('ProcessingStage', 'unknown')
+    metadata['Export file'] = file_path
+    return {'metadata': metadata, 'data': df}
+
+
+def read_snirf_time_window(file_path: str, t_start: float, t_stop: float) -> dict:
+    """
+    Read the samples between t_start and t_stop seconds from the start of a SNIRF file.
+    """
+    import h5py
+
+    with h5py.File(file_path, 'r') as f:
+        data = f['nirs']['data1']
+        _, sample_rate = _time_base(data['time'][()], data['dataTimeSeries'].shape[0])
+    return read_snirf(file_path, int(t_start * sample_rate), int(t_stop * sample_rate))
+
+
+def _time_base(time: np.ndarray, n_samples: int) -> tuple:
+    # 'time' is either [start time, sample spacing] or the full time vector
+    if len(time) == 2 and n_samples != 2:
+        return float(time[0]), 1.0 / float(time[1])
+    return float(time[0]), 1.0 / float(time[1] - time[0])
+
+
+def _source_detector(column: str, position: int) -> tuple:
+    # 'Rx1-Tx3 O2Hb' -> source 3, detector 1; 'CH4 HbO' -> source 4, detector 4
+    match = re.search(r'Rx(\d+)\s*-\s*Tx(\d+)', column)
+    if match:
+        return int(match.group(2)), int(match.group(1))
+    match = re.search(r'CH(\d+)', column)
+    if match:
+        return int(match.group(1)), int(match.group(1))
+    return position + 1, position + 1
+
+
+def _data_type_label(column: str) -> str:
+    if 'HHb' in column or 'HbR' in column or 'deoxy' in column:
+        return 'HbR'
+    if 'O2Hb' in column or 'HbO' in column or 'oxy' in column:
+        return 'HbO'
+    return 'unknown'
+
+
+def _read_string(dataset) -> str:
+    value = dataset[()]
+    if isinstance(value, np.ndarray):
+        value = value.flat[0]
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
@@ -2,8 +2,14 @@
 import pandas as pd
 import numpy as np
 
+from processing.precision import ACCUMULATOR, signal_dtype
 
-def ssc_regression(long_data: pd.DataFrame, short_data: pd.DataFrame):
+# 'reference' regresses channel by channel, 'vectorized' fits all long
+# channels with one matrix product
+ENGINES = ('reference', 'vectorized')
+
+
+def ssc_regression(long_data: pd.DataFrame, short_data: pd.DataFrame, engine: str = 'reference'):
     """
     Apply short channel correction technique to remove the superficial
     component of the probed tissue.
@@ -11,17 +17,31 @@ def ssc_regression(long_data: pd.DataFrame, short_data: pd.DataFrame):
     Parameters:
     - long_data: DataFrame containing fNIRS data for the long channels
     - short_data: DataFrame containing fNIRS data for the short reference channels
+    - engine: Implementation to use, one of ENGINES
 
     Returns:
-    - DataFrame of corrected long channels
+    - DataFrame of corrected long channels, in the float type of long_data
+
+    The regression dot products are accumulated in float64 also for float32 data.
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown short channel regression engine: {engine}, expected one of {ENGINES}")
     long_data_corrected = long_data.copy()
     short_mean = short_data.mean(axis=1)  # Calculate the mean across short channels
 
+    if engine == 'vectorized':
+        dtype = signal_dtype(long_data)
+        X = short_mean.to_numpy(dtype=ACCUMULATOR)
+        Y = long_data.to_numpy(dtype=ACCUMULATOR)
+        beta = (X @ Y) / np.dot(X, X)  # One regression parameter per long channel
+        long_data_corrected[list(long_data.columns)] = (Y - np.outer(X, beta)).astype(dtype, copy=False)
+        return long_data_corrected
+
+    X_acc = short_mean.to_numpy(dtype=ACCUMULATOR)
     for col in long_data.columns:
         Y = long_data[col]
         X = short_mean
-        beta = np.dot(X, Y) / np.dot(X, X)  # Linear regression parameter
-        long_data_corrected[col] = Y - beta * X  # Subtract regression fit
+        beta = np.dot(X_acc, Y.to_numpy(dtype=ACCUMULATOR)) / np.dot(X_acc, X_acc)  # Linear regression parameter
+        long_data_corrected[col] = Y - float(beta) * X  # Subtract regression fit
 
     return long_data_corrected
@@ -0,0 +1,174 @@
+import json
+import time
+import socket
+import threading
+
+import numpy as np
+
+from processing.readers import read_recording
+from processing.resample import get_sample_rate, resample_recording
+
+# A stream starts with one JSON header line {"channels": [...], "sample_rate": ...}
+# followed by fixed-size little-endian frames, see frame_dtype()
+HEADER_LIMIT = 1 << 16
+
+
+def frame_dtype(n_channels: int) -> np.dtype:
+    """
+    Record layout of one streamed sample: its sample index, the time it was
+    acquired in seconds since the epoch, and one float64 value per channel.
+    """
+    return np.dtype([('sample', '<u8'), ('time', '<f8'), ('values', '<f8', (n_channels,))])
+
+
+def channel_names(n_columns: int) -> list:
+    """
+    Names of the channel columns of an Oxysoft export, HbO and HbR
+    alternating as in the baseline-corrected pipeline.
+    """
+    return [f'CH{i + 1} {kind}' for i in range(n_columns // 2) for kind in ('HbO', 'HbR')]
+
+
+class ReplaySimulator:
+    """
+    Stand-in for the acquisition software: serves an exported recording over
+    TCP, one frame per sample at the sampling rate, as if it were being
+    recorded. Each frame is stamped with the time it is sent.
+
+    One client is served at a time. The recording is replayed from the start
+    for every client, and repeated while the client stays connected when
+    loop is True.
+    """
+
+    def __init__(self, file_path: str, host: str = '127.0.0.1', port: int = 0, sample_rate: int = 50,
+                 loop: bool = False, speed: float = 1.0):
+        recording = read_recording(file_path)
+        df = resample_recording(recording['data'], get_sample_rate(recording['metadata'], default=sample_rate),
+                                sample_rate)
+        data_columns = [col for col in df.columns if col not in ['Sample number', 'Event']]
+        self.values = df[data_columns].to_numpy(dtype='float64')
+        self.channels = channel_names(len(data_columns))
+        self.values = self.values[:, :len(self.channels)]
+        self.sample_rate = sample_rate
+        self.loop = loop
+        self.speed = speed
+        self._server = socket.create_server((host, port))
+        self.address = self._server.getsockname()[:2]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Serve clients on a background thread.
+
+        Returns:
+        - (host, port) the simulator listens on
+        """
+        self._thread = threading.Thread(target=self.serve, name='replay-simulator', daemon=True)
+        self._thread.start()
+        return self.address
+
+    def serve(self):
+        """
+        Serve clients until close() is called.
+        """
+        self._server.settimeout(0.2)
+        while not self._stop.is_set():
+            try:
+                client, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            with client:
+                try:
+                    self._replay(client)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    def close(self):
+        self._stop.set()
+        self._server.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _replay(self, client):
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        header = {'channels': self.channels, 'sample_rate': self.sample_rate}
+        client.sendall(json.dumps(header).encode('utf-8') + b'\n')
+        frame = np.zeros(1, dtype=frame_dtype(len(self.channels)))
+        interval = 1.0 / (self.sample_rate * self.speed)
+        sample = 0
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            for values in self.values:
+                # Paced against the start time so that delays do not accumulate
+                delay = start + sample * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if self._stop.is_set():
+                    return
+                frame['sample'] = sample
+                frame['time'] = time.time()
+                frame['values'] = values
+                client.sendall(frame.tobytes())
+                sample += 1
+            if not self.loop:
+                return
+
+
+class SocketSource:
+    """
+    Receives a stream of sample frames from a TCP source, e.g. a
+    ReplaySimulator or a bridge from the acquisition software.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 10.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock.settimeout(None)
+        pending = b''
+        while b'\n' not in pending:
+            chunk = self._sock.recv(4096)
+            if not chunk or len(pending) > HEADER_LIMIT:
+                raise ConnectionError(f"No stream header received from {host}:{port}")
+            pending += chunk
+        header, self._pending = pending.split(b'\n', 1)
+        header = json.loads(header)
+        self.channels = header['channels']
+        self.sample_rate = header['sample_rate']
+        self.dtype = frame_dtype(len(self.channels))
+
+    def batches(self):
+        """
+        Yield the frames as they arrive, as (sample indices, acquisition
+        times, values of shape samples x channels) of every complete frame
+        received at once. Ends when the source closes the connection.
+        """
+        itemsize = self.dtype.itemsize
+        pending = self._pending
+        while True:
+            n = len(pending) // itemsize
+            if n:
+                frames = np.frombuffer(pending, dtype=self.dtype, count=n)
+                pending = pending[n * itemsize:]
+                yield frames['sample'], frames['time'], frames['values']
+            chunk = self._sock.recv(1 << 16)
+            if not chunk:
+                return
+            pending += chunk
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
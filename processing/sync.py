@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from processing.manifest import file_fingerprint
+
+
+def sync_files(pairs, max_workers: int = 8, checksum: bool = False, mtime_tolerance: float = 2.0) -> dict:
+    """
+    Copy source files to their destinations, skipping files that are already
+    up to date.
+
+    A destination is up to date when its size and mtime match the source (the
+    mtime within mtime_tolerance seconds, since network shares often store
+    coarse timestamps), or, with checksum=True, when size and SHA-1 match.
+    The remaining files are copied concurrently through a bounded thread pool.
+    Each copy is written to a temporary file next to the destination and
+    renamed into place, so an interrupted run never leaves a truncated file.
+
+    Parameters:
+    - pairs: Iterable of (source path, destination path)
+    - max_workers: Maximum number of concurrent copies
+    - checksum: Compare SHA-1 checksums instead of mtimes
+    - mtime_tolerance: Allowed mtime difference in seconds
+
+    Returns:
+    - Dictionary with the lists 'copied', 'skipped' and 'failed'; failed
+      entries are (source path, error message) tuples
+    """
+    summary = {'copied': [], 'skipped': [], 'failed': []}
+
+    def sync_one(pair):
+        src, dst = pair
+        try:
+            if _is_up_to_date(src, dst, checksum, mtime_tolerance):
+                return 'skipped', src, None
+            _copy_atomic(src, dst)
+            return 'copied', src, None
+        except Exception as e:
+            return 'failed', src, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for status, src, error in executor.map(sync_one, list(pairs)):
+            if status == 'failed':
+                print(f"Failed to copy {src}: {error}")
+                summary['failed'].append((src, error))
+            else:
+                summary[status].append(src)
+
+    print(f"Sync complete: {len(summary['copied'])} copied, {len(summary['skipped'])} skipped, "
+          f"{len(summary['failed'])} failed")
+    return summary
+
+
+def _is_up_to_date(src: str, dst: str, checksum: bool, mtime_tolerance: float) -> bool:
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = os.stat(src)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if checksum:
+        return file_fingerprint(src)['sha1'] == file_fingerprint(dst)['sha1']
+    return abs(src_stat.st_mtime - dst_stat.st_mtime) <= mtime_tolerance
+
+
+def _copy_atomic(src: str, dst: str):
+    dst_dir = os.path.dirname(dst)
+    os.makedirs(dst_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix='.' + os.path.basename(dst) + '.', suffix='.part')
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp_path)
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+from scipy.stats import gamma
+
+# Channel layout of the turning study device, Rx2-Tx7 and Rx2-Tx8 are the short channels
+DEFAULT_LABELS = ['Rx1-Tx1', 'Rx1-Tx2', 'Rx1-Tx3', 'Rx1-Tx4', 'Rx2-Tx5', 'Rx2-Tx6', 'Rx2-Tx7', 'Rx2-Tx8']
+
+
+def channel_labels(n_channels: int) -> list:
+    """
+    Return Oxysoft channel labels, the study layout for 8 channels and four
+    transmitters per receiver otherwise.
+    """
+    if n_channels == len(DEFAULT_LABELS):
+        return list(DEFAULT_LABELS)
+    return [f'Rx{i // 4 + 1}-Tx{i + 1}' for i in range(n_channels)]
+
+
+def canonical_hrf(sample_rate: float, duration: float = 30.0) -> np.ndarray:
+    """
+    Double-gamma haemodynamic response function, peak normalised to 1.
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    hrf = gamma.pdf(t, 6) - gamma.pdf(t, 16) / 6
+    return hrf / hrf.max()
+
+
+def synthetic_recording(duration: float = 170.0, sample_rate: float = 50, n_channels: int = 8,
+                        walk_start: float = 22.0, walk_stop: float = None, hrf_amplitude: float = 0.5,
+                        cardiac_amplitude: float = 0.1, mayer_amplitude: float = 0.2, noise: float = 0.05,
+                        drift: float = 0.3, n_spikes: int = 3, spike_amplitude: float = 3.0,
+                        zero_channels=(), seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a raw fNIRS recording in the layout returned by read_txt_file.
+
+    Every HbO channel is the task response (boxcar from walk_start to
+    walk_stop convolved with a double-gamma HRF) plus cardiac (~1.1 Hz) and
+    Mayer (~0.1 Hz) oscillations, a slow drift, white noise and motion spikes
+    (sharp steps that decay over a few seconds). HbR follows with inverted,
+    smaller responses. Events S1, W1 and S2 mark the start of the quiet
+    stance, the start of walking and the end of walking.
+
+    Parameters:
+    - duration: Length of the recording in seconds
+    - sample_rate: Sampling rate in Hz
+    - n_channels: Number of channels (HbO/HbR pairs)
+    - walk_start, walk_stop: Walking interval in seconds, walk_stop defaults to 12 s before the end
+    - hrf_amplitude, cardiac_amplitude, mayer_amplitude, noise, drift: Signal component amplitudes (uM)
+    - n_spikes, spike_amplitude: Number and amplitude of motion artifacts
+    - zero_channels: 1-based channel numbers whose HbO and HbR are all zeros
+    - seed: Seed for reproducible data
+
+    Returns:
+    - DataFrame with 'Sample number', '<label> O2Hb', '<label> HHb' per channel and 'Event'
+    """
+    rng = np.random.default_rng(seed)
+    n = int(round(duration * sample_rate))
+    t = np.arange(n) / sample_rate
+    if walk_stop is None:
+        walk_stop = duration - 12.0
+
+    task = ((t >= walk_start) & (t < walk_stop)).astype('float64')
+    response = np.convolve(task, canonical_hrf(sample_rate))[:n]
+    response /= max(response.max(), 1e-12)
+
+    # Systemic oscillations are shared across channels with small phase shifts
+    cardiac_rate = 1.1 + 0.05 * rng.standard_normal()
+    mayer_rate = 0.1 + 0.01 * rng.standard_normal()
+
+    columns = {'Sample number': np.arange(n)}
+    for ch, label in enumerate(channel_labels(n_channels), start=1):
+        phase = rng.uniform(0, 2 * np.pi, 2)
+        systemic = (cardiac_amplitude * np.sin(2 * np.pi * cardiac_rate * t + phase[0])
+                    + mayer_amplitude * np.sin(2 * np.pi * mayer_rate * t + phase[1]))
+        slow = drift * np.cumsum(rng.standard_normal(n)) / np.sqrt(n)
+        spikes = np.zeros(n)
+        for start in rng.integers(0, n, n_spikes):
+            decay = np.exp(-np.arange(n - start) / (2.0 * sample_rate))
+            spikes[start:] += spike_amplitude * rng.choice([-1, 1]) * decay
+
+        gain = rng.uniform(0.5, 1.5)
+        hbo = gain * hrf_amplitude * response + systemic + slow + spikes + noise * rng.standard_normal(n)
+        hbr = (-0.3 * gain * hrf_amplitude * response + 0.3 * systemic + 0.5 * slow + 0.5 * spikes
+               + noise * rng.standard_normal(n))
+        if ch in zero_channels:
+            hbo = np.zeros(n)
+            hbr = np.zeros(n)
+        columns[f'{label} O2Hb'] = hbo
+        columns[f'{label} HHb'] = hbr
+
+    df = pd.DataFrame(columns)
+    events = pd.Series(np.nan, index=df.index, dtype=object)
+    for time, marker in [(2.0, 'S1'), (walk_start, 'W1'), (walk_stop, 'S2')]:
+        sample = int(time * sample_rate)
+        if 0 <= sample < n:
+            events.iloc[sample] = marker
+    df['Event'] = events
+    return df
+
+
+def write_oxysoft_txt(file_path: str, recording: pd.DataFrame, sample_rate: float):
+    """
+    Write a recording in the Oxysoft .txt export layout read by read_txt_file.
+    """
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    data_columns = [col for col in recording.columns if col not in ['Sample number', 'Event']]
+    with open(file_path, 'w') as f:
+        f.write(f'OxySoft export of:\t{os.path.splitext(os.path.basename(file_path))[0]}.oxy\n')
+        f.write('Start of measurement:\t2024-01-01 09:00:00\n')
+        f.write('Export date:\t2024-01-01 10:00:00\n')
+        f.write('\n\n\n\n')
+        f.write(f'Datafile sample rate:\t{sample_rate:g}\n')
+        f.write('\n')
+        f.write('1\t(Sample number)\n')
+        for i, col in enumerate(data_columns, start=2):
+            f.write(f'{i}\t{col} (uM)\n')
+        f.write(f'{len(data_columns) + 2}\t(Event)\n')
+        f.write('\n\n\n')
+
+        # Rows with an event marker end with an extra tab, as in Oxysoft exports
+        values = recording[data_columns].to_numpy()
+        samples = recording['Sample number'].to_numpy()
+        events = recording['Event'].to_numpy()
+        lines = []
+        for sample, row, event in zip(samples, values, events):
+            line = f'{sample}\t' + '\t'.join(f'{v:.5f}' for v in row)
+            line += f'\t{event}\t' if isinstance(event, str) else '\t'
+            lines.append(line)
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_artinis_mat(file_path: str, recording: pd.DataFrame, sample_rate: int):
+    """
+    Write a recording in the Artinis .mat export layout read by read_mat.
+    Events are written as pulses on the second ADvalues channel.
+    """
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    labels = [col[:-len(' O2Hb')] for col in recording.columns if col.endswith(' O2Hb')]
+    n = len(recording)
+
+    ad_values = np.zeros((n, 3))
+    for sample in np.flatnonzero(recording['Event'].notna().to_numpy()):
+        ad_values[max(sample - 1, 0):sample + 2, 1] = 1.0
+        ad_values[sample, 1] = 2.0
+
+    label_cells = np.empty((1, len(labels)), dtype=object)
+    for i, label in enumerate(labels):
+        label_cells[0, i] = label
+    nirs_data = {
+        'Fs': int(sample_rate),
+        'label': label_cells,
+        'oxyvals': recording[[f'{label} O2Hb' for label in labels]].to_numpy(),
+        'dxyvals': recording[[f'{label} HHb' for label in labels]].to_numpy(),
+        'ADvalues': ad_values,
+    }
+    sio.savemat(file_path, {'nirs_data': nirs_data})
+
+
+def generate_cohort(root: str, subjects=('OHSU_Turn_501', 'OHSU_Turn_502'), timepoints=('Baseline', 'Pre'),
+                    conditions=('LongWalk_ST', 'LongWalk_DT'), fmt: str = 'txt', seed: int = 0,
+                    **recording_kwargs) -> list:
+    """
+    Write a synthetic study tree root/<subject>/<timepoint>/<subject>_<condition>_converted.<fmt>.
+
+    Returns:
+    - List of the written file paths
+    """
+    sample_rate = recording_kwargs.get('sample_rate', 50)
+    paths = []
+    for i, subject in enumerate(subjects):
+        for j, timepoint in enumerate(timepoints):
+            for k, condition in enumerate(conditions):
+                file_seed = seed + 1000 * i + 10 * j + k
+                recording = synthetic_recording(seed=file_seed, **recording_kwargs)
+                path = os.path.join(root, subject, timepoint, f'{subject}_{condition}_converted.{fmt}')
+                if fmt == 'txt':
+                    write_oxysoft_txt(path, recording, sample_rate)
+                elif fmt == 'mat':
+                    write_artinis_mat(path, recording, sample_rate)
+                else:
+                    raise ValueError(f"Unsupported format: {fmt}")
+                paths.append(path)
+    return paths
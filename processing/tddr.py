@@ -1,39 +1,96 @@
+from functools import lru_cache
+
 import numpy as np
 import pandas as pd
-from scipy.signal import butter, sosfiltfilt
 
-def tddr(data: pd.DataFrame, sample_rate: int) -> pd.DataFrame:
+from processing.precision import ACCUMULATOR, signal_dtype
+
+# 'reference' repairs channel by channel, 'vectorized' repairs all float
+# channels at once with the same fixed 50 reweighting iterations
+ENGINES = ('reference', 'vectorized')
+
+
+def tddr(data: pd.DataFrame, sample_rate: int, engine: str = 'reference') -> pd.DataFrame:
     """
     Apply Temporal Derivative Distribution Repair (TDDR) algorithm to correct for motion artifacts.
 
     Parameters:
     - data: DataFrame containing fNIRS data for long channels
     - sample_rate: Sampling rate of the data in Hz
+    - engine: Implementation to use, one of ENGINES
 
     Returns:
-    - DataFrame with TDDR corrected data
+    - DataFrame with TDDR corrected data, in the float type of the input
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown TDDR engine: {engine}, expected one of {ENGINES}")
     corrected_df = data.copy()
-    for col in corrected_df.columns:
-        if corrected_df[col].dtype == np.float64:
-            corrected_df[col] = _tddr(np.array(corrected_df[col], dtype='float64'), sample_rate)
+    columns = [col for col in corrected_df.columns if pd.api.types.is_float_dtype(corrected_df[col])]
+    if engine == 'vectorized':
+        if columns:
+            dtype = signal_dtype(corrected_df, columns)
+            corrected_df[columns] = _tddr_vectorized(corrected_df[columns].to_numpy(dtype=dtype), sample_rate)
+        return corrected_df
+    for col in columns:
+        corrected_df[col] = _tddr(np.array(corrected_df[col]), sample_rate)
     return corrected_df
 
+@lru_cache(maxsize=None)
+def lowpass_design(sample_rate: float) -> np.ndarray:
+    """
+    Second-order sections of the 0.5 Hz low-pass that splits the signal in
+    TDDR, computed once per sampling rate. The array is shared by every
+    call, so it must not be modified (sosfiltfilt does not accept read-only
+    arrays).
+    """
+    from scipy.signal import butter
+    return butter(N=3, Wn=0.5, output='sos', fs=sample_rate)
+
 def _tddr(signal: np.array, sample_rate: int) -> np.array:
-    # Temporal Derivative Distribution Repair algorithm implementation
-    signal_mean = np.mean(signal)
-    signal -= signal_mean
-    sos = butter(N=3, Wn=0.5, output='sos', fs=sample_rate)
-    signal_low = sosfiltfilt(sos, signal)
+    # Temporal Derivative Distribution Repair algorithm implementation, in the
+    # precision of signal with the mean, weights and cumulative sum in ACCUMULATOR
+    dtype = signal.dtype
+    signal_mean = np.mean(signal, dtype=ACCUMULATOR)
+    signal -= signal_mean.astype(dtype)
+    # scipy.signal is imported on first use so the entry points start quickly
+    from scipy.signal import sosfiltfilt
+    # The recursive low-pass runs in float64, its state accumulates rounding errors
+    sos = lowpass_design(sample_rate)
+    signal_low = sosfiltfilt(sos, signal).astype(dtype, copy=False)
     signal_high = signal - signal_low
     deriv = np.diff(signal_low)
-    w = np.ones(deriv.shape)
+    w = np.ones(deriv.shape, dtype=dtype)
     for _ in range(50):
-        mu = np.sum(w * deriv) / np.sum(w)
+        mu = (np.sum(w * deriv, dtype=ACCUMULATOR) / np.sum(w, dtype=ACCUMULATOR)).astype(dtype)
         dev = np.abs(deriv - mu)
         sigma = 1.4826 * np.median(dev)
         r = dev / (sigma * 4.685)
         w = ((1 - r**2) * (r < 1)) ** 2
     new_deriv = w * (deriv - mu)
-    signal_low_corrected = np.cumsum(np.insert(new_deriv, 0, 0.0))
-    return signal_low_corrected + signal_high + signal_mean
+    signal_low_corrected = np.cumsum(np.insert(new_deriv, 0, 0.0), dtype=ACCUMULATOR)
+    return (signal_low_corrected + signal_high + signal_mean).astype(dtype, copy=False)
+
+def _tddr_vectorized(signals: np.array, sample_rate: int) -> np.array:
+    # _tddr applied to every column of signals (samples x channels), worked
+    # on channel rows so the per-channel medians run over contiguous memory
+    from scipy.signal import sosfiltfilt
+
+    dtype = signals.dtype
+    signals = np.ascontiguousarray(signals.T)
+    signal_mean = np.mean(signals, axis=1, keepdims=True, dtype=ACCUMULATOR)
+    signals = signals - signal_mean.astype(dtype)
+    sos = lowpass_design(sample_rate)
+    signal_low = sosfiltfilt(sos, signals, axis=1).astype(dtype, copy=False)
+    signal_high = signals - signal_low
+    deriv = np.diff(signal_low, axis=1)
+    w = np.ones(deriv.shape, dtype=dtype)
+    for _ in range(50):
+        mu = (np.sum(w * deriv, axis=1, keepdims=True, dtype=ACCUMULATOR)
+              / np.sum(w, axis=1, keepdims=True, dtype=ACCUMULATOR)).astype(dtype)
+        dev = np.abs(deriv - mu)
+        sigma = 1.4826 * np.median(dev, axis=1, keepdims=True)
+        r = dev / (sigma * 4.685)
+        w = ((1 - r**2) * (r < 1)) ** 2
+    new_deriv = w * (deriv - mu)
+    signal_low_corrected = np.cumsum(np.insert(new_deriv, 0, 0.0, axis=1), axis=1, dtype=ACCUMULATOR)
+    return (signal_low_corrected + signal_high + signal_mean).astype(dtype, copy=False).T
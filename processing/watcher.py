@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from processing.catalog import Catalog, DATA_EXTENSIONS
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+
+class DirectoryWatcher:
+    """
+    Reports the data files below a study tree that are new or changed, once
+    they have been completely written.
+
+    With watchdog installed, file system events (inotify on Linux) report
+    files as they are created or modified. Without it, or for trees on
+    network shares that do not deliver events, the tree is polled through
+    its catalog. Either way a catalog refresh runs every rescan_interval
+    seconds to pick up missed events. These refreshes list every directory
+    rather than only those whose mtime changed, since rewriting a file in
+    place (e.g. re-exporting a session) leaves its directory's mtime as it
+    was.
+
+    Exports are written over several seconds, so a file is only reported
+    once its size and mtime are unchanged between two polls and its mtime is
+    at least settle_seconds old. Files still being written are listed by
+    unsettled(). The first poll reports every settled file of the tree, so
+    the caller catches up with sessions exported while it was not running.
+    """
+
+    def __init__(self, root: str, catalog_path: str, exclude=(), formats=None, settle_seconds: float = 30.0,
+                 poll_interval: float = 5.0, rescan_interval: float = 600.0, use_events: bool = True):
+        self.root = os.path.abspath(root)
+        self.catalog_path = catalog_path
+        self.exclude = [os.path.abspath(d) for d in exclude]
+        self.formats = formats
+        self.extensions = tuple('.' + f for f in formats) if formats else DATA_EXTENSIONS
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self._pending = {}
+        self._events = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_rescan = None
+        self._observer = None
+        if use_events and Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_EventHandler(self), self.root, recursive=True)
+            self._observer.start()
+        mode = 'file system events' if self._observer is not None else f'polling every {poll_interval:g} s'
+        print(f"Watching {self.root} ({mode})")
+
+    def close(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def poll(self) -> list:
+        """
+        Return the files that settled since the last poll, in path order.
+        """
+        now = time.time()
+        candidates = set()
+        if self._observer is None or self._last_rescan is None or now - self._last_rescan >= self.rescan_interval:
+            candidates.update(self._rescan())
+            self._last_rescan = now
+        with self._lock:
+            candidates.update(self._events)
+            self._events.clear()
+        for file_path in candidates:
+            self._pending.setdefault(file_path, None)
+
+        ready = []
+        for file_path, previous in list(self._pending.items()):
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                # Removed or renamed before it settled
+                del self._pending[file_path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            self._pending[file_path] = current
+            # Unchanged since it was last seen, or old enough when seen for the first time
+            unchanged = previous is None or previous == current
+            if unchanged and st.st_size > 0 and now - st.st_mtime >= self.settle_seconds:
+                ready.append(file_path)
+                del self._pending[file_path]
+        return sorted(ready)
+
+    def unsettled(self) -> set:
+        """
+        Return the files that are still being written.
+        """
+        return set(self._pending)
+
+    def wait(self):
+        """
+        Sleep until the next poll, or until close() is called.
+
+        Returns:
+        - False once the watcher has been closed
+        """
+        return not self._stop.wait(self.poll_interval)
+
+    def _rescan(self) -> list:
+        # Files that are new or changed since the last scan, every file on the first one
+        query = "SELECT path, size, mtime_ns FROM files WHERE root = ?"
+        with Catalog(self.catalog_path) as catalog:
+            before = {path: (size, mtime_ns) for path, size, mtime_ns in catalog.conn.execute(query, (self.root,))}
+            catalog.refresh(self.root, exclude=self.exclude, verbose=False, full=True)
+            after = {path: (size, mtime_ns) for path, size, mtime_ns in catalog.conn.execute(query, (self.root,))}
+        first = self._last_rescan is None
+        return [path for path, stat in after.items()
+                if path.lower().endswith(self.extensions) and (first or before.get(path) != stat)]
+
+    def _notify(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        if not file_path.lower().endswith(self.extensions):
+            return
+        if any(file_path.startswith(folder + os.sep) for folder in self.exclude):
+            return
+        with self._lock:
+            self._events.add(file_path)
+
+
+class _EventHandler:
+    # watchdog handler: passes created, modified and moved-in files on to the watcher
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def dispatch(self, event):
+        if event.is_directory or event.event_type not in ('created', 'modified', 'moved', 'closed'):
+            return
+        self.watcher._notify(getattr(event, 'dest_path', None) or event.src_path)
+
+
+def warm_up(NIRSsamprate: int = 50):
+    """
+    Import the heavy dependencies of the processing stages and compute their
+    filter designs, so that the first file processed does not pay for them.
+    Run once in the watching process and as the initializer of warm_pool().
+    """
+    import scipy.signal  # noqa: F401
+    import scipy.stats  # noqa: F401
+    import scipy.integrate  # noqa: F401
+    import scipy.interpolate  # noqa: F401
+    import matplotlib.figure  # noqa: F401
+    import matplotlib.backends.backend_agg  # noqa: F401
+    from processing import process_file_bc, process_file_delta_txt  # noqa: F401
+    from processing.filter import fir_design, BANDPASS_ORDER, BANDPASS_WN
+    from processing.tddr import lowpass_design
+    fir_design(BANDPASS_ORDER, BANDPASS_WN, NIRSsamprate)
+    lowpass_design(NIRSsamprate)
+
+
+def warm_pool(workers: int, NIRSsamprate: int = 50) -> ProcessPoolExecutor:
+    """
+    Start a worker process pool that stays up between batches, with the
+    processing modules and filter designs loaded in every worker.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_up, initargs=(NIRSsamprate,))
+    # Workers are started on demand, start them all now rather than with the first files
+    for future in [executor.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+    return executor
+
+
+def watch(watcher: DirectoryWatcher, process):
+    """
+    Call process(ready files) every time files settle, until interrupted
+    with Ctrl+C or until the watcher is closed.
+    """
+    try:
+        while True:
+            ready = watcher.poll()
+            if ready:
+                print(f"\n{len(ready)} new or changed files: {', '.join(os.path.basename(f) for f in ready[:5])}"
+                      + (', ...' if len(ready) > 5 else ''))
+                process(ready)
+                print(f"Waiting for new files in {watcher.root}")
+            if not watcher.wait():
+                break
+    except KeyboardInterrupt:
+        print("Stopped watching.")
@@ -0,0 +1,56 @@
+import os
+import sys
+import argparse
+import tempfile
+
+from processing.benchmarks import DEFAULT_DURATIONS, run_benchmarks, compare, save_results, load_results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time every processing stage and the full pipelines on synthetic recordings, '
+                    'and compare against a stored baseline.')
+    parser.add_argument('--durations', type=float, nargs='+', default=list(DEFAULT_DURATIONS),
+                        help='Recording durations in seconds')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+    parser.add_argument('--filter', default=None, help='Only run benchmarks whose name contains this text')
+    parser.add_argument('--output', default='benchmark_results.json', help='File for the results of this run')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='Stored baseline to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown reported as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(workdir, durations=args.durations, repeat=args.repeat, name_filter=args.filter)
+    save_results(results, args.output)
+    print(f"Benchmark results saved to {args.output}")
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline found at {args.baseline}, run with --save-baseline to store one.")
+        return
+
+    baseline = load_results(args.baseline)
+    if baseline['environment'] != results['environment']:
+        print("Warning: the baseline was recorded in a different environment:")
+        print(f"  baseline: {baseline['environment']}")
+        print(f"  current:  {results['environment']}")
+
+    regressions = compare(results, baseline, threshold=args.threshold)
+    if not regressions:
+        print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
+        return
+
+    print(f"REGRESSIONS above {args.threshold:.0%} against {args.baseline}:")
+    for key, previous, current, change in regressions:
+        print(f"  {key:45s} {previous * 1000:10.2f} ms -> {current * 1000:10.2f} ms  (+{change:.0%})")
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
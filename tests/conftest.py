@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The entry points and the processing package are imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    """
+    Small synthetic study tree: two subjects, one timepoint, ST and DT walks.
+    """
+    from processing.synthetic import generate_cohort
+
+    root = tmp_path / 'data'
+    paths = generate_cohort(str(root), timepoints=('Baseline',), duration=90.0, sample_rate=10)
+    return str(root), paths
@@ -0,0 +1,60 @@
+import os
+
+from processing.catalog import Catalog, build_catalog, parse_recording_path
+
+
+def test_parse_recording_path(tmp_path):
+    root = str(tmp_path)
+    path = os.path.join(root, 'site', 'OHSU_Turn_507', 'Pre', 'OHSU_Turn_507_LongWalk_DT_converted.txt')
+    assert parse_recording_path(path, root) == {
+        'subject': 'OHSU_Turn_507', 'session': 'Pre', 'condition': 'LongWalk_DT', 'format': 'txt'}
+    assert parse_recording_path(os.path.join(root, 'notes.TXT'), root) == {
+        'subject': None, 'session': None, 'condition': None, 'format': 'txt'}
+
+
+def test_find_by_subject_condition_and_format(cohort, tmp_path):
+    root, paths = cohort
+    (tmp_path / 'data' / 'README.md').write_text('not a recording')
+
+    with build_catalog(root, str(tmp_path / 'catalog.sqlite')) as catalog:
+        assert catalog.find(root=root) == sorted(paths)
+        assert catalog.find(subject='OHSU_Turn_502', condition='LongWalk_ST') == [
+            p for p in paths if 'OHSU_Turn_502' in p and 'LongWalk_ST' in p]
+        assert catalog.find(condition=['LongWalk_ST', 'LongWalk_DT'], fmt='txt') == sorted(paths)
+        assert catalog.find(name_pattern='*_DT_*') == sorted(p for p in paths if '_DT_' in p)
+        record = catalog.get(paths[0])
+        assert record['size'] == os.path.getsize(paths[0])
+        assert record['session'] == 'Baseline'
+
+
+def test_refresh_only_rescans_changed_directories(cohort, tmp_path):
+    root, paths = cohort
+    db_path = str(tmp_path / 'catalog.sqlite')
+    with Catalog(db_path) as catalog:
+        first = catalog.refresh(root, verbose=False)
+        assert first['reused'] == 0
+
+        unchanged = catalog.refresh(root, verbose=False)
+        assert unchanged == {'scanned': 0, 'reused': first['scanned']}
+
+        new_file = os.path.join(root, 'OHSU_Turn_501', 'Baseline', 'OHSU_Turn_501_LongWalk_ST_2.txt')
+        with open(new_file, 'w') as f:
+            f.write('x')
+        os.remove(paths[-1])
+        changed = catalog.refresh(root, verbose=False)
+        assert changed['scanned'] == 2
+        assert catalog.find(root=root) == sorted(paths[:-1] + [new_file])
+
+    # The catalog persists between sessions
+    with Catalog(db_path) as catalog:
+        assert catalog.find(root=root) == sorted(paths[:-1] + [new_file])
+
+
+def test_excluded_folders_are_not_cataloged(cohort, tmp_path):
+    root, paths = cohort
+    output_folder = os.path.join(root, 'processed')
+    os.makedirs(output_folder)
+    with open(os.path.join(output_folder, 'OHSU_Turn_501_LongWalk_ST_stats.txt'), 'w') as f:
+        f.write('x')
+    with build_catalog(root, str(tmp_path / 'catalog.sqlite'), exclude=[output_folder]) as catalog:
+        assert catalog.find(root=root) == sorted(paths)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import coherence
+
+from processing.connectivity import (
+    CONNECTIVITY_COLUMNS, coherence_matrix, correlation_matrix, hemispheric_summary, load_connectivity,
+    save_connectivity, segment_connectivity
+)
+
+SAMPLE_RATE = 10.0
+
+
+def _signals(n=1800, n_channels=5, seed=0):
+    # Channels sharing a slow oscillation in different amounts, plus noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / SAMPLE_RATE
+    shared = np.sin(2 * np.pi * 0.05 * t) + 0.5 * np.sin(2 * np.pi * 0.08 * t + 1.0)
+    mixing = np.linspace(0.2, 1.5, n_channels)
+    return shared[:, None] * mixing + rng.standard_normal((n, n_channels))
+
+
+@pytest.mark.parametrize('nperseg', [300, 600, 900])
+def test_coherence_matches_scipy(nperseg):
+    values = _signals()
+    band = (0.01, 0.1)
+    msc = coherence_matrix(values, SAMPLE_RATE, nperseg, band)
+
+    for i in range(values.shape[1]):
+        for j in range(values.shape[1]):
+            frequencies, expected = coherence(values[:, i], values[:, j], fs=SAMPLE_RATE, window='hann',
+                                              nperseg=nperseg, noverlap=nperseg // 2)
+            in_band = (frequencies >= band[0]) & (frequencies <= band[1])
+            assert msc[i, j] == pytest.approx(expected[in_band].mean(), rel=1e-9, abs=1e-12)
+
+
+def test_coherence_needs_several_windows():
+    values = _signals(n=100)
+    assert np.isnan(coherence_matrix(values, SAMPLE_RATE, 100)).all()
+    # No Welch frequency inside the band
+    assert np.isnan(coherence_matrix(values, SAMPLE_RATE, 20)).all()
+
+
+def test_correlation_matches_numpy():
+    values = _signals()
+    np.testing.assert_allclose(correlation_matrix(values), np.corrcoef(values, rowvar=False), atol=1e-12)
+
+
+def test_segment_connectivity_and_round_trip(tmp_path):
+    values = _signals(n_channels=len(CONNECTIVITY_COLUMNS))
+    full = pd.DataFrame(values, columns=CONNECTIVITY_COLUMNS)
+    # An excluded channel is missing from the second segment
+    segments = {'Overall': full, 'First Half': full.iloc[:900].drop(columns=['CH2 HbO', 'CH2 HbR'])}
+    result = segment_connectivity(segments, SAMPLE_RATE)
+
+    n = len(CONNECTIVITY_COLUMNS)
+    assert result['segments'] == ['Overall', 'First Half']
+    assert result['correlation'].shape == result['coherence'].shape == (2, n, n)
+    missing = CONNECTIVITY_COLUMNS.index('CH2 HbO')
+    assert np.isnan(result['correlation'][1, missing]).all()
+    assert not np.isnan(result['correlation'][0]).any()
+    np.testing.assert_allclose(np.diagonal(result['coherence'][0]), 1.0)
+
+    summary = hemispheric_summary(result)
+    assert list(summary['Segment']) == ['Overall', 'First Half']
+    assert summary[['oxy correlation', 'oxy coherence']].notna().all().all()
+
+    path = str(tmp_path / 'connectivity.npz')
+    save_connectivity(path, result)
+    loaded = load_connectivity(path)
+    assert loaded['segments'] == result['segments']
+    assert loaded['columns'] == result['columns']
+    assert loaded['band'] == result['band']
+    np.testing.assert_allclose(loaded['coherence'], result['coherence'], rtol=1e-6)
@@ -0,0 +1,117 @@
+import os
+
+import pandas as pd
+
+from processing.manifest import Manifest, STATUS_DONE, STATUS_FAILED, PIPELINE_VERSION
+from processing.synthetic import generate_cohort, synthetic_recording, write_oxysoft_txt
+
+PARAMS = {'dtype': 'float64', 'motion': 'tddr'}
+
+
+def _input(tmp_path, name='rec.txt', text='1\t2\t3\n'):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_resume_skips_done_files_and_retries_failed_ones(tmp_path):
+    done = _input(tmp_path, 'done.txt')
+    failed = _input(tmp_path, 'failed.txt')
+    output = tmp_path / 'done_stats.csv'
+    output.write_text('stats')
+
+    manifest = Manifest(str(tmp_path / 'manifest.jsonl'))
+    manifest.record(done, PARAMS, STATUS_DONE, outputs={'stats': str(output), 'mean': 0.5})
+    manifest.record(failed, PARAMS, STATUS_FAILED, error='boom')
+
+    # A new run reads the entries back from disk
+    resumed = Manifest(str(tmp_path / 'manifest.jsonl'))
+    assert not resumed.needs_processing(done, PARAMS)
+    assert resumed.needs_processing(failed, PARAMS)
+    assert resumed.needs_processing(_input(tmp_path, 'new.txt'), PARAMS)
+    assert [e['input'] for e in resumed.completed()] == [done]
+    assert [e['input'] for e in resumed.failed()] == [failed]
+    assert resumed.entries[done]['pipeline_version'] == PIPELINE_VERSION
+
+
+def test_changes_that_require_reprocessing(tmp_path):
+    path = _input(tmp_path)
+    output = tmp_path / 'stats.csv'
+    output.write_text('stats')
+    manifest = Manifest(str(tmp_path / 'manifest.jsonl'))
+    manifest.record(path, PARAMS, STATUS_DONE, outputs={'stats': str(output)})
+    assert not manifest.needs_processing(path, PARAMS)
+
+    assert manifest.needs_processing(path, dict(PARAMS, motion='spline'))
+
+    # Touching the file without changing it keeps the entry valid
+    os.utime(path, ns=(0, 10 ** 18))
+    assert not manifest.needs_processing(path, PARAMS)
+    assert not manifest.is_unchanged(path)
+
+    with open(path, 'a') as f:
+        f.write('4\t5\t6\n')
+    assert manifest.needs_processing(path, PARAMS)
+
+    manifest.record(path, PARAMS, STATUS_DONE, outputs={'stats': str(output)})
+    assert manifest.is_unchanged(path)
+    output.unlink()
+    assert manifest.needs_processing(path, PARAMS)
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    path = _input(tmp_path)
+    manifest_path = tmp_path / 'manifest.jsonl'
+    Manifest(str(manifest_path)).record(path, PARAMS, STATUS_DONE)
+    with open(manifest_path, 'a') as f:
+        f.write('{"input": "other.txt", "fingerpr')
+
+    resumed = Manifest(str(manifest_path))
+    assert list(resumed.entries) == [path]
+    assert not resumed.needs_processing(path, PARAMS)
+
+
+def test_run_resumes_with_changed_files_only(cohort, tmp_path, capsys):
+    import main
+
+    root, paths = cohort
+    output_folder = str(tmp_path / 'out')
+    main.run(root, output_folder, workers=1)
+    assert os.path.isfile(os.path.join(output_folder, 'manifest.jsonl'))
+    capsys.readouterr()
+
+    with open(paths[0], 'a') as f:
+        f.write('\n')
+    main.run(root, output_folder, workers=1)
+    out = capsys.readouterr().out
+    skipped = [line for line in out.splitlines() if line.startswith('Skipping unchanged file')]
+    assert len(skipped) == len(paths) - 1
+    assert paths[0] not in ''.join(skipped)
+
+
+def _ratios(output_folder):
+    df = pd.read_csv(os.path.join(output_folder, 'combined_ratios.csv'))
+    return df.sort_values(['Subject', 'Timepoint']).reset_index(drop=True)
+
+
+def test_incremental_run_after_st_edit_equals_full_run(tmp_path):
+    import main_delta_txt
+
+    root = str(tmp_path / 'data')
+    paths = generate_cohort(root, subjects=('OHSU_Turn_501',), timepoints=('Baseline', 'Pre'),
+                            duration=90.0, sample_rate=10)
+    run_args = dict(make_plots=False, make_report=False)
+    incremental = str(tmp_path / 'incremental')
+    main_delta_txt.run(root, incremental, **run_args)
+
+    # Re-export only the Baseline ST recording
+    baseline_st = [p for p in paths if 'Baseline' in p and 'LongWalk_ST' in p][0]
+    write_oxysoft_txt(baseline_st, synthetic_recording(duration=90.0, sample_rate=10, hrf_amplitude=2.0, seed=99),
+                      10)
+    main_delta_txt.run(root, incremental, **run_args)
+
+    full = str(tmp_path / 'full')
+    main_delta_txt.run(root, full, **run_args)
+    expected = _ratios(full)
+    assert list(expected['Timepoint']) == ['Baseline', 'Pre']
+    pd.testing.assert_frame_equal(_ratios(incremental), expected)
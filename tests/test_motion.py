@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from processing.motion import correct_motion, detect_motion, motion_segments, spline_correct
+
+SAMPLE_RATE = 10.0
+
+
+def _recording(step_at=None, spike_at=None, n=1200, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / SAMPLE_RATE
+    columns = {}
+    for ch in (1, 2):
+        columns[f'CH{ch} HbO'] = 0.2 * np.sin(2 * np.pi * 0.05 * t) + 0.02 * rng.standard_normal(n)
+    df = pd.DataFrame(columns)
+    if step_at is not None:
+        df.loc[step_at:, 'CH1 HbO'] += 3.0
+    if spike_at is not None:
+        df.loc[spike_at:spike_at + 4, 'CH1 HbO'] += 4.0
+    return df
+
+
+def test_clean_recording_is_not_flagged():
+    mask = detect_motion(_recording(), SAMPLE_RATE)
+    assert list(mask.columns) == ['CH1 HbO', 'CH2 HbO']
+    assert not mask.to_numpy().any()
+    assert motion_segments(mask, SAMPLE_RATE).empty
+
+
+def test_step_is_flagged_on_its_channel_only():
+    mask = detect_motion(_recording(step_at=600), SAMPLE_RATE)
+    assert mask.loc[600, 'CH1 HbO']
+    assert not mask['CH2 HbO'].any()
+
+    segments = motion_segments(mask, SAMPLE_RATE)
+    assert list(segments['Channel']) == ['CH1 HbO']
+    start, stop = segments.loc[0, ['Start sample', 'End sample']]
+    assert start <= 600 < stop
+    # The flagged window plus a margin of one second on either side
+    assert stop - start <= 2 * (5 + 10) + 1
+    assert segments.loc[0, 'Start (s)'] == start / SAMPLE_RATE
+
+
+def test_spline_removes_step_and_keeps_clean_channels():
+    clean = _recording()
+    data = _recording(step_at=600)
+    mask = detect_motion(data, SAMPLE_RATE)
+    corrected = spline_correct(data, mask, SAMPLE_RATE)
+
+    pd.testing.assert_series_equal(corrected['CH2 HbO'], data['CH2 HbO'])
+    jump = corrected.loc[620:700, 'CH1 HbO'].mean() - corrected.loc[500:580, 'CH1 HbO'].mean()
+    expected = clean.loc[620:700, 'CH1 HbO'].mean() - clean.loc[500:580, 'CH1 HbO'].mean()
+    # The slow signal inside the flagged segment is lost with the artifact
+    assert abs(jump - expected) < 0.1 * 3.0
+    assert abs(corrected['CH1 HbO'] - clean['CH1 HbO']).iloc[800:].std() < 0.01
+
+
+def test_spline_removes_spike():
+    clean = _recording()
+    data = _recording(spike_at=400)
+    corrected = spline_correct(data, detect_motion(data, SAMPLE_RATE), SAMPLE_RATE)
+    error = corrected['CH1 HbO'] - clean['CH1 HbO']
+    assert error.loc[390:420].abs().max() < 1.0
+    assert (error - error.mean()).abs().max() < 1.0
+
+
+@pytest.mark.parametrize('method', ['tddr', 'spline', 'spline+tddr', 'none'])
+def test_correct_motion_methods(method):
+    data = _recording(step_at=600).astype('float32')
+    corrected, mask = correct_motion(data, SAMPLE_RATE, method=method)
+    assert corrected is not data
+    assert (corrected.dtypes == 'float32').all()
+    assert (mask is not None) == method.startswith('spline')
+    if method == 'none':
+        pd.testing.assert_frame_equal(corrected, data)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        correct_motion(_recording(), SAMPLE_RATE, method='wavelet')
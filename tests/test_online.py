@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from processing.average_channels import ROI_COLUMNS, average_channels, roi_weights
+from processing.online import OnlinePipeline, OnlineSSC, RingBuffer
+from processing.stream_source import channel_names
+
+SAMPLE_RATE = 10.0
+CHANNELS = channel_names(16)
+
+
+def _stream(n=1000, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, len(CHANNELS))).cumsum(axis=0) * 0.01
+
+
+@pytest.mark.parametrize('channels_to_exclude', [None, [2], [4, 5, 6]])
+def test_roi_weights_match_average_channels(channels_to_exclude):
+    values = _stream()
+    df = pd.DataFrame(values, columns=CHANNELS)
+    df.insert(0, 'Sample number', np.arange(len(df)))
+    df['Event'] = np.nan
+
+    expected = average_channels(df, channels_to_exclude)[ROI_COLUMNS]
+    weights = roi_weights(CHANNELS, channels_to_exclude)
+    assert list(weights.index) == CHANNELS
+    np.testing.assert_allclose(values @ weights.to_numpy(), expected.to_numpy(), atol=1e-12)
+
+
+def test_ring_buffer_keeps_the_latest_samples():
+    buffer = RingBuffer(5, 1)
+    assert len(buffer) == 0
+    buffer.extend(np.arange(3.0)[:, None])
+    np.testing.assert_array_equal(buffer.latest()[:, 0], [0, 1, 2])
+
+    # A batch larger than the buffer
+    buffer.extend(np.arange(3.0, 11.0)[:, None])
+    assert buffer.total == 11
+    np.testing.assert_array_equal(buffer.latest()[:, 0], [6, 7, 8, 9, 10])
+    buffer.extend(np.array([[11.0], [12.0]]))
+    np.testing.assert_array_equal(buffer.latest(3)[:, 0], [10, 11, 12])
+
+
+def test_online_ssc_does_not_depend_on_batches():
+    rng = np.random.default_rng(1)
+    long_values = rng.standard_normal((1000, 6))
+    short_values = rng.standard_normal((1000, 2)) + long_values[:, :2]
+
+    def run(batch, half_life_seconds=30.0):
+        ssc = OnlineSSC(SAMPLE_RATE, 6, half_life_seconds)
+        return np.concatenate([ssc(long_values[i:i + batch], short_values[i:i + batch])
+                               for i in range(0, 1000, batch)])
+
+    single = run(1)
+    for batch in (7, 64, 1000):
+        np.testing.assert_allclose(run(batch), single, atol=1e-12)
+    # Blocks of a batch longer than 32 half lives
+    np.testing.assert_allclose(run(1000, 0.5), run(1, 0.5), atol=1e-12)
+
+
+def test_pipeline_updates_do_not_depend_on_batches():
+    values = _stream(600)
+    samples = np.arange(len(values))
+
+    def run(batch):
+        pipeline = OnlinePipeline(CHANNELS, SAMPLE_RATE, buffer_seconds=20, rolling_seconds=5)
+        updates = []
+        pipeline.subscribe(updates.append)
+        for i in range(0, len(values), batch):
+            pipeline.push(samples[i:i + batch], np.full(min(batch, len(values) - i), 0.0), values[i:i + batch])
+        return pipeline, updates
+
+    single, single_updates = run(1)
+    batched, batched_updates = run(25)
+    assert len(single_updates) == len(values)
+    assert len(batched_updates) == len(values) // 25
+    for update in batched_updates:
+        reference = single_updates[update['sample']]
+        for key in ['grand oxy', 'grand deoxy', 'rolling grand oxy', 'rolling grand deoxy']:
+            assert update[key] == pytest.approx(reference[key], abs=1e-9)
+    np.testing.assert_allclose(batched.roi.latest(), single.roi.latest(), atol=1e-9)
+    np.testing.assert_array_equal(batched.raw.latest(), values[-200:])
+
+
+def test_pipeline_without_short_channels_averages_filtered_channels():
+    values = _stream(300)
+    pipeline = OnlinePipeline(CHANNELS, SAMPLE_RATE, channels_to_exclude=[7, 8])
+    assert pipeline.ssc is None
+    update = pipeline.push(np.arange(300), np.zeros(300), values)
+
+    from processing.online import CausalBandpass
+    filtered = CausalBandpass(len(CHANNELS), SAMPLE_RATE)(values)
+    grand = filtered @ roi_weights(CHANNELS, [7, 8]).to_numpy()[:, ROI_COLUMNS.index('grand oxy')]
+    assert update['grand oxy'] == pytest.approx(grand[-1])
+    assert update['sample'] == 299
+    assert update['time'] == pytest.approx(29.9)
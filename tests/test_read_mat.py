@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from processing.read_mat import read_mat, read_mat_v73
+from processing.readers import detect_format, read_recording
+from processing.synthetic import synthetic_recording, write_artinis_mat
+
+h5py = pytest.importorskip('h5py')
+
+
+def write_mat_v73(file_path, recording: pd.DataFrame, sample_rate: float):
+    """
+    Write a recording in the Artinis export layout as MATLAB -v7.3 saves it:
+    HDF5 behind a 512 byte text header, arrays transposed and the label cell
+    array as references to uint16 character arrays.
+    """
+    labels = [col[:-len(' O2Hb')] for col in recording.columns if col.endswith(' O2Hb')]
+    ad_values = np.zeros((len(recording), 3))
+    for sample in np.flatnonzero(recording['Event'].notna().to_numpy()):
+        ad_values[max(sample - 1, 0):sample + 2, 1] = 1.0
+        ad_values[sample, 1] = 2.0
+
+    with h5py.File(file_path, 'w', userblock_size=512) as f:
+        refs = f.create_group('#refs#')
+        label_refs = np.empty((len(labels), 1), dtype=h5py.ref_dtype)
+        for i, label in enumerate(labels):
+            chars = refs.create_dataset(f'label{i}', data=np.array([[ord(c)] for c in label], dtype='uint16'))
+            label_refs[i, 0] = chars.ref
+        nirs_data = f.create_group('nirs_data')
+        nirs_data.create_dataset('Fs', data=np.array([[sample_rate]]))
+        nirs_data.create_dataset('label', data=label_refs)
+        nirs_data.create_dataset('oxyvals', data=recording[[f'{label} O2Hb' for label in labels]].to_numpy().T)
+        nirs_data.create_dataset('dxyvals', data=recording[[f'{label} HHb' for label in labels]].to_numpy().T)
+        nirs_data.create_dataset('ADvalues', data=ad_values.T)
+    with open(file_path, 'r+b') as f:
+        f.write(b'MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: Mon Jan  1 10:00:00 2024 HDF5 schema 1.00 .'
+                .ljust(512, b' '))
+
+
+@pytest.fixture
+def recording():
+    return synthetic_recording(duration=30.0, sample_rate=10, walk_start=5.0, walk_stop=20.0, seed=3)
+
+
+def test_v73_matches_v5(recording, tmp_path):
+    v5_path = str(tmp_path / 'rec_v5.mat')
+    v73_path = str(tmp_path / 'rec_v73.mat')
+    write_artinis_mat(v5_path, recording, 10)
+    write_mat_v73(v73_path, recording, 10.0)
+
+    assert detect_format(v73_path).name != detect_format(v5_path).name
+    expected = read_mat(v5_path)
+    result = read_recording(v73_path)
+    pd.testing.assert_frame_equal(result['data'], expected['data'])
+    assert result['metadata']['Datafile sample rate'] == 10.0
+
+
+def test_v73_fractional_sample_rate(recording, tmp_path):
+    path = str(tmp_path / 'rec.mat')
+    write_mat_v73(path, recording, 10.0125)
+    result = read_mat_v73(path, dtype='float32')
+
+    assert result['metadata']['Datafile sample rate'] == 10.0125
+    df = result['data']
+    # The first second is dropped
+    assert df['Sample number'].iloc[0] == 10
+    assert len(df) == len(recording) - 10
+    assert list(df['Event'].dropna()) == ['S1', 'W1', 'S2']
+    assert df.loc[df['Event'] == 'W1', 'Sample number'].item() == 50
+    assert (df.dtypes[[col for col in df.columns if col.endswith(('O2Hb', 'HHb'))]] == 'float32').all()
+    np.testing.assert_allclose(df['Rx1-Tx1 O2Hb'].to_numpy(), recording['Rx1-Tx1 O2Hb'].iloc[10:], rtol=1e-6)
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from processing.read_txt import read_txt_file
+from processing.resample import get_sample_rate, resample_recording
+from processing.synthetic import synthetic_recording, write_oxysoft_txt
+
+
+@pytest.fixture
+def export(tmp_path):
+    recording = synthetic_recording(duration=60.0, sample_rate=10, seed=5)
+    path = str(tmp_path / 'OHSU_Turn_501_LongWalk_ST_converted.txt')
+    write_oxysoft_txt(path, recording, 10.0125)
+    return path, recording
+
+
+@pytest.mark.parametrize('low_memory', [False, True])
+def test_fractional_sample_rate(export, low_memory):
+    path, recording = export
+    result = read_txt_file(path, low_memory=low_memory)
+
+    assert result['metadata']['Datafile sample rate'] == 10.0125
+    df = result['data']
+    # The first second is dropped, rounded to whole samples
+    assert df['Sample number'].iloc[0] == 10
+    assert len(df) == len(recording) - 10
+
+
+def test_readers_agree_and_resample_at_the_true_rate(export):
+    path, _ = export
+    full = read_txt_file(path)
+    low_memory = read_txt_file(path, low_memory=True)
+    assert full['metadata'] == low_memory['metadata']
+    pd.testing.assert_frame_equal(full['data'], low_memory['data'], check_dtype=False)
+
+    fs = get_sample_rate(full['metadata'])
+    resampled = resample_recording(full['data'], fs, 50)
+    assert len(resampled) == pytest.approx(len(full['data']) * 50 / 10.0125, abs=1)
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from processing.resampling_stats import contrast_statistics, paired_differences, subject_means
+
+
+def _stats():
+    rows = []
+    for s, subject in enumerate(['OHSU_Turn_501', 'OHSU_Turn_502', 'OHSU_Turn_503']):
+        for t, timepoint in enumerate(['Baseline', 'Pre', 'Post']):
+            for condition, shift in [('LongWalk_ST', 0.0), ('LongWalk_DT', 1.0 + s)]:
+                rows.append({'Subject': subject, 'Timepoint': timepoint, 'Condition': condition,
+                             'Mean': 10 * t + shift, 'Slope': np.nan if (s, t) == (0, 0) else shift})
+    return pd.DataFrame(rows)
+
+
+def test_subject_means_average_timepoints():
+    differences = paired_differences(_stats(), feature_columns=['Mean', 'Slope'])
+    assert len(differences) == 9
+
+    means = subject_means(differences, ['Mean', 'Slope'])
+    assert list(means['Subject']) == ['OHSU_Turn_501', 'OHSU_Turn_502', 'OHSU_Turn_503']
+    np.testing.assert_allclose(means['Mean'], [1.0, 2.0, 3.0])
+    # Missing values are left out of the mean
+    np.testing.assert_allclose(means['Slope'], [1.0, 2.0, 3.0])
+
+
+def test_contrast_units_are_subjects():
+    differences = paired_differences(_stats(), feature_columns=['Mean', 'Slope'])
+    result = contrast_statistics(subject_means(differences), feature_columns=['Mean', 'Slope'], n_resamples=2000)
+    assert list(result['N']) == [3, 3]
+    np.testing.assert_allclose(result['Mean'], [2.0, 2.0])
+    # Three subjects allow 2 ** 3 sign flips, so p cannot be below 1/8 however many rows they have
+    assert (result['p-value'] >= 0.1).all()
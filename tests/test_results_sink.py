@@ -0,0 +1,77 @@
+import os
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from processing.results_sink import ResultsSink, read_results, SCHEMA_FILE
+
+
+def _rows(subject, condition, **features):
+    return pd.DataFrame([dict(Subject=subject, Timepoint='Baseline', Condition=condition, **features)])
+
+
+def test_rows_of_flushes_with_different_columns(tmp_path):
+    path = str(tmp_path / 'results')
+    flushed = []
+    with ResultsSink(path, flush_rows=1, on_flush=flushed.extend) as sink:
+        sink.append(_rows('501', 'LongWalk_ST', mean_hbo=1.0), 'a.txt', 'a')
+        sink.append(_rows('502', 'LongWalk_DT', mean_hbo=2.0, dt_ratio=0.5), 'b.txt', 'b')
+    assert [payload for _, payload in flushed] == ['a', 'b']
+
+    schema = pq.read_schema(os.path.join(path, SCHEMA_FILE))
+    assert {'mean_hbo', 'dt_ratio', 'Source file'} <= set(schema.names)
+    assert 'Subject' not in schema.names
+
+    df = read_results(path).sort_values('Subject').reset_index(drop=True)
+    assert list(df['Subject']) == ['501', '502']
+    assert pd.isna(df.loc[0, 'dt_ratio']) and df.loc[1, 'dt_ratio'] == 0.5
+    assert list(read_results(path, filters={'Condition': 'LongWalk_DT'})['Source file']) == ['b.txt']
+
+
+def test_reads_the_schema_file_not_the_data_files(tmp_path):
+    path = str(tmp_path / 'results')
+    with ResultsSink(path, flush_rows=1) as sink:
+        sink.append(_rows('501', 'LongWalk_ST', mean_hbo=1.0), 'a.txt')
+    # A column only listed in the schema file is read, as nulls
+    schema = pq.read_schema(os.path.join(path, SCHEMA_FILE))
+    pq.write_metadata(schema.append(schema.field('mean_hbo').with_name('extra')), os.path.join(path, SCHEMA_FILE))
+    df = read_results(path)
+    assert 'extra' in df.columns and df['extra'].isna().all()
+
+
+def test_schema_file_added_to_an_older_dataset(tmp_path):
+    path = str(tmp_path / 'results')
+    with ResultsSink(path, flush_rows=1) as sink:
+        sink.append(_rows('501', 'LongWalk_ST', mean_hbo=1.0), 'a.txt')
+    os.remove(os.path.join(path, SCHEMA_FILE))
+    assert len(read_results(path)) == 1
+
+    with ResultsSink(path, flush_rows=1) as sink:
+        sink.append(_rows('502', 'LongWalk_DT', dt_ratio=0.5), 'b.txt')
+    # Columns of the files written before the schema file are kept in it
+    assert {'mean_hbo', 'dt_ratio'} <= set(pq.read_schema(os.path.join(path, SCHEMA_FILE)).names)
+    assert len(read_results(path)) == 2
+
+
+def test_flushes_on_row_count_or_interval(tmp_path):
+    path = str(tmp_path / 'results')
+    flushed = []
+    with ResultsSink(path, flush_rows=2, flush_seconds=0.5, on_flush=flushed.append) as sink:
+        sink.append(_rows('501', 'LongWalk_ST', mean_hbo=1.0), 'a.txt', 'a')
+        sink.append(_rows('502', 'LongWalk_ST', mean_hbo=2.0), 'b.txt', 'b')
+        # Two rows reach flush_rows: written together
+        deadline = time.monotonic() + 5
+        while not flushed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert flushed == [[('a.txt', 'a'), ('b.txt', 'b')]]
+
+        # A single row waits for the interval rather than being written at once
+        sink.append(_rows('503', 'LongWalk_ST', mean_hbo=3.0), 'c.txt', 'c')
+        time.sleep(0.1)
+        assert len(flushed) == 1
+        deadline = time.monotonic() + 5
+        while len(flushed) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert flushed[1] == [('c.txt', 'c')]
+    assert len(read_results(path)) == 3
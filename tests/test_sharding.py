@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from processing.sharding import parse_shard, shard_files, shard_folder, shard_folders
+
+FILES = [f'/data/OHSU_Turn_5{i // 4:02d}/{"Baseline" if i % 2 else "Pre"}/rec{i}.txt' for i in range(40)]
+SIZES = {f: 1000 + 137 * i % 900 for i, f in enumerate(FILES)}
+
+
+def _size(file_path):
+    return SIZES[file_path]
+
+
+def _subject(file_path):
+    return file_path.split('/')[2]
+
+
+def test_parse_shard():
+    assert parse_shard('3/16') == (3, 16)
+    assert parse_shard(' 0 / 1 ') == (0, 1)
+    for text in ['4/4', '1', '-1/2', 'a/b', '0/0']:
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+
+@pytest.mark.parametrize('count', [1, 3, 7])
+def test_shards_partition_the_files(count):
+    shards = [shard_files(FILES, i, count, size=_size) for i in range(count)]
+    assert sorted(f for shard in shards for f in shard) == sorted(FILES)
+    for shard in shards:
+        # Files keep the input order
+        assert shard == [f for f in FILES if f in shard]
+
+    loads = [sum(SIZES[f] for f in shard) for shard in shards]
+    assert max(loads) - min(loads) <= max(SIZES.values())
+
+
+def test_partition_does_not_depend_on_input_order():
+    reordered = list(reversed(FILES))
+    for i in range(4):
+        assert sorted(shard_files(FILES, i, 4, size=_size)) == sorted(shard_files(reordered, i, 4, size=_size))
+
+
+def test_groups_stay_in_one_shard():
+    for i in range(3):
+        subjects = {_subject(f) for f in shard_files(FILES, i, 3, group=_subject, size=_size)}
+        others = {_subject(f) for j in range(3) if j != i for f in shard_files(FILES, j, 3, group=_subject, size=_size)}
+        assert subjects and not subjects & others
+
+
+def test_shard_folders_require_every_shard(tmp_path):
+    output_folder = str(tmp_path)
+    with pytest.raises(ValueError):
+        shard_folders(output_folder)
+
+    for i in [0, 2]:
+        os.makedirs(shard_folder(output_folder, i, 3))
+    with pytest.raises(ValueError, match=r'\[1\]'):
+        shard_folders(output_folder)
+
+    os.makedirs(shard_folder(output_folder, 1, 3))
+    assert shard_folders(output_folder) == [shard_folder(output_folder, i, 3) for i in range(3)]
+
+    os.makedirs(shard_folder(output_folder, 0, 2))
+    with pytest.raises(ValueError, match='different runs'):
+        shard_folders(output_folder)
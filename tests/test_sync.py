@@ -0,0 +1,68 @@
+import os
+
+from processing.sync import sync_files
+
+
+def _share(tmp_path):
+    share = tmp_path / 'share'
+    local = tmp_path / 'local'
+    pairs = []
+    for i in range(5):
+        src = share / f'sub{i}' / f'file{i}.txt'
+        src.parent.mkdir(parents=True)
+        src.write_text(f'recording {i}\n' * 100)
+        pairs.append((str(src), str(local / f'sub{i}' / f'file{i}.txt')))
+    return pairs
+
+
+def test_copies_then_skips_up_to_date_files(tmp_path):
+    pairs = _share(tmp_path)
+
+    summary = sync_files(pairs, max_workers=3)
+    assert sorted(summary['copied']) == sorted(src for src, _ in pairs)
+    for src, dst in pairs:
+        with open(src) as a, open(dst) as b:
+            assert a.read() == b.read()
+        assert abs(os.stat(src).st_mtime - os.stat(dst).st_mtime) < 1e-3
+
+    summary = sync_files(pairs, max_workers=3)
+    assert summary['copied'] == []
+    assert len(summary['skipped']) == len(pairs)
+
+
+def test_changed_source_is_copied_again(tmp_path):
+    pairs = _share(tmp_path)
+    sync_files(pairs)
+
+    src, dst = pairs[2]
+    with open(src, 'a') as f:
+        f.write('appended\n')
+    summary = sync_files(pairs)
+    assert summary['copied'] == [src]
+    with open(dst) as f:
+        assert f.read().endswith('appended\n')
+
+
+def test_checksum_detects_same_size_edits(tmp_path):
+    pairs = _share(tmp_path)
+    sync_files(pairs)
+
+    # Same size and mtime as the copy, only the content differs
+    src, dst = pairs[0]
+    st = os.stat(src)
+    with open(src, 'r+') as f:
+        f.write('R')
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert sync_files(pairs)['copied'] == []
+    assert sync_files(pairs, checksum=True)['copied'] == [src]
+
+
+def test_failed_copy_leaves_no_partial_file(tmp_path):
+    pairs = _share(tmp_path)
+    missing = (str(tmp_path / 'share' / 'missing.txt'), str(tmp_path / 'local' / 'missing.txt'))
+
+    summary = sync_files(pairs + [missing])
+    assert [src for src, _ in summary['failed']] == [missing[0]]
+    assert len(summary['copied']) == len(pairs)
+    leftovers = [name for _, _, names in os.walk(tmp_path / 'local') for name in names if name.endswith('.part')]
+    assert leftovers == []
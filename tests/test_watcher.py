@@ -0,0 +1,56 @@
+import os
+import time
+
+from processing.watcher import DirectoryWatcher
+
+
+def _age(path, seconds=120):
+    # Backdate a file past the settle time, keeping its directory's mtime as it was
+    folder = os.path.dirname(path)
+    folder_stat = os.stat(folder)
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+    os.utime(folder, ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+
+
+def _watcher(root, tmp_path):
+    return DirectoryWatcher(str(root), str(tmp_path / 'catalog.sqlite'), settle_seconds=30, poll_interval=0.1,
+                            use_events=False)
+
+
+def test_polling_reports_new_and_settled_files(cohort, tmp_path):
+    root, paths = cohort
+    for path in paths:
+        _age(path)
+    with _watcher(root, tmp_path) as watcher:
+        assert watcher.poll() == sorted(paths)
+        assert watcher.poll() == []
+
+        new_file = os.path.join(root, 'OHSU_Turn_503', 'Baseline', 'OHSU_Turn_503_LongWalk_ST_converted.txt')
+        os.makedirs(os.path.dirname(new_file))
+        with open(new_file, 'w') as f:
+            f.write('partial export')
+        # Just written, so not reported until it has settled
+        assert watcher.poll() == []
+        assert watcher.unsettled() == {new_file}
+        # Reported once its size and mtime are the same in two polls
+        _age(new_file)
+        assert watcher.poll() == []
+        assert watcher.poll() == [new_file]
+
+
+def test_polling_sees_files_rewritten_in_place(cohort, tmp_path):
+    root, paths = cohort
+    for path in paths:
+        _age(path)
+    with _watcher(root, tmp_path) as watcher:
+        assert watcher.poll() == sorted(paths)
+
+        # Re-export one session over the existing file: its directory's mtime does not change
+        folder_mtime = os.stat(os.path.dirname(paths[1])).st_mtime_ns
+        with open(paths[1], 'r+') as f:
+            f.write('OxySoft export of:\tre-exported')
+        _age(paths[1], seconds=60)
+        assert os.stat(os.path.dirname(paths[1])).st_mtime_ns == folder_mtime
+        assert watcher.poll() == [paths[1]]
+        assert watcher.poll() == []